@@ -1,4 +1,5 @@
 from .dataset import Dataset
 from .dataset import AuxTables
+from .executor import Executor
 
-__all__ = ['Dataset', 'AuxTables']
+__all__ = ['Dataset', 'AuxTables', 'Executor']
@@ -0,0 +1,66 @@
+import os
+import hashlib
+import numpy as np
+import pandas as pd
+from scipy.sparse import load_npz, save_npz
+
+
+def fingerprint(enc):
+    """
+    Computes a content hash of the encoded dataset (schema, value dictionaries and codes).
+    """
+    h = hashlib.sha1()
+    for attr in enc.attrs:
+        h.update(attr.encode('utf-8'))
+        h.update(u'\x00'.join(enc.get_values(attr)).encode('utf-8'))
+        h.update(np.ascontiguousarray(enc.get_codes(attr)).tobytes())
+    return h.hexdigest()
+
+
+class StatsCache:
+    """
+    On-disk cache for dataset statistics and attribute correlations.
+    Entries live under <cache_dir>/<fingerprint>/ so a change in the data
+    results in a different directory, i.e. stale entries are never read.
+    """
+
+    def __init__(self, cache_dir, enc):
+        self.enc = enc
+        self.fingerprint = fingerprint(enc)
+        self.path = os.path.join(cache_dir, self.fingerprint)
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+        self.attr_to_idx = {attr: idx for idx, attr in enumerate(enc.attrs)}
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def load_single(self, attr):
+        f = self._file('single_%d.npy' % self.attr_to_idx[attr])
+        if os.path.exists(f):
+            return np.load(f)
+        return None
+
+    def save_single(self, attr, counts):
+        np.save(self._file('single_%d.npy' % self.attr_to_idx[attr]), counts)
+
+    def load_pair(self, cond_attr, trg_attr):
+        f = self._file('pair_%d_%d.npz' % (self.attr_to_idx[cond_attr], self.attr_to_idx[trg_attr]))
+        if os.path.exists(f):
+            return load_npz(f).tocsr()
+        return None
+
+    def save_pair(self, cond_attr, trg_attr, m):
+        save_npz(self._file('pair_%d_%d.npz' % (self.attr_to_idx[cond_attr], self.attr_to_idx[trg_attr])), m)
+
+    def load_correlations(self, key='corr'):
+        f = self._file('%s.npz' % key)
+        if os.path.exists(f):
+            data = np.load(f)
+            attrs = [str(attr) for attr in data['attrs']]
+            return pd.DataFrame(data['matrix'], index=attrs, columns=attrs)
+        return None
+
+    def save_correlations(self, corr, key='corr'):
+        attrs = np.array([str(attr) for attr in corr.columns.values])
+        np.savez(self._file('%s.npz' % key), matrix=corr.values, attrs=attrs)
@@ -1,20 +1,15 @@
+import os
 import time
 from enum import Enum
+import numpy as np
 import pandas as pd
 from .dbengine import DBengine
-from .table import Table, Source
-
-
-def dictify(frame):
-    d = {}
-    for row in frame.values:
-        here = d
-        for elem in row[:-2]:
-            if elem not in here:
-                here[elem] = {}
-            here = here[elem]
-        here[row[-2]] = row[-1]
-    return d
+from .executor import Executor
+from .table import Table, Source, normalize_df
+from .encoding import EncodedDataset
+from .stats import StatsEngine
+from .cache import StatsCache, fingerprint
+from .resultcache import ResultCache
 
 
 class AuxTables(Enum):
@@ -31,39 +26,76 @@ class Dataset:
     This class keeps all dataframes and tables for a HC session
     """
 
-    def __init__(self, name, env):
+    def __init__(self, name, env, executor=None):
+        """
+        :param executor: Executor shared by the session. A new one sized from env['threads']
+        is created if none is given.
+        """
         self.id = name
         self.raw_data = None
+        # Batches appended to raw_data that are not concatenated to its dataframe yet
+        self.raw_chunks = []
+        # Dictionary-encoded columnar copy of raw_data
+        self.encoded_data = None
+        # CSR domain of the random variables
+        self.domain = None
         self.repaired_data = None
         self.constraints = None
         self.aux_table = {}
         for tab in AuxTables:
             self.aux_table[tab] = None
+        # on-disk cache of statistics, keyed by the fingerprint of the raw dataset
+        self.cache_dir = env.get('cache_dir', None)
+        self.stats_cache = None
+        self.executor = executor if executor is not None else Executor(env['threads'])
         # start dbengine
+        plan_cache = None
+        result_cache = ResultCache()
+        if self.cache_dir:
+            if not os.path.exists(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            plan_cache = os.path.join(self.cache_dir, 'query_plans.json')
+            result_cache = ResultCache(path=os.path.join(self.cache_dir, 'query_results'))
         self.engine = DBengine(env['db_user'], env['db_pwd'], env['db_name'], env['db_host'], pool_size=env['threads'],
-                               verbose=env['verbose'], timeout=env['timeout'])
+                               verbose=env['verbose'], timeout=env['timeout'], plan_cache=plan_cache,
+                               executor=self.executor, result_cache=result_cache,
+                               lossy_backup=env.get('lossy_backup', False))
         # members to convert (tuple_id, attribute) to cell_id
         self.attr_to_idx = {}
         self.attr_number = 0
         # dataset statistics
         self.stats_ready = False
-        # Total tuples
-        self.total_tuples = 0
-        # Domain stats for single attributes
-        self.single_attr_stats = {}
-        # Domain stats for attribute pairs
-        self.pair_attr_stats = {}
+        self.stats = None
 
     # Fixed to load data from a CSV file at the moment.
-    def load_data(self, name, f_path, f_name, na_values=None):
+    def load_data(self, name, f_path, f_name, na_values=None, chunksize=None):
+        """
+        Loads the raw dataset from a CSV file.
+        :param chunksize: if given, the file is streamed to the database <chunksize> rows at a time
+        and the raw dataframe is only materialized when a later stage asks for it.
+        """
         tic = time.clock()
+        self.raw_chunks = []
         try:
-            self.raw_data = Table(name, Source.FILE, f_path, f_name, na_values)
-            # Add _tid_ column to dataset
-            df = self.raw_data.df
-            df.insert(0,'_tid_', range(0,len(df)))
-            df.fillna('_nan_',inplace=True)
-            self.raw_data.store_to_db(self.engine.engine)
+            if chunksize is None:
+                self.raw_data = Table(name, Source.FILE, f_path, f_name, na_values)
+                # Add _tid_ column to dataset
+                df = self.raw_data.df
+                df.insert(0,'_tid_', range(0,len(df)))
+                # Remember the null cells before they are filled in.
+                null_mask = df[df.columns.values[1:]].isnull().values
+                df.fillna('_nan_',inplace=True)
+                self.raw_data.store_to_db(self.engine.engine)
+                self.encoded_data = EncodedDataset.from_df(df, df.columns.values[1:], null_mask)
+            else:
+                self.encoded_data = None
+                self.raw_data = Table(name, Source.FILE, f_path, f_name, na_values, chunksize=chunksize,
+                                      db_conn=self.engine.engine, on_chunk=self.prepare_chunk)
+                if self.encoded_data is None:
+                    # prepare_chunk was never called: the file holds no tuples.
+                    raise Exception("ERROR while loading table. No tuples found in %s." % f_name)
+                self.encoded_data.finalize()
+            self.engine.invalidate(name, token=fingerprint(self.encoded_data))
             status = 'DONE Loading '+f_name
             for attr in self.raw_data.get_attributes():
                 # Generate index on attribute
@@ -80,6 +112,53 @@ class Dataset:
         load_time = toc - tic
         return status, load_time
 
+    def prepare_chunk(self, chunk):
+        null_mask = chunk[chunk.columns.values[1:]].isnull().values
+        chunk.fillna('_nan_', inplace=True)
+        if self.encoded_data is None:
+            self.encoded_data = EncodedDataset(chunk.columns.values[1:])
+        self.encoded_data.append(chunk, null_mask)
+
+    def append_data(self, df):
+        """
+        Appends a batch of new tuples to the raw dataset, both to the database table
+        and to the encoded store. Existing codes stay valid (see EncodedDataset.extend) and the
+        statistics are updated with the counts of the batch, so the cost scales with the batch.
+        The domain only covers the tuples loaded before: call setup_domain again before repairing.
+        :param df: dataframe with the attributes of the raw dataset
+        :return: np.array with the _tid_ assigned to the new tuples
+        """
+        enc = self.get_encoded_data()
+        df = normalize_df(df.copy())
+        df = df[list(enc.attrs)]
+        start = enc.num_tuples
+        df.insert(0, '_tid_', range(start, start+len(df)))
+        null_mask = df[list(enc.attrs)].isnull().values
+        df.fillna('_nan_', inplace=True)
+        Table(self.raw_data.name, Source.DF, df).store_to_db(self.engine.engine, if_exists='append')
+        self.engine.invalidate(self.raw_data.name, df, append=True)
+        if not (self.raw_data.streamed and self.raw_data.df.empty):
+            # Concatenated to the raw dataframe when it is next requested.
+            self.raw_chunks.append(df)
+        enc.extend(df, null_mask)
+        if self.stats is not None:
+            self.stats.update(start)
+        # The cache is keyed by the fingerprint of the previous version of the data.
+        self.stats_cache = None
+        return np.arange(start, start+len(df))
+
+    def sort_encoding(self):
+        """
+        Restores the sorted order of the codes after appends (see EncodedDataset.sort) and
+        renumbers the statistics. The domain refers to the previous codes and is dropped.
+        """
+        ranks = self.get_encoded_data().sort()
+        if ranks:
+            if self.stats is not None:
+                self.stats.remap(ranks)
+            self.stats_cache = None
+            self.domain = None
+
     def set_constraints(self, constraints):
         self.constraints = constraints
 
@@ -88,6 +167,7 @@ class Dataset:
             self.aux_table[aux_table] = Table(aux_table.name, Source.DF, df)
             if store:
                 self.aux_table[aux_table].store_to_db(self.engine.engine)
+                self.engine.invalidate(aux_table.name, df)
             if index_attrs:
                 self.aux_table[aux_table].create_df_index(index_attrs)
             if store and index_attrs:
@@ -95,6 +175,34 @@ class Dataset:
         except Exception as e:
             raise Exception(' '.join(['For table:',aux_table.name,str(e)]))
 
+    def append_aux_table(self, aux_table, df, new=False, keep=False):
+        """
+        Bulk-writes a chunk of an aux table to the database without keeping it in memory.
+        The first chunk should be passed with new=True to (re)create the table. Indexes
+        should be created once all chunks are stored.
+        :param keep: keep the rows in memory too, appended to the ones already there.
+        """
+        try:
+            prev = None
+            if new or self.aux_table[aux_table] is None:
+                self.aux_table[aux_table] = Table(aux_table.name, Source.DF, df)
+                if_exists = 'replace'
+            else:
+                prev = self.aux_table[aux_table].df
+                self.aux_table[aux_table].df = df
+                if_exists = 'append'
+            table = self.aux_table[aux_table]
+            table.store_to_db(self.engine.engine, if_exists=if_exists)
+            self.engine.invalidate(aux_table.name, df, append=if_exists == 'append')
+            if keep:
+                table.df = df if prev is None else pd.concat([prev, df], ignore_index=True)
+            else:
+                # Only keep the schema in memory.
+                table.df = df.head(0)
+                table.streamed = True
+        except Exception as e:
+            raise Exception(' '.join(['For table:',aux_table.name,str(e)]))
+
     def generate_aux_table_sql(self, aux_table, query, index_attrs=False):
         try:
             self.aux_table[aux_table] = Table(aux_table.name, Source.SQL, query, self.engine)
@@ -106,10 +214,31 @@ class Dataset:
 
     def get_raw_data(self):
         if self.raw_data:
+            if self.raw_data.streamed and self.raw_data.df.empty:
+                self.raw_data.load_from_db(self.engine.engine)
+                self.raw_chunks = []
+            elif self.raw_chunks:
+                self.raw_data.df = pd.concat([self.raw_data.df] + self.raw_chunks, ignore_index=True)
+                self.raw_chunks = []
             return self.raw_data.df
         else:
             raise Exception('ERROR No dataset loaded')
 
+    def get_encoded_data(self):
+        if self.encoded_data:
+            return self.encoded_data
+        else:
+            raise Exception('ERROR No dataset loaded')
+
+    def set_domain(self, domain):
+        self.domain = domain
+
+    def get_domain(self):
+        if self.domain:
+            return self.domain
+        else:
+            raise Exception('ERROR No domain generated')
+
     def get_attributes(self):
         if self.raw_data:
             attrs = self.raw_data.get_attributes()
@@ -123,30 +252,51 @@ class Dataset:
 
         return vid
 
+    def get_cell_ids(self, tids, attrs):
+        """
+        Vectorized get_cell_id.
+        :param tids: array of _tid_
+        :param attrs: array of attribute names, same length as <tids>
+        :return: np.array of cell ids
+        """
+        codes, uniques = pd.factorize(np.asarray(attrs, dtype=object))
+        attr_idx = np.array([self.attr_to_idx[attr] for attr in uniques], dtype=np.int64)
+        return np.asarray(tids, dtype=np.int64)*self.attr_number + attr_idx[codes]
+
+    def get_cells(self, cids):
+        """
+        Inverse of get_cell_ids.
+        :return: dataframe [_tid_, attribute, _cid_] for the cell ids <cids>
+        """
+        cids = np.asarray(cids, dtype=np.int64)
+        idx_to_attr = np.empty(self.attr_number, dtype=object)
+        for attr, idx in self.attr_to_idx.items():
+            idx_to_attr[idx] = attr
+        return pd.DataFrame({'_tid_': cids // self.attr_number,
+                             'attribute': idx_to_attr[cids % self.attr_number],
+                             '_cid_': cids},
+                            columns=['_tid_', 'attribute', '_cid_'])
+
     def get_statistics(self):
+        """
+        :return: StatsEngine with single and pairwise counts of the raw dataset.
+        """
         if not self.stats_ready:
             self.collect_stats()
-        stats = (self.total_tuples, self.single_attr_stats, self.pair_attr_stats)
         self.stats_ready = True
-        return stats
+        return self.stats
+
+    def get_stats_cache(self):
+        """
+        :return: StatsCache for the loaded dataset or None if no cache directory is configured.
+        """
+        if self.cache_dir and self.stats_cache is None:
+            self.stats_cache = StatsCache(self.cache_dir, self.get_encoded_data())
+        return self.stats_cache
 
     def collect_stats(self):
-        self.total_tuples = self.get_raw_data().shape[0]
-        for attr in self.get_attributes():
-            self.single_attr_stats[attr] = self.get_stats_single(attr)
-        for cond_attr in self.get_attributes():
-            self.pair_attr_stats[cond_attr] = {}
-            for trg_attr in self.get_attributes():
-                if trg_attr != cond_attr:
-                    self.pair_attr_stats[cond_attr][trg_attr] = self.get_stats_pair(cond_attr,trg_attr)
-
-    def get_stats_single(self, attr):
-        tmp_df = self.get_raw_data()[[attr]].groupby([attr]).size()
-        return tmp_df
-
-    def get_stats_pair(self, cond_attr, trg_attr):
-        tmp_df = self.get_raw_data()[[cond_attr,trg_attr]].groupby([cond_attr,trg_attr]).size().reset_index(name="count")
-        return tmp_df
+        self.stats = StatsEngine(self.get_encoded_data(), cache=self.get_stats_cache())
+        self.stats.collect()
 
     def get_domain_info(self):
         query = 'SELECT count(_vid_), max(domain_size) FROM %s'%AuxTables.cell_domain.name
@@ -157,12 +307,9 @@ class Dataset:
 
     def get_inferred_values(self):
         tic = time.clock()
-        query = "SELECT t1._tid_, t1.attribute, domain[inferred_assignment + 1] as rv_value " \
-                "FROM " \
-                "(SELECT _tid_, attribute, " \
-                "_vid_, init_value, string_to_array(regexp_replace(domain, \'[{\"\"}]\', \'\', \'gi\'), \'|||\') as domain " \
-                "FROM %s) as t1, %s as t2 " \
-                "WHERE t1._vid_ = t2._vid_"%(AuxTables.cell_domain.name, AuxTables.inf_values_idx.name)
+        query = "SELECT t1._tid_, t1.attribute, t1.rv_val as rv_value " \
+                "FROM %s as t1, %s as t2 " \
+                "WHERE t1._vid_ = t2._vid_ AND t1.val_id = t2.inferred_assignment + 1"%(AuxTables.pos_values.name, AuxTables.inf_values_idx.name)
         try:
             self.generate_aux_table_sql(AuxTables.inf_values_dom, query, index_attrs=['_tid_'])
             self.aux_table[AuxTables.inf_values_dom].create_db_index(self.engine, ['attribute'])
@@ -176,16 +323,19 @@ class Dataset:
     def get_repaired_dataset(self):
         tic = time.clock()
         try:
-            init_records = self.raw_data.df.sort_values(['_tid_']).to_records(index=False)
-            t = self.aux_table[AuxTables.inf_values_dom]
-            repaired_vals = dictify(t.df.reset_index())
-            for tid in repaired_vals:
-                for attr in repaired_vals[tid]:
-                    init_records[tid][attr] = repaired_vals[tid][attr]
-            repaired_df = pd.DataFrame.from_records(init_records)
+            enc = self.get_encoded_data()
+            repaired_df = pd.DataFrame({'_tid_': enc.tids})
+            repaired = self.aux_table[AuxTables.inf_values_dom].df.reset_index()
+            for attr in enc.attrs:
+                values = enc.decode(attr)
+                attr_repairs = repaired[repaired['attribute'] == attr]
+                if not attr_repairs.empty:
+                    values[attr_repairs['_tid_'].values] = attr_repairs['rv_value'].values
+                repaired_df[attr] = values
             name = self.raw_data.name+'_repaired'
             self.repaired_data = Table(name, Source.DF, repaired_df)
             self.repaired_data.store_to_db(self.engine.engine)
+            self.engine.invalidate(name, repaired_df)
             status = "DONE generating repaired dataset"
         except Exception as e:
             status = "ERROR when generating repaired dataset: %s"
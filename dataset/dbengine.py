@@ -1,7 +1,14 @@
 import sqlalchemy as sql
+import pandas as pd
+import os
+import itertools
+import json
+import hashlib
 import time
+import random
 from string import Template
-from multiprocessing import Pool
+from .executor import Executor
+from .resultcache import ResultCache, df_token
 from functools import partial
 import psycopg2
 
@@ -9,57 +16,225 @@ index_template = Template('CREATE INDEX $idx_title ON $table ($attr)')
 drop_table_template = Template('DROP TABLE IF EXISTS $tab_name')
 create_table_template = Template('CREATE TABLE $tab_name AS ($stmt)')
 
+# Connection held by every worker of the DBengine executor. It is opened by the first
+# query run by the worker and reused by all the following ones.
+worker_conn = None
+
+def get_worker_connection(conn_args):
+    """
+    :return: connection of the current worker. It is re-opened if it was closed or lost
+    and rolled back if it was left in a failed transaction.
+    """
+    global worker_conn
+    if worker_conn is not None and not worker_conn.closed:
+        status = worker_conn.get_transaction_status()
+        if status == psycopg2.extensions.TRANSACTION_STATUS_INERROR:
+            worker_conn.rollback()
+            return worker_conn
+        if status != psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+            return worker_conn
+        close_worker_connection()
+    worker_conn = psycopg2.connect(conn_args)
+    return worker_conn
+
+def close_worker_connection():
+    global worker_conn
+    if worker_conn is not None and not worker_conn.closed:
+        try:
+            worker_conn.close()
+        except psycopg2.Error:
+            pass
+    worker_conn = None
+
+def run_on_worker(conn_args, fn):
+    """
+    Runs fn(connection) with the connection of the current worker and rolls back the
+    transaction afterwards so the worker holds no locks or snapshots between queries.
+    If the connection is lost, it is re-opened and fn is retried once.
+    """
+    for attempt in range(2):
+        con = get_worker_connection(conn_args)
+        try:
+            return fn(con)
+        except psycopg2.extensions.QueryCanceledError:
+            raise
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            # Only retry if the error comes from a lost connection.
+            if attempt == 1 or not con.closed:
+                raise
+            close_worker_connection()
+        finally:
+            if not con.closed:
+                con.rollback()
+
+def fetch_query(con, query):
+    cur = con.cursor()
+    cur.execute(query)
+    res = cur.fetchall()
+    cur.close()
+    return res
+
 def execute_query(args, conn_args, verbose):
     query_id = args[0]
     query = args[1]
     if verbose:
         print("Starting to execute query %s with id %s"%(query, query_id))
     tic = time.clock()
-    con = psycopg2.connect(conn_args)
-    cur = con.cursor()
-    cur.execute(query)
-    res = cur.fetchall()
-    con.close()
+    res = run_on_worker(conn_args, partial(fetch_query, query=query))
     toc = time.clock()
     if verbose:
         print('Time to execute query with id %d: %.2f secs' % (query_id, (toc - tic)))
     return res
 
+def explain_cost(cur, query):
+    """
+    :return: total cost estimated by the Postgres planner for <query>
+    """
+    cur.execute("EXPLAIN (FORMAT JSON) %s" % query)
+    plan = cur.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return float(plan[0]['Plan']['Total Cost'])
+
+def fetch_query_w_backup(con, query_id, query, query_backup, choice, verbose, timeout):
+    cur = con.cursor()
+    if not query_backup:
+        choice = 'query'
+    elif choice is None:
+        cost = explain_cost(cur, query)
+        backup_cost = explain_cost(cur, query_backup)
+        choice = 'backup' if backup_cost < cost else 'query'
+        if verbose:
+            print("Estimated cost of query with id %s: %.2f, backup: %.2f. Running %s." % (query_id, cost, backup_cost, choice))
+    timed_out = False
+    start = time.time()
+    if choice == 'query':
+        # The timeout only applies to the current transaction.
+        cur.execute("SET LOCAL statement_timeout to %d;"%timeout)
+        try:
+            cur.execute(query)
+            res = cur.fetchall()
+        except psycopg2.extensions.QueryCanceledError as e:
+            if verbose:
+                 print("Failed to execute query %s with id %s. Timeout reached." % (query, query_id))
+                 print("Starting to execute backup query %s with id %s" % (query_backup, query_id))
+            con.rollback()
+            cur = con.cursor()
+            choice = 'backup'
+            timed_out = True
+            start = time.time()
+    if choice == 'backup':
+        cur.execute(query_backup)
+        res = cur.fetchall()
+    runtime = time.time() - start
+    cur.close()
+    return res, (choice, runtime, timed_out)
+
 def execute_query_w_backup(args, conn_args, verbose, timeout):
+    """
+    Runs either the query or its backup. The variant is the one picked by the QueryPlanner
+    (args[2]) or, if the planner has no preference, the one with the lowest EXPLAIN cost.
+    If the query is run and reaches the statement timeout, the backup query is executed.
+    :return: (result, (variant that produced the result, runtime in seconds, timed out))
+    """
     query_id = args[0]
     query = args[1][0]
     query_backup = args[1][1]
+    choice = args[2] if len(args) > 2 else None
     if verbose:
         print("Starting to execute query %s with id %s"%(query, query_id))
     tic = time.clock()
-    con = psycopg2.connect(conn_args)
-    cur = con.cursor()
-    cur.execute("SET statement_timeout to %d;"%timeout)
-    try:
-        cur.execute(query)
-        res = cur.fetchall()
-    except psycopg2.extensions.QueryCanceledError as e:
-        if verbose:
-             print("Failed to execute query %s with id %s. Timeout reached." % (query, query_id))
-             print("Starting to execute backup query %s with id %s" % (query_backup, query_id))
-        con.close()
-        con = psycopg2.connect(conn_args)
-        cur = con.cursor()
-        cur.execute(query_backup)
-        res = cur.fetchall()
-        if len(res) == 1:
-            print(res)
-        con.close()
+    output = run_on_worker(conn_args, partial(fetch_query_w_backup, query_id=query_id, query=query,
+                                              query_backup=query_backup, choice=choice, verbose=verbose,
+                                              timeout=timeout))
     toc = time.clock()
     if verbose:
         print('Time to execute query with id %d: %.2f secs' % (query_id, (toc - tic)))
-    return res
+    return output
+
+def execute_indexed_query_w_backup(args, conn_args, verbose, timeout):
+    return args[0], execute_query_w_backup(args, conn_args, verbose, timeout)
+
+class QueryPlanner:
+    """
+    Remembers for every (query, backup query) pair the runtime of the variants that were
+    executed. A variant that reached the statement timeout is recorded with an infinite
+    runtime. The records are kept in a JSON file if a path is given.
+
+    Backup queries may not return the same result as their query (e.g. the featurization
+    backups return 1/0 indicators instead of violation counts), so by default the backup
+    only replaces a query that reached the statement timeout: a query that timed out in a
+    previous run directly runs its backup instead of waiting for the timeout again.
+    With <lossy> set, the backup may be picked whenever it is faster, by its recorded runtime
+    or, for new queries, by its EXPLAIN cost.
+    In both cases, the variant that is not the preferred one is run with probability
+    <explore>, so runtimes are learned for both variants and stale records are refreshed.
+    """
+
+    def __init__(self, path=None, lossy=False, explore=0.1, seed=None):
+        self.path = path
+        self.lossy = lossy
+        self.explore = explore
+        self.random = random.Random(seed)
+        self.plans = {}
+        if path and os.path.exists(path):
+            with open(path, 'r') as f:
+                self.plans = json.load(f)
+
+    def key(self, query, backup):
+        text = ' '.join(query.split()) + '\x00' + ' '.join(backup.split())
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    def get_choice(self, query, backup):
+        """
+        :return: 'query', 'backup' or None if the variant should be picked by EXPLAIN cost
+        """
+        if not backup:
+            return 'query'
+        runtimes = self.plans.get(self.key(query, backup), {})
+        if not self.lossy:
+            # Only skip the query if it timed out, and retry it now and then.
+            if runtimes.get('query') == float('inf') and self.random.random() >= self.explore:
+                return 'backup'
+            return 'query'
+        if not runtimes:
+            return None
+        best = min(runtimes, key=lambda variant: runtimes[variant])
+        if self.random.random() < self.explore:
+            return 'backup' if best == 'query' else 'query'
+        return best
+
+    def record(self, query, backup, record):
+        choice, runtime, timed_out = record
+        if not backup:
+            return
+        runtimes = self.plans.setdefault(self.key(query, backup), {})
+        if timed_out:
+            runtimes['query'] = float('inf')
+        runtimes[choice] = runtime
+
+    def save(self):
+        if self.path:
+            with open(self.path, 'w') as f:
+                json.dump(self.plans, f)
 
 class DBengine:
-    def __init__(self, user, pwd, db, host='localhost', port=5432, pool_size=20, verbose=False, timeout=60000):
+    def __init__(self, user, pwd, db, host='localhost', port=5432, pool_size=20, verbose=False, timeout=60000,
+                 plan_cache=None, executor=None, result_cache=None, lossy_backup=False):
+        """
+        :param plan_cache: optional JSON file where the runtimes of the variants of every query
+        with a backup are recorded across runs.
+        :param executor: Executor running the parallel queries. A new one with <pool_size>
+        processes is used if none is given.
+        :param result_cache: ResultCache of the SELECT queries. A memory-only one is used if none is given.
+        :param lossy_backup: allow picking the backup of a query up front when it is faster, even
+        though it may return a different result (see QueryPlanner). Otherwise backups only replace
+        queries that reach the timeout.
+        """
         self.POOL_MAX = pool_size
         self.timeout = timeout
-        self.pool = Pool(self.POOL_MAX)
+        self.planner = QueryPlanner(plan_cache, lossy=lossy_backup)
+        self.cache = result_cache if result_cache is not None else ResultCache()
         self.verbose = verbose
         url = 'postgresql+psycopg2://{}:{}@{}:{}/{}'
         url = url.format(user, pwd, host, port, db)
@@ -67,15 +242,28 @@ class DBengine:
         con = 'dbname={} user={} password={} host={} port={}'
         con = con.format(db, user, pwd, host, port)
         self.conn_args = con
+        # Every worker keeps one connection open for all the queries it runs.
+        self.pool = executor if executor is not None else Executor(self.POOL_MAX)
         self.engine = sql.create_engine(url, client_encoding='utf8', pool_size=pool_size)
+        # used to give unique names to the server-side cursors of stream_query
+        self.cursor_ids = itertools.count()
 
     # Executes queries in parallel.
     def execute_queries(self, queries):
         if self.verbose:
             print('Preparing to execute %d queries.'%len(queries))
         tic = time.clock()
-        # TODO(python3): Modify pool to context manager (with statement)
-        results = self.pool.map(partial(execute_query, conn_args=self.conn_args, verbose=self.verbose), [(idx, q) for idx, q in enumerate(queries)])
+        results = [None]*len(queries)
+        misses = []
+        for idx, q in enumerate(queries):
+            hit, results[idx] = self.cache.get(q)
+            if not hit:
+                misses.append(idx)
+        outputs = self.pool.map(partial(execute_query, conn_args=self.conn_args, verbose=self.verbose),
+                                [(idx, queries[idx]) for idx in misses])
+        for idx, res in zip(misses, outputs):
+            self.cache.put(queries[idx], res)
+            results[idx] = res
         toc = time.clock()
         if self.verbose:
             print('Time to execute %d queries: %.2f secs'%(len(queries),toc-tic))
@@ -83,30 +271,113 @@ class DBengine:
 
     # Executes queries that have backups in parallel. Used in featurization.
     def execute_queries_w_backup(self, queries):
+        results = [None]*len(queries)
+        for idx, res in self.imap_queries_w_backup(queries):
+            results[idx] = res
+        return results
+
+    def imap_queries_w_backup(self, queries):
+        """
+        Executes queries that have backups in parallel.
+        :param queries: list of (query, backup query)
+        :return: generator of (query index, result) in the order the queries complete, so
+        results can be processed while the remaining queries are still running. The queries
+        are submitted when this method is called.
+        """
         if self.verbose:
             print('Preparing to execute %d queries.'%len(queries))
         tic = time.clock()
-        # TODO(python3): Modify pool to context manager (with statement)
-        results = self.pool.map(
-            partial(execute_query_w_backup, conn_args=self.conn_args, verbose=self.verbose, timeout=self.timeout),
-            [(idx, q) for idx, q in enumerate(queries)])
+        hits = []
+        misses = []
+        for idx, q in enumerate(queries):
+            choice = self.planner.get_choice(q[0], q[1])
+            # Results are cached under the variant that produced them, so only the result
+            # of the variant the planner picked (or of either one if it has no preference) is reused.
+            variants = {'query': [q[0]], 'backup': [q[1]], None: [q[0], q[1]]}[choice]
+            for variant in variants:
+                hit, res = self.cache.get(variant)
+                if hit:
+                    hits.append((idx, res))
+                    break
+            else:
+                misses.append((idx, q, choice))
+        outputs = self.pool.imap_unordered(
+            partial(execute_indexed_query_w_backup, conn_args=self.conn_args, verbose=self.verbose,
+                    timeout=self.timeout), misses)
+        return self.collect_queries_w_backup(queries, hits, outputs, tic)
+
+    def collect_queries_w_backup(self, queries, hits, outputs, tic):
+        for idx, res in hits:
+            yield idx, res
+        for idx, (res, record) in outputs:
+            self.planner.record(queries[idx][0], queries[idx][1], record)
+            self.cache.put(queries[idx][0] if record[0] == 'query' else queries[idx][1], res)
+            yield idx, res
+        self.planner.save()
         toc = time.clock()
         if self.verbose:
             print('Time to execute %d queries: %.2f secs'%(len(queries),toc-tic))
-        return results
 
     # Executes a single query using current connection.
     def execute_query(self, query):
         tic = time.clock()
-        conn = self.engine.connect()
-        result = conn.execute(query).fetchall()
-        conn.close()
+        hit, result = self.cache.get(query)
+        if not hit:
+            conn = self.engine.connect()
+            result = conn.execute(query).fetchall()
+            conn.close()
+            self.cache.put(query, result)
         toc = time.clock()
         if self.verbose:
             exec_time = toc-tic
             print('Time to execute query: %.2f secs' % exec_time)
         return result
 
+    def stream_query(self, query, batch_size=100000):
+        """
+        Executes a query with a named (server-side) cursor so that its result is transferred
+        and consumed in batches instead of being materialized at once.
+        Results of up to max_rows rows (see ResultCache) are kept, batch by batch, and cached
+        once the whole result was consumed.
+        :param batch_size: number of rows per batch
+        :return: generator of DataFrames with at most <batch_size> rows and the columns of the query
+        """
+        tic = time.clock()
+        hit, result = self.cache.get(query, stream=True)
+        if hit:
+            columns, rows = result
+            for start in range(0, len(rows), batch_size):
+                yield pd.DataFrame.from_records(rows[start:start+batch_size], columns=columns)
+            return
+        conn = self.engine.raw_connection()
+        try:
+            cur = conn.connection.cursor(name='stream_%d' % next(self.cursor_ids))
+            cur.itersize = batch_size
+            cur.execute(query)
+            columns = None
+            # rows kept for the cache, None once there are too many of them
+            cached = []
+            while True:
+                rows = cur.fetchmany(batch_size)
+                if columns is None:
+                    columns = [desc[0] for desc in cur.description]
+                if not rows:
+                    break
+                if cached is not None:
+                    cached.extend(rows)
+                    if len(cached) > self.cache.max_rows:
+                        cached = None
+                yield pd.DataFrame.from_records(rows, columns=columns)
+            cur.close()
+            if cached is not None:
+                self.cache.put(query, cached, columns=columns)
+        finally:
+            conn.rollback()
+            conn.close()
+        toc = time.clock()
+        if self.verbose:
+            print('Time to stream query: %.2f secs' % (toc-tic))
+
     def create_db_table_from_query(self, name, query):
         tic = time.clock()
         drop = drop_table_template.substitute(tab_name=name)
@@ -115,12 +386,30 @@ class DBengine:
         dropped = conn.execute(drop)
         created = conn.execute(create)
         conn.close()
+        self.cache.set_version(name, self.cache.query_token(query))
         toc = time.clock()
         if self.verbose:
             exec_time = toc-tic
             print('Time to create table: %.2f secs' % exec_time)
         return True
 
+    def invalidate(self, table, df=None, append=False, token=None):
+        """
+        Updates the version stamp of a table after its content was written, which invalidates
+        the cached results of the queries over it.
+        :param df: the rows written to the table or None if unknown
+        :param append: True if <df> was appended to the table instead of replacing it
+        :param token: content hash of the whole table, used instead of hashing <df>
+        """
+        if token is not None:
+            self.cache.set_version(table, token)
+        elif df is None:
+            self.cache.set_version(table)
+        elif append:
+            self.cache.update_version(table, df_token(df))
+        else:
+            self.cache.set_version(table, df_token(df))
+
     def create_db_index(self, name, table, attr_list):
         stmt = index_template.substitute(idx_title=name, table=table, attr=','.join(attr_list))
         tic = time.clock()
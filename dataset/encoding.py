@@ -0,0 +1,240 @@
+import numpy as np
+import pandas as pd
+
+
+def grow(buf, size, values):
+    """
+    Writes <values> at buf[size:] and returns the buffer, reallocated with twice the capacity
+    if it is full, so that appending is amortized O(len(values)).
+    """
+    end = size + len(values)
+    if end > len(buf):
+        new = np.empty(max(end, 2*len(buf)), dtype=buf.dtype)
+        new[:size] = buf[:size]
+        buf = new
+    buf[size:end] = values
+    return buf
+
+
+class EncodedRow:
+    """
+    Read-only view of a single tuple of the encoded dataset that decodes values on access.
+    """
+
+    def __init__(self, enc, tid):
+        self.enc = enc
+        self.tid = tid
+
+    def __getitem__(self, attr):
+        if attr == '_tid_':
+            return self.tid
+        return self.enc.get_value(attr, self.tid)
+
+
+class EncodedDataset:
+    """
+    Columnar, dictionary-encoded copy of the raw dataset shared by all stages.
+    Every attribute is kept as an array of integer codes (one per tuple, in _tid_ order)
+    plus the array of distinct values the codes refer to. Once finalized, codes follow
+    the sorted order of the values, i.e. they are identical to pandas category codes.
+    Tuples added with extend() keep the existing codes valid, and new values get codes after
+    the existing ones until sort() restores the order.
+    """
+
+    def __init__(self, attrs):
+        self.attrs = list(attrs)
+        self.num_tuples = 0
+        self.tids = np.zeros(0, dtype=np.int64)
+        # attr -> np.array of int32 codes
+        self.codes = {}
+        # attr -> np.array of distinct values
+        self.values = {}
+        # attr -> {value: code}
+        self.value_to_code = {}
+        # Sparse list of the cells that were null in the raw data (before fillna):
+        # cell i is (null_tids[i], attrs[null_attr_idx[i]]).
+        self.null_tids = np.zeros(0, dtype=np.int64)
+        self.null_attr_idx = np.zeros(0, dtype=np.int64)
+        self._tid_chunks = []
+        self._null_chunks = []
+        self._code_chunks = {}
+        for attr in self.attrs:
+            self.value_to_code[attr] = {}
+            self._code_chunks[attr] = []
+        self.finalized = False
+        # Codes follow the sorted order of the values.
+        self.sorted = True
+        # Arrays above are views of these buffers, which have room for extend().
+        self._buffers = {}
+
+    @classmethod
+    def from_df(cls, df, attrs, null_mask=None):
+        enc = cls(attrs)
+        enc.append(df, null_mask)
+        enc.finalize()
+        return enc
+
+    def append(self, df, null_mask=None):
+        """
+        Encodes a chunk of the raw dataset. New values are added to the per-attribute dictionaries.
+        :param df: dataframe containing _tid_ and all attributes of the store
+        :param null_mask: boolean array [rows x attrs] of the cells of <df> that were null before
+        they were filled in. Defaults to the null cells of <df>.
+        """
+        tids = df['_tid_'].values.astype(np.int64)
+        if null_mask is None:
+            null_mask = df[self.attrs].isnull().values
+        rows, cols = np.nonzero(np.asarray(null_mask))
+        self._null_chunks.append((tids[rows], cols.astype(np.int64)))
+        self._tid_chunks.append(tids)
+        for attr in self.attrs:
+            inverse, uniques = pd.factorize(df[attr].values)
+            dictionary = self.value_to_code[attr]
+            mapping = np.empty(len(uniques), dtype=np.int32)
+            for idx, val in enumerate(uniques):
+                if val not in dictionary:
+                    dictionary[val] = len(dictionary)
+                mapping[idx] = dictionary[val]
+            self._code_chunks[attr].append(mapping[inverse])
+        self.num_tuples += len(df)
+        self.finalized = False
+
+    def finalize(self):
+        """
+        Concatenates the encoded chunks and re-numbers codes so they follow the order of the values.
+        Codes handed out before are invalid afterwards if new values were appended.
+        """
+        if self._tid_chunks:
+            self.tids = np.concatenate([self.tids] + self._tid_chunks)
+            self._tid_chunks = []
+        if self._null_chunks:
+            self.null_tids = np.concatenate([self.null_tids] + [tids for tids, _ in self._null_chunks])
+            self.null_attr_idx = np.concatenate([self.null_attr_idx] + [idx for _, idx in self._null_chunks])
+            self._null_chunks = []
+        for attr in self.attrs:
+            dictionary = self.value_to_code[attr]
+            values = np.empty(len(dictionary), dtype=object)
+            for val, code in dictionary.items():
+                values[code] = val
+            codes = np.concatenate([self.codes.get(attr, np.zeros(0, dtype=np.int32))] + self._code_chunks[attr])
+            self._code_chunks[attr] = []
+            order = np.argsort(values, kind='mergesort')
+            rank = np.empty(len(order), dtype=np.int32)
+            rank[order] = np.arange(len(order), dtype=np.int32)
+            self.values[attr] = values[order]
+            self.codes[attr] = rank[codes]
+            self.value_to_code[attr] = {val: code for code, val in enumerate(self.values[attr])}
+        self._buffers = {}
+        self.finalized = True
+        self.sorted = True
+
+    def extend(self, df, null_mask=None):
+        """
+        Adds tuples to the finalized store without renumbering: values seen before keep their
+        codes and new values get the next codes, so codes held by other components (statistics,
+        domains) stay valid. The cost is amortized O(len(df)).
+        :param df: dataframe containing _tid_ and all attributes of the store
+        :param null_mask: see append
+        """
+        if not self.finalized:
+            self.finalize()
+        n = self.num_tuples
+        tids = df['_tid_'].values.astype(np.int64)
+        if null_mask is None:
+            null_mask = df[self.attrs].isnull().values
+        rows, cols = np.nonzero(np.asarray(null_mask))
+        num_nulls = len(self.null_tids)
+        self.tids = self._append('_tid_', self.tids, n, tids)
+        self.null_tids = self._append('_null_tids_', self.null_tids, num_nulls, tids[rows])
+        self.null_attr_idx = self._append('_null_attr_idx_', self.null_attr_idx, num_nulls, cols.astype(np.int64))
+        for attr in self.attrs:
+            inverse, uniques = pd.factorize(df[attr].values)
+            dictionary = self.value_to_code[attr]
+            mapping = np.empty(len(uniques), dtype=np.int32)
+            size = len(dictionary)
+            for idx, val in enumerate(uniques):
+                if val not in dictionary:
+                    dictionary[val] = len(dictionary)
+                mapping[idx] = dictionary[val]
+            if len(dictionary) > size:
+                new_values = np.empty(len(dictionary) - size, dtype=object)
+                new_values[mapping[mapping >= size] - size] = uniques[mapping >= size]
+                self.values[attr] = self._append(('values', attr), self.values[attr], size, new_values)
+                self.sorted = False
+            self.codes[attr] = self._append(('codes', attr), self.codes[attr], n, mapping[inverse])
+        self.num_tuples += len(df)
+
+    def _append(self, name, arr, size, values):
+        """
+        :return: view of the first size+len(values) entries of the buffer of <arr> after
+        writing <values> at its end.
+        """
+        buf = grow(self._buffers.get(name, arr), size, values)
+        self._buffers[name] = buf
+        return buf[:size+len(values)]
+
+    def sort(self):
+        """
+        Renumbers the codes of the attributes whose values were extended out of order so they
+        follow the sorted order of the values again.
+        :return: dict attr -> np.array mapping the old codes to the new ones, for every
+        attribute whose codes changed
+        """
+        ranks = {}
+        if self.sorted:
+            return ranks
+        for attr in self.attrs:
+            values = self.values[attr]
+            order = np.argsort(values, kind='mergesort')
+            if np.all(order == np.arange(len(order))):
+                continue
+            rank = np.empty(len(order), dtype=np.int32)
+            rank[order] = np.arange(len(order), dtype=np.int32)
+            self.values[attr] = values[order]
+            self.codes[attr] = rank[self.codes[attr]]
+            self.value_to_code[attr] = {val: code for code, val in enumerate(self.values[attr])}
+            self._buffers.pop(('values', attr), None)
+            self._buffers.pop(('codes', attr), None)
+            ranks[attr] = rank
+        self.sorted = True
+        return ranks
+
+    def get_codes(self, attr):
+        return self.codes[attr]
+
+    def get_values(self, attr):
+        return self.values[attr]
+
+    def domain_size(self, attr):
+        return len(self.values[attr])
+
+    def encode(self, attr, value):
+        """
+        :return: code of <value> in <attr> or -1 if the value does not appear in the dataset.
+        """
+        return self.value_to_code[attr].get(value, -1)
+
+    def decode(self, attr, codes=None):
+        """
+        :return: np.array with the values of <attr> for the given codes (all tuples if codes is None).
+        """
+        if codes is None:
+            codes = self.codes[attr]
+        return self.values[attr][codes]
+
+    def get_value(self, attr, tid):
+        return self.values[attr][self.codes[attr][tid]]
+
+    def get_row(self, tid):
+        return EncodedRow(self, tid)
+
+    def to_df(self, attrs=None):
+        """
+        Decodes the store back to a dataframe with schema [_tid_, attrs...].
+        """
+        if attrs is None:
+            attrs = self.attrs
+        df = pd.DataFrame({'_tid_': self.tids})
+        for attr in attrs:
+            df[attr] = self.decode(attr)
+        return df
@@ -0,0 +1,91 @@
+import os
+import pickle
+import tempfile
+import threading
+import itertools
+from multiprocessing import Pool
+
+# Context of the last job run by this worker with Executor.imap_context: (job id, context).
+worker_context = (None, None)
+
+
+def run_in_context(args):
+    """
+    Runs func(context, item) in a worker. The context of a job is loaded from its file
+    the first time the worker runs one of the job's items.
+    """
+    global worker_context
+    func, job_id, path, item = args
+    if worker_context[0] != job_id:
+        worker_context = (None, None)
+        with open(path, 'rb') as f:
+            worker_context = (job_id, pickle.load(f))
+    return func(worker_context[1], item)
+
+
+class Executor:
+    """
+    Process pool shared by the components of a session (DBengine, domain engine, featurizers).
+    The pool is created when a task is first submitted (or by start()) and is shut down by close().
+    Forking from a thread of a multithreaded process is unsafe, so components that submit tasks
+    from several threads call start() from the main thread first.
+    """
+
+    def __init__(self, processes):
+        self.processes = max(1, processes)
+        self.pool = None
+        self.lock = threading.Lock()
+        self.job_ids = itertools.count()
+
+    def start(self):
+        self.get_pool()
+
+    def get_pool(self):
+        with self.lock:
+            if self.pool is None:
+                self.pool = Pool(self.processes)
+            return self.pool
+
+    def map(self, func, iterable):
+        return self.get_pool().map(func, iterable)
+
+    def imap(self, func, iterable):
+        return self.get_pool().imap(func, iterable)
+
+    def imap_unordered(self, func, iterable):
+        return self.get_pool().imap_unordered(func, iterable)
+
+    def imap_context(self, func, context, iterable):
+        """
+        Runs func(context, item) for every item without sending the (large, read-only) <context>
+        with every task: it is written once to a temporary file that every worker loads once.
+        Workers keep the context of their last job until they run another one.
+        Runs in the calling process if the executor has a single process or there is one item.
+        :param func: module-level function taking (context, item)
+        :return: generator of the results, in the order of the items
+        """
+        items = list(iterable)
+        if self.processes == 1 or len(items) < 2:
+            for item in items:
+                yield func(context, item)
+            return
+        fd, path = tempfile.mkstemp(suffix='.pkl')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(context, f, protocol=pickle.HIGHEST_PROTOCOL)
+            job_id = '%d_%d' % (os.getpid(), next(self.job_ids))
+            for res in self.imap(run_in_context, [(func, job_id, path, item) for item in items]):
+                yield res
+        finally:
+            os.remove(path)
+
+    def close(self):
+        """
+        Waits for the submitted tasks and terminates the workers. The pool is created again
+        if a task is submitted afterwards.
+        """
+        with self.lock:
+            if self.pool is not None:
+                self.pool.close()
+                self.pool.join()
+                self.pool = None
@@ -0,0 +1,243 @@
+import os
+import re
+import uuid
+import pickle
+import hashlib
+from collections import OrderedDict
+
+import pandas as pd
+
+# Clauses that end the list of tables of a FROM clause.
+from_end = re.compile(r'\b(where|group|order|having|limit|offset|union|except|intersect|window|on|using|join|'
+                      r'left|right|inner|outer|full|cross|natural|lateral)\b|[();]')
+table_name = re.compile(r'\s*"?([a-z_][\w$]*)"?(?:\s*\.\s*"?([a-z_][\w$]*)"?)?')
+string_literal = re.compile(r"'(?:[^']|'')*'")
+
+
+def normalize_sql(query):
+    """
+    :return: <query> with collapsed whitespaces and without the trailing semicolon.
+    """
+    return ' '.join(query.split()).rstrip(';').strip()
+
+
+def table_references(query):
+    """
+    :return: set of the (lower-cased, schema-less) names of the tables that follow FROM or
+    JOIN in <query>, including the comma-separated tables of a FROM clause.
+    """
+    query = string_literal.sub("''", query.lower())
+    tables = set()
+    for clause in re.finditer(r'\bfrom\b', query):
+        start = clause.end()
+        end = from_end.search(query, start)
+        for item in query[start:end.start() if end else len(query)].split(','):
+            match = table_name.match(item)
+            if match:
+                tables.add(match.group(2) or match.group(1))
+    for clause in re.finditer(r'\bjoin\b', query):
+        match = table_name.match(query, clause.end())
+        if match:
+            tables.add(match.group(2) or match.group(1))
+    return tables
+
+
+def df_token(df):
+    """
+    :return: content hash of a dataframe.
+    """
+    h = hashlib.sha1()
+    h.update(u'\x00'.join([str(attr) for attr in df.columns.values]).encode('utf-8'))
+    if len(df) > 0:
+        try:
+            hashes = pd.util.hash_pandas_object(df, index=False)
+        except TypeError:
+            # Columns holding lists (e.g. domains) are hashed through their string form.
+            hashes = pd.util.hash_pandas_object(df.astype(str), index=False)
+        h.update(hashes.values.tobytes())
+    return h.hexdigest()
+
+
+def num_rows(result, stream):
+    return len(result[1]) if stream else len(result)
+
+
+class ResultCache:
+    """
+    Cache of query results with a LRU memory tier holding up to <max_rows> rows and an
+    optional disk tier under <path> holding up to <max_disk_bytes> bytes, from which the
+    least recently used results are deleted first.
+    Every table written through the Dataset gets a version stamp derived from its content
+    (or from the query that created it). Results are keyed by the normalized query and the
+    stamps of the tables it references, so rewriting a table makes the cached results of
+    the queries over it unreachable, and identical data in later sessions reuses the disk tier.
+    Only SELECT queries whose referenced tables all have a version stamp are cached.
+    """
+
+    def __init__(self, max_rows=1000000, path=None, max_disk_bytes=1 << 30):
+        self.max_rows = max_rows
+        self.path = path
+        self.max_disk_bytes = max_disk_bytes
+        if path and not os.path.exists(path):
+            os.makedirs(path)
+        self.disk_bytes = sum(size for _, _, size in self.disk_files())
+        # table name -> version stamp
+        self.versions = {}
+        # key -> (referenced tables, result)
+        self.entries = OrderedDict()
+        self.rows = 0
+
+    def set_version(self, table, token=None):
+        """
+        Stamps a table whose content was replaced. A random stamp is used if <token> is None.
+        """
+        table = table.lower()
+        self.versions[table] = token if token is not None else uuid.uuid4().hex
+        self.evict_table(table)
+
+    def update_version(self, table, token):
+        """
+        Stamps a table that had rows appended, from its previous stamp and <token>.
+        """
+        prev = self.versions.get(table.lower(), None)
+        if prev is None:
+            self.set_version(table)
+            return
+        self.set_version(table, hashlib.sha1((prev + token).encode('utf-8')).hexdigest())
+
+    def query_token(self, query):
+        """
+        :return: stamp of a table created from <query>, derived from the query and the stamps
+        of the tables it reads, or None if it reads a table without stamp.
+        """
+        tables = self.get_tables(query)
+        if tables is None:
+            return None
+        text = normalize_sql(query) + u''.join([u'\x00%s:%s' % (t, self.versions[t]) for t in tables])
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    def get_tables(self, query):
+        """
+        :return: sorted tables referenced by <query> or None if one of them has no version stamp,
+        i.e. its content is not tracked.
+        """
+        tables = table_references(query)
+        if any(t not in self.versions for t in tables):
+            return None
+        return sorted(tables)
+
+    def get_key(self, query, stream=False):
+        """
+        :param stream: key of the result of stream_query, which also holds the column names
+        :return: (key, referenced tables) or (None, None) if the query cannot be cached.
+        """
+        query = normalize_sql(query)
+        if not re.match(r'(select|with)\b', query, re.IGNORECASE):
+            return None, None
+        tables = self.get_tables(query)
+        if not tables:
+            return None, None
+        text = query + u''.join([u'\x00%s:%s' % (t, self.versions[t]) for t in tables])
+        if stream:
+            text += u'\x00stream'
+        return hashlib.sha1(text.encode('utf-8')).hexdigest(), tables
+
+    def get(self, query, stream=False):
+        """
+        :return: (True, result) if the result of <query> is cached, (False, None) otherwise.
+        With <stream>, the result is (column names, rows).
+        """
+        key, tables = self.get_key(query, stream)
+        if key is None:
+            return False, None
+        if key in self.entries:
+            entry = self.entries.pop(key)
+            self.entries[key] = entry
+            return True, entry[1]
+        f = self._file(key)
+        if f is not None and os.path.exists(f):
+            try:
+                with open(f, 'rb') as fp:
+                    result = pickle.load(fp)
+                # Mark the file as recently used for the eviction of the disk tier.
+                os.utime(f, None)
+            except (IOError, OSError):
+                # Deleted by the eviction of another session sharing the directory.
+                return False, None
+            self._store(key, tables, result, num_rows(result, stream))
+            return True, result
+        return False, None
+
+    def put(self, query, result, columns=None):
+        """
+        :param columns: column names of a result of stream_query
+        """
+        stream = columns is not None
+        key, tables = self.get_key(query, stream)
+        if key is None:
+            return
+        result = [tuple(row) for row in result]
+        if stream:
+            result = (tuple(columns), result)
+        self._store(key, tables, result, num_rows(result, stream))
+        f = self._file(key)
+        if f is not None:
+            if os.path.exists(f):
+                self.disk_bytes -= os.path.getsize(f)
+            with open(f, 'wb') as fp:
+                pickle.dump(result, fp, protocol=2)
+            self.disk_bytes += os.path.getsize(f)
+            if self.disk_bytes > self.max_disk_bytes:
+                self.evict_disk()
+
+    def disk_files(self):
+        """
+        :return: list of (modification time, file, size) of the results in the disk tier
+        """
+        if not self.path:
+            return []
+        files = []
+        for name in os.listdir(self.path):
+            if name.endswith('.pkl'):
+                f = os.path.join(self.path, name)
+                try:
+                    stat = os.stat(f)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, f, stat.st_size))
+        return files
+
+    def evict_disk(self):
+        """
+        Deletes the least recently used results of the disk tier until it fits in max_disk_bytes.
+        """
+        files = sorted(self.disk_files())
+        self.disk_bytes = sum(size for _, _, size in files)
+        for _, f, size in files:
+            if self.disk_bytes <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(f)
+            except OSError:
+                pass
+            self.disk_bytes -= size
+
+    def evict_table(self, table):
+        for key in [key for key, (tables, _, _) in self.entries.items() if table in tables]:
+            self.rows -= self.entries.pop(key)[2]
+
+    def _store(self, key, tables, result, rows):
+        if key in self.entries:
+            self.rows -= self.entries.pop(key)[2]
+        if rows > self.max_rows:
+            return
+        self.entries[key] = (tables, result, rows)
+        self.rows += rows
+        while self.rows > self.max_rows:
+            _, (_, _, evicted) = self.entries.popitem(last=False)
+            self.rows -= evicted
+
+    def _file(self, key):
+        if not self.path:
+            return None
+        return os.path.join(self.path, '%s.pkl' % key)
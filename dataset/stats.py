@@ -0,0 +1,168 @@
+import numpy as np
+from scipy.sparse import coo_matrix
+
+
+class StatsEngine:
+    """
+    Single attribute and pairwise co-occurrence counts over the encoded dataset.
+    Single counts are dense arrays indexed by value code and pair counts are sparse
+    contingency matrices with one row per value code of the conditioning attribute
+    and one column per value code of the target attribute.
+    """
+
+    def __init__(self, enc, cache=None):
+        """
+        :param cache: optional StatsCache used to reuse counts computed by previous runs.
+        """
+        self.enc = enc
+        self.cache = cache
+        self.total = enc.num_tuples
+        # attr -> np.array of counts indexed by code
+        self.single_stats = {}
+        # (cond_attr, trg_attr) -> scipy.sparse.csr_matrix of counts
+        self.pair_stats = {}
+
+    def collect(self):
+        """
+        Computes single attribute counts. Pair counts are lazy: a pair is only
+        computed (or loaded from the cache) on first access and then memoized.
+        """
+        for attr in self.enc.attrs:
+            self.single_counts(attr)
+
+    def single_counts(self, attr):
+        if attr not in self.single_stats:
+            counts = self.cache.load_single(attr) if self.cache else None
+            if counts is None:
+                counts = np.bincount(self.enc.get_codes(attr), minlength=self.enc.domain_size(attr))
+                if self.cache:
+                    self.cache.save_single(attr, counts)
+            self.single_stats[attr] = counts
+        return self.single_stats[attr]
+
+    def pair_counts(self, cond_attr, trg_attr):
+        if (cond_attr, trg_attr) not in self.pair_stats:
+            if (trg_attr, cond_attr) in self.pair_stats:
+                # Transpose the memoized reverse orientation instead of rescanning the columns.
+                m = self.pair_stats[(trg_attr, cond_attr)].T.tocsr()
+            else:
+                m = self.load_or_compute_pair(cond_attr, trg_attr)
+            self.pair_stats[(cond_attr, trg_attr)] = m
+        return self.pair_stats[(cond_attr, trg_attr)]
+
+    def load_or_compute_pair(self, cond_attr, trg_attr):
+        m = None
+        if self.cache:
+            m = self.cache.load_pair(cond_attr, trg_attr)
+            if m is None:
+                m = self.cache.load_pair(trg_attr, cond_attr)
+                if m is not None:
+                    m = m.T.tocsr()
+        if m is None:
+            m = self.compute_pair(cond_attr, trg_attr)
+            if self.cache:
+                self.cache.save_pair(cond_attr, trg_attr, m)
+        return m
+
+    def compute_pair(self, cond_attr, trg_attr, start=0):
+        """
+        :param start: only count the tuples from this position on
+        """
+        cond_codes = self.enc.get_codes(cond_attr)[start:]
+        trg_codes = self.enc.get_codes(trg_attr)[start:]
+        shape = (self.enc.domain_size(cond_attr), self.enc.domain_size(trg_attr))
+        # Duplicate (row, col) entries are summed when converting to CSR.
+        m = coo_matrix((np.ones(len(cond_codes), dtype=np.int64), (cond_codes, trg_codes)), shape=shape).tocsr()
+        m.sum_duplicates()
+        return m
+
+    def update(self, start):
+        """
+        Adds the counts of the tuples appended to the encoded dataset (with extend) from
+        position <start> on to the memoized counts. The cost depends on the number of new tuples
+        and on the number of distinct values, not on the number of tuples.
+        The counts are not saved to the cache anymore since the data changed.
+        """
+        self.cache = None
+        self.total = self.enc.num_tuples
+        for attr, old in list(self.single_stats.items()):
+            counts = np.bincount(self.enc.get_codes(attr)[start:], minlength=self.enc.domain_size(attr))
+            counts[:len(old)] += old
+            self.single_stats[attr] = counts
+        for (cond_attr, trg_attr), m in list(self.pair_stats.items()):
+            delta = self.compute_pair(cond_attr, trg_attr, start)
+            m = m.tocoo()
+            m = coo_matrix((m.data, (m.row, m.col)), shape=delta.shape).tocsr() + delta
+            m.sort_indices()
+            self.pair_stats[(cond_attr, trg_attr)] = m
+
+    def remap(self, ranks):
+        """
+        Renumbers the memoized counts after the encoded dataset was sorted.
+        :param ranks: dict attr -> np.array mapping old codes to new codes (see EncodedDataset.sort)
+        """
+        for attr, counts in list(self.single_stats.items()):
+            if attr in ranks:
+                new = np.empty_like(counts)
+                new[ranks[attr]] = counts
+                self.single_stats[attr] = new
+        for (cond_attr, trg_attr), m in list(self.pair_stats.items()):
+            if cond_attr not in ranks and trg_attr not in ranks:
+                continue
+            m = m.tocoo()
+            rows = ranks[cond_attr][m.row] if cond_attr in ranks else m.row
+            cols = ranks[trg_attr][m.col] if trg_attr in ranks else m.col
+            m = coo_matrix((m.data, (rows, cols)), shape=m.shape).tocsr()
+            m.sort_indices()
+            self.pair_stats[(cond_attr, trg_attr)] = m
+
+    def count(self, attr, code):
+        """
+        :return: number of tuples with <attr> = <code>.
+        """
+        if code < 0:
+            return 0
+        return int(self.single_counts(attr)[code])
+
+    def count_pair(self, cond_attr, cond_code, trg_attr, trg_code):
+        """
+        :return: number of tuples with <cond_attr> = <cond_code> and <trg_attr> = <trg_code>.
+        """
+        if cond_code < 0 or trg_code < 0:
+            return 0
+        m = self.pair_counts(cond_attr, trg_attr)
+        start, end = m.indptr[cond_code], m.indptr[cond_code+1]
+        pos = start + np.searchsorted(m.indices[start:end], trg_code)
+        if pos < end and m.indices[pos] == trg_code:
+            return int(m.data[pos])
+        return 0
+
+    def cond_counts(self, cond_attr, cond_code, trg_attr):
+        """
+        :return: (codes, counts) of the values of <trg_attr> co-occurring with <cond_attr> = <cond_code>.
+        """
+        m = self.pair_counts(cond_attr, trg_attr)
+        start, end = m.indptr[cond_code], m.indptr[cond_code+1]
+        return m.indices[start:end], m.data[start:end]
+
+    def topk(self, cond_attr, cond_code, trg_attr, k):
+        """
+        :return: codes of the <k> most frequent values of <trg_attr> given <cond_attr> = <cond_code>.
+        """
+        codes, counts = self.cond_counts(cond_attr, cond_code, trg_attr)
+        order = np.argsort(-counts, kind='mergesort')[:k]
+        return codes[order]
+
+    def cond_candidates(self, cond_attr, trg_attr, threshold):
+        """
+        Prunes the contingency matrix of (cond_attr, trg_attr) to the entries whose conditional
+        probability P(trg_attr = y | cond_attr = x) is above <threshold>.
+        :return: scipy.sparse.csr_matrix with one row of candidate codes per value code of cond_attr.
+        """
+        m = self.pair_counts(cond_attr, trg_attr)
+        single = self.single_counts(cond_attr)
+        rows = np.repeat(np.arange(m.shape[0]), np.diff(m.indptr))
+        keep = m.data > threshold*single[rows]
+        cands = coo_matrix((m.data[keep], (rows[keep], m.indices[keep])), shape=m.shape).tocsr()
+        cands.sum_duplicates()
+        return cands
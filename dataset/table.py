@@ -1,6 +1,76 @@
 import os
 import pandas as pd
 from enum import Enum
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+# Number of rows streamed to the database with a single COPY statement.
+COPY_CHUNKSIZE = 100000
+
+def quote_ident(name):
+    return '"%s"' % name.replace('"', '""')
+
+def to_pg_array(values):
+    """
+    Formats a list as a Postgres array literal, the same text that is produced when
+    psycopg2 adapts a Python list and Postgres casts it to a text column.
+    """
+    elems = []
+    for val in values:
+        val = str(val)
+        if val == '' or val.upper() == 'NULL' or any(c in val for c in ' ,{}"\\'):
+            val = '"%s"' % val.replace('\\', '\\\\').replace('"', '\\"')
+        elems.append(val)
+    return '{%s}' % ','.join(elems)
+
+def to_copy_field(col):
+    """
+    Formats a column as CSV fields for COPY: every value is quoted and NULL is the only
+    unquoted (empty) field, so no value can be mistaken for NULL.
+    """
+    fields = '"' + col.astype(str).str.replace('"', '""', regex=False) + '"'
+    fields[col.isnull().values] = ''
+    return fields
+
+def copy_df(cursor, name, df):
+    """
+    Streams a dataframe into an existing table using COPY FROM STDIN.
+    :param cursor: psycopg2 cursor
+    :param name: name of target table
+    :param df: dataframe with the same columns as the target table
+    """
+    if len(df) == 0:
+        return
+    # Columns holding lists (e.g. distributions) are written as array literals.
+    list_attrs = [attr for attr in df.columns.values
+                  if df[attr].dtype == object and isinstance(df[attr].iloc[0], (list, tuple))]
+    fields = []
+    for attr in df.columns.values:
+        col = df[attr]
+        if attr in list_attrs:
+            col = col.apply(lambda val: None if val is None else to_pg_array(val))
+        fields.append(to_copy_field(col.reset_index(drop=True)))
+    lines = fields[0].str.cat(fields[1:], sep=',') if len(fields) > 1 else fields[0]
+    buf = StringIO()
+    buf.write(u'\n'.join(lines.tolist()))
+    buf.write(u'\n')
+    buf.seek(0)
+    attrs = ','.join([quote_ident(attr) for attr in df.columns.values])
+    stmt = "COPY %s (%s) FROM STDIN WITH CSV" % (quote_ident(name), attrs)
+    cursor.copy_expert(stmt, buf)
+
+def normalize_df(df):
+    """
+    Normalizes to lower strings and strips whitespaces using vectorized string operations.
+    """
+    # TODO: No support for numerical values. To be added.
+    for attr in df.columns.values:
+        if attr != '_tid_' and df[attr].dtype == object:
+            df[attr] = df[attr].str.lower().str.strip()
+    df.columns = [attr.lower() for attr in df.columns.values]
+    return df
 
 class Source(Enum):
     FILE = 1
@@ -12,10 +82,18 @@ class Table:
     """
     A wrapper class for Dataset Tables.
     """
-    def __init__(self, name, src, *args):
+    def __init__(self, name, src, *args, **kwargs):
+        """
+        :param kwargs: for Source.FILE, <chunksize> enables streaming ingestion: the file is read
+        <chunksize> rows at a time and each chunk is appended to the table <name> through the
+        sqlalchemy engine <db_conn>. <on_chunk>, if given, is called on every chunk before it is stored.
+        """
         self.name = name
         self.index_count = 0
         self.df = pd.DataFrame()
+        self.streamed = False
+        # attribute lists of the indexes created on the database table
+        self.db_indexes = set()
         if src == Source.FILE:
             if len(args) < 2:
                 raise Exception("ERROR while loading table. File path and file name expected.Please provide <file_path> and <file_name>.")
@@ -26,14 +104,14 @@ class Table:
                     na_values = args[2]
                 else:
                     na_values = None
-                self.df = pd.read_csv(os.path.join(file_path,file_name), dtype=str, na_values=na_values)
-                # Normalize to lower strings and strip whitespaces.
-                # TODO: No support for numerical values. To be added.
-                for attr in self.df.columns.values:
-                    if attr != '_tid_' and self.df[attr].dtype == str:
-                        self.df[attr] = self.df[attr].apply(lambda x: x.lower())
-                        self.df[attr] = self.df[attr].apply(lambda x: x.strip())
-                self.df.columns = map(str.lower, self.df.columns)
+                chunksize = kwargs.get('chunksize', None)
+                if chunksize is None:
+                    self.df = normalize_df(pd.read_csv(os.path.join(file_path,file_name), dtype=str, na_values=na_values))
+                else:
+                    if kwargs.get('db_conn', None) is None:
+                        raise Exception("ERROR while loading table. DB connection expected for streaming ingestion. Please provide <db_conn>.")
+                    self.stream_to_db(file_path, file_name, na_values, chunksize, kwargs['db_conn'],
+                                      kwargs.get('on_chunk', None))
         elif src == Source.DF:
             if len(args) != 1:
                 raise Exception("ERROR while loading table. Dataframe expected. Please provide <dataframe>.")
@@ -54,12 +132,61 @@ class Table:
                 dbengine.create_db_table_from_query(self.name, tab_query)
                 self.df = pd.read_sql_table(name, dbengine.conn)
 
-    def store_to_db(self, con, if_exists='replace', index=False, index_label=None):
+    def stream_to_db(self, file_path, file_name, na_values, chunksize, con, on_chunk=None):
+        """
+        Reads a CSV file in chunks of <chunksize> rows, assigns _tid_ incrementally and appends every
+        chunk to the database so that peak memory is bounded by the chunk size and not the file size.
+        Only the (empty) schema is kept in self.df; use load_from_db to materialize the table.
+        """
+        reader = pd.read_csv(os.path.join(file_path,file_name), dtype=str, na_values=na_values, chunksize=chunksize)
+        tid = 0
+        for chunk in reader:
+            chunk = normalize_df(chunk)
+            chunk.insert(0, '_tid_', range(tid, tid+len(chunk)))
+            tid += len(chunk)
+            if on_chunk is not None:
+                on_chunk(chunk)
+            self.df = chunk
+            self.store_to_db(con, if_exists='replace' if not self.streamed else 'append')
+            self.streamed = True
+        self.df = self.df.head(0)
+        self.streamed = True
+
+    def load_from_db(self, con):
+        self.df = pd.read_sql_table(self.name, con)
+
+    def store_to_db(self, con, if_exists='replace', index=False, index_label=None, bulk=True,
+                    chunksize=COPY_CHUNKSIZE):
         # TODO: This version supports single session, single worker.
-        self.df.to_sql(self.name, con, if_exists=if_exists, index=index, index_label=index_label)
+        if bulk:
+            self.bulk_store_to_db(con, if_exists=if_exists, index=index, index_label=index_label, chunksize=chunksize)
+        else:
+            self.df.to_sql(self.name, con, if_exists=if_exists, index=index, index_label=index_label)
+
+    def bulk_store_to_db(self, con, if_exists='replace', index=False, index_label=None, chunksize=COPY_CHUNKSIZE):
+        """
+        Stores the dataframe with COPY FROM STDIN in chunks of <chunksize> rows.
+        Indexes are not created here, callers should create them after the load finishes.
+        :param con: sqlalchemy engine
+        """
+        df = self.df
+        if index:
+            df = df.reset_index()
+            if index_label is not None:
+                df = df.rename(columns={df.columns.values[0]: index_label})
+        # Let pandas create (or replace) the empty table so column types stay the same as with to_sql.
+        df.head(0).to_sql(self.name, con, if_exists=if_exists, index=False)
+        conn = con.raw_connection()
+        try:
+            cur = conn.cursor()
+            for start in range(0, len(df), chunksize):
+                copy_df(cur, self.name, df.iloc[start:start+chunksize])
+            conn.commit()
+        finally:
+            conn.close()
 
     def get_attributes(self):
-        if not self.df.empty:
+        if not self.df.empty or (self.streamed and len(self.df.columns) > 0):
             return list(self.df.columns.values)
         else:
             raise Exception("Empty Dataframe associated with table "+self.name+". Cannot return attributes.")
@@ -72,6 +199,7 @@ class Table:
         try:
             dbengine.create_db_index(index_name, self.name, attr_list)
             self.index_count += 1
+            self.db_indexes.add(tuple(attr_list))
         except:
             raise Exception("ERROR while creating index for table %s on attributes %s"%(self.name, str(attr_list)))
         return
\ No newline at end of file
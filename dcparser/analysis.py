@@ -0,0 +1,108 @@
+from collections import OrderedDict
+
+from .constraint import is_symmetric
+
+# Order operations written the other way around, e.g. t1.A > t2.B is t2.B < t1.A.
+mirror_operation = {'>': '<', '>=': '<='}
+
+
+def canonical_component(component, rename):
+    if isinstance(component, str):
+        return ('', component)
+    return (rename[component[0]], component[1].lower())
+
+
+def canonical_predicate(predicate, rename):
+    """
+    :return: hashable form of <predicate> that does not depend on the order of the operands
+    of symmetric operations or on the direction of order operations.
+    """
+    left, right = [canonical_component(c, rename) for c in predicate.components]
+    op = predicate.operation
+    if is_symmetric(op):
+        left, right = sorted([left, right])
+    elif op in mirror_operation:
+        left, right, op = right, left, mirror_operation[op]
+    return op, left, right
+
+
+def canonical_form(c):
+    """
+    :return: canonical predicate set of <c> with its tuples named t1, t2 in order.
+    The tuples are never swapped: detection only reports the cells of the first tuple, so a
+    constraint and its swapped twin flag different cells unless the constraint is symmetric
+    (in which case both have the same canonical form).
+    """
+    rename = {name: 't%d' % (idx+1) for idx, name in enumerate(c.tuple_names)}
+    return frozenset(canonical_predicate(p, rename) for p in c.predicates)
+
+
+def merge_components(c, other):
+    """
+    Adds the components (attributes whose cells are flagged) of <other> missing in <c>.
+    """
+    attrs = set(attr.lower() for attr in c.components)
+    for attr in other.components:
+        if attr.lower() not in attrs:
+            c.components.append(attr)
+            attrs.add(attr.lower())
+
+
+def flags_components(c, other):
+    """
+    :return: True if <c> flags the cells of all the components of <other>
+    """
+    return set(attr.lower() for attr in other.components) <= set(attr.lower() for attr in c.components)
+
+
+def count_queries(c):
+    """
+    :return: number of detection and featurization (relaxed) queries generated for <c>.
+    """
+    if len(c.tuple_names) == 1:
+        return 1 + len(c.predicates)
+    count = 1
+    for p in c.predicates:
+        tuples = set(comp[0] for comp in p.components if not isinstance(comp, str))
+        # Relaxing an asymmetric predicate over both tuples yields one query per tuple.
+        count += 2 if len(tuples) == 2 and not is_symmetric(p.operation) else 1
+    return count
+
+
+def prune_constraints(dcs):
+    """
+    Removes constraints whose removal does not change the detected cells: duplicates (same
+    canonical predicates), and constraints implied by another one, i.e. whose predicates are
+    a superset of the predicates of another constraint over the same tuples (every violation
+    of the former violates the latter), if the latter flags all their components.
+    A duplicate hands its components over to the constraint that is kept, as both flag the
+    same tuples.
+    :param dcs: list of (key, ConstraintPlan)
+    :return: (kept, removed, queries_saved) where kept is the list of kept keys in their
+    original order and removed maps every removed key to the key of the constraint implying it.
+    """
+    # Visit constraints with fewer predicates first so the most general one is kept.
+    order = sorted(range(len(dcs)), key=lambda i: len(dcs[i][1].predicates))
+    kept = []
+    removed = OrderedDict()
+    queries_saved = 0
+    for i in order:
+        key, c = dcs[i]
+        form = canonical_form(c)
+        implied_by = None
+        for k_key, k_c, k_form in kept:
+            if len(k_c.tuple_names) != len(c.tuple_names):
+                continue
+            if k_form == form:
+                merge_components(k_c, c)
+            elif not (k_form < form and flags_components(k_c, c)):
+                continue
+            implied_by = k_key
+            break
+        if implied_by is None:
+            kept.append((key, c, form))
+        else:
+            removed[key] = implied_by
+            queries_saved += count_queries(c)
+    kept_keys = [key for key, _ in dcs if key not in removed]
+    return kept_keys, removed, queries_saved
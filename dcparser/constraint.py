@@ -41,7 +41,7 @@ class DenialConstraint:
         if verbose:
             print('DONE pre-processing constraint: '+dc_string)
         for component in split:
-            if contains_operation(component):
+            if contains_operation(component) is not None:
                 break
             else:
                 self.tuple_names.append(component)
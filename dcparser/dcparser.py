@@ -1,6 +1,8 @@
 import os
 import time
 from .constraint import DenialConstraint
+from .analysis import prune_constraints
+from .plan import ConstraintPlan, plans_key, load_plans, save_plans
 
 class Parser:
     """
@@ -17,12 +19,16 @@ class Parser:
         self.dc_strings = []
         self.dcs = {}
 
-    def load_denial_constraints(self, f_path, f_name):
+    def load_denial_constraints(self, f_path, f_name, prune=True):
         """
         Loads denial constraints from line-separated txt file
         :param file_path: path to dc file
         :param all_current_dcs: list of current dcs in the session
-        :return: list of Denial Constraint strings and their respective Denial Constraint Objects
+        :param prune: remove duplicate and implied DCs after loading
+        :return: list of Denial Constraint strings and their respective compiled ConstraintPlans.
+        If a cache directory is configured, the plans are saved there (before pruning) and later
+        runs over the same constraints and schema skip parsing and planning. Pruning always runs
+        against all the DCs loaded so far.
         """
         tic = time.clock()
         if not self.ds.raw_data:
@@ -35,16 +41,58 @@ class Parser:
             status = "OPENED constraints file successfully"
             if self.env['verbose']:
                 print (status)
-            for line in dc_file:
-                if not line.isspace():
-                    line = line.rstrip()
-                    self.dc_strings.append(line)
-                    self.dcs[line] = (DenialConstraint(line,attrs,self.env['verbose']))
-            status = 'DONE Loading DCs from ' + f_name
+            lines = [line.rstrip() for line in dc_file if not line.isspace()]
+            dc_file.close()
+            plans_file = self.get_plans_file(lines, attrs)
+            cached = load_plans(plans_file) if plans_file else None
+            if cached is not None:
+                dc_strings, plans = cached
+                status = 'DONE Loading compiled DCs of ' + f_name + ' from cache'
+            else:
+                dc_strings = lines
+                plans = {}
+                for line in lines:
+                    plans[line] = ConstraintPlan.compile(DenialConstraint(line,attrs,self.env['verbose']))
+                status = 'DONE Loading DCs from ' + f_name
+                if plans_file:
+                    save_plans(plans_file, dc_strings, plans)
+            self.dc_strings.extend(dc_strings)
+            for line in dc_strings:
+                # Keep the plans of DCs already loaded: pruning may have extended their components.
+                if line not in self.dcs:
+                    self.dcs[line] = plans[line]
+            if prune:
+                status += '. ' + self.prune_redundant_dcs()
         except Exception as e:
             status = ' '.join(['For file:', f_name, str(e)])
         toc = time.clock()
         return status, toc - tic
 
+    def get_plans_file(self, lines, attrs):
+        cache_dir = self.env.get('cache_dir', None)
+        if not cache_dir:
+            return None
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        return os.path.join(cache_dir, 'dcs_%s.json' % plans_key(lines, attrs))
+
+    def prune_redundant_dcs(self):
+        """
+        Removes DCs that are duplicates of (up to symmetric predicates) or implied by other
+        loaded DCs over the same tuples, without changing the detected cells (see prune_constraints).
+        :return: status message with the number of detection/featurization queries saved
+        """
+        keys = []
+        for line in self.dc_strings:
+            if line not in keys:
+                keys.append(line)
+        kept, removed, queries_saved = prune_constraints([(key, self.dcs[key]) for key in keys])
+        for key, implied_by in removed.items():
+            if self.env['verbose']:
+                print('Pruned DC %s: implied by %s' % (key, implied_by))
+            del self.dcs[key]
+        self.dc_strings = kept
+        return 'Pruned %d redundant DCs, saving %d queries' % (len(removed), queries_saved)
+
     def get_dcs(self):
         return self.dcs
@@ -0,0 +1,111 @@
+import os
+import json
+import hashlib
+
+
+class PredicatePlan:
+    """
+    Structured form of a Predicate.
+    components are [tuple name, attribute] pairs or literal strings (with their quotes).
+    """
+
+    def __init__(self, operation, components, cnf_form):
+        self.operation = operation
+        self.components = components
+        self.cnf_form = cnf_form
+        # names of the tuples referenced by the predicate, in order of appearance
+        self.tuples = []
+        for comp in components:
+            if isinstance(comp, list) and comp[0] not in self.tuples:
+                self.tuples.append(comp[0])
+        self.attrs = [comp[1].lower() for comp in components if isinstance(comp, list)]
+
+    def is_join_key(self):
+        """
+        :return: True if the predicate equates the same attribute of two different tuples.
+        """
+        return self.operation == '=' and len(self.tuples) == 2 and len(set(self.attrs)) == 1
+
+    def to_dict(self):
+        return {'operation': self.operation, 'components': self.components, 'cnf_form': self.cnf_form}
+
+    @classmethod
+    def from_dict(cls, d):
+        components = [[str(c[0]), str(c[1])] if isinstance(c, list) else str(c) for c in d['components']]
+        return cls(str(d['operation']), components, str(d['cnf_form']))
+
+
+class ConstraintPlan:
+    """
+    Compiled form of a DenialConstraint shared by detection and featurization.
+    It exposes the same members as DenialConstraint (tuple_names, predicates, cnf_form,
+    components) plus the predicates split by role:
+      join_keys: equality predicates on the same attribute of both tuples
+      residuals: the other predicates over both tuples
+      filters:   predicates over a single tuple (e.g. against a literal)
+    """
+
+    def __init__(self, tuple_names, predicates, components):
+        self.tuple_names = tuple_names
+        self.predicates = predicates
+        self.components = components
+        self.cnf_form = " AND ".join([p.cnf_form for p in predicates])
+        self.join_keys = [p for p in predicates if p.is_join_key()]
+        self.residuals = [p for p in predicates if not p.is_join_key() and len(p.tuples) == 2]
+        self.filters = [p for p in predicates if len(p.tuples) < 2]
+        # sorted attributes of the equality join
+        self.join_attrs = sorted(set(p.attrs[0] for p in self.join_keys))
+        # all attributes involved in the constraint
+        self.attrs = sorted(set(attr for p in predicates for attr in p.attrs))
+
+    @classmethod
+    def compile(cls, dc):
+        predicates = [PredicatePlan(p.operation, [list(c) if not isinstance(c, str) else c for c in p.components],
+                                    p.cnf_form) for p in dc.predicates]
+        return cls(list(dc.tuple_names), predicates, list(dc.components))
+
+    def get_filters(self, tuple_name):
+        return [p for p in self.filters if p.tuples == [tuple_name]]
+
+    def to_dict(self):
+        return {'tuple_names': self.tuple_names,
+                'predicates': [p.to_dict() for p in self.predicates],
+                'components': self.components}
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls([str(t) for t in d['tuple_names']],
+                   [PredicatePlan.from_dict(p) for p in d['predicates']],
+                   [str(c) for c in d['components']])
+
+
+def plans_key(dc_strings, schema):
+    """
+    :return: hash identifying the plans compiled from <dc_strings> over <schema>.
+    """
+    h = hashlib.sha1()
+    h.update(u'\x00'.join(schema).encode('utf-8'))
+    h.update(u'\x00'.join(dc_strings).encode('utf-8'))
+    return h.hexdigest()
+
+
+def save_plans(path, dc_strings, plans):
+    """
+    :param plans: dict dc string -> ConstraintPlan
+    """
+    with open(path, 'w') as f:
+        json.dump({'dc_strings': dc_strings,
+                   'plans': [[key, plans[key].to_dict()] for key in dc_strings]}, f)
+
+
+def load_plans(path):
+    """
+    :return: (dc_strings, plans) saved with save_plans or None if <path> does not exist.
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as f:
+        data = json.load(f)
+    dc_strings = [str(key) for key in data['dc_strings']]
+    plans = {str(key): ConstraintPlan.from_dict(plan) for key, plan in data['plans']}
+    return dc_strings, plans
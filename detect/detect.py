@@ -1,5 +1,6 @@
-import pandas as pd
+import numpy as np
 import time
+from multiprocessing.pool import ThreadPool
 from dataset import AuxTables
 
 
@@ -9,19 +10,11 @@ class DetectEngine:
         self.ds = dataset
 
     def detect_errors(self, detectors):
-        errors = []
         tic_total = time.clock()
         for detector in detectors:
             detector.setup(self.ds, self.env)
-        for detector in detectors:
-            tic = time.clock()
-            error_df = detector.detect_noisy_cells()
-            toc = time.clock()
-            if self.env['verbose']:
-                print("DONE with Error Detector: %s in %.2f secs"%(detector.name, toc-tic))
-            errors.append(error_df)
-        errors_df = pd.concat(errors, ignore_index=True).drop_duplicates().reset_index(drop=True)
-        errors_df['_cid_'] = errors_df.apply(lambda x: self.ds.get_cell_id(x['_tid_'], x['attribute']), axis=1)
+        errors = self.run_detectors(detectors)
+        errors_df = self.merge_errors(errors)
         try:
             self.store_detected_errors(errors_df)
             status = "DONE with error detection."
@@ -31,6 +24,80 @@ class DetectEngine:
         detect_time = toc_total - tic_total
         return status, detect_time
 
+    def detect_new_errors(self, detectors, df):
+        """
+        Incremental mode: appends the tuples in <df> to the dataset and only looks for
+        errors involving them. The new noisy cells are merged into dk_cells.
+        """
+        tic_total = time.clock()
+        new_tids = self.ds.append_data(df)
+        for detector in detectors:
+            detector.setup(self.ds, self.env)
+        errors = self.run_detectors(detectors, new_tids)
+        errors_df = self.merge_errors(errors)
+        try:
+            if not errors_df.empty:
+                self.merge_detected_errors(errors_df)
+            status = "DONE with incremental error detection."
+        except Exception as e:
+            status = "ERROR in incremental detection: "+str(e)
+        toc_total = time.clock()
+        detect_time = toc_total - tic_total
+        return status, detect_time
+
+    def run_detectors(self, detectors, new_tids=None):
+        """
+        Runs the (independent) detectors concurrently in a thread pool. Detectors spend most
+        of their time in numpy or waiting on the database, both of which release the GIL.
+        :param new_tids: if given, only detect errors involving these appended tuples
+        :return: list with the dataframe [_tid_, attribute] of every detector
+        """
+        def run(detector):
+            tic = time.clock()
+            if new_tids is None:
+                error_df = detector.detect_noisy_cells()
+            else:
+                error_df = detector.detect_new_cells(new_tids)
+            toc = time.clock()
+            if self.env['verbose']:
+                print("DONE with Error Detector: %s in %.2f secs"%(detector.name, toc-tic))
+            return error_df
+        if len(detectors) < 2:
+            return [run(detector) for detector in detectors]
+        # The detectors submit queries to the process pool: create it before starting threads.
+        self.ds.executor.start()
+        pool = ThreadPool(len(detectors))
+        try:
+            return pool.map(run, detectors)
+        finally:
+            pool.close()
+            pool.join()
+
+    def merge_errors(self, errors):
+        """
+        Merges and deduplicates the output of all detectors on cell ids.
+        :return: dataframe [_tid_, attribute, _cid_] with one row per noisy cell
+        """
+        cids = [self.ds.get_cell_ids(df['_tid_'].values, df['attribute'].values) for df in errors if not df.empty]
+        cids = np.unique(np.concatenate(cids)) if cids else np.zeros(0, dtype=np.int64)
+        return self.ds.get_cells(cids)
+
+    def merge_detected_errors(self, errors_df):
+        """
+        Appends the cells of <errors_df> that are not in dk_cells yet. Only the cells of
+        <errors_df> are looked up, through the index of dk_cells on _cid_.
+        """
+        dk_cells = self.ds.aux_table[AuxTables.dk_cells]
+        if dk_cells is None:
+            self.store_detected_errors(errors_df)
+            return
+        cids = ', '.join(str(cid) for cid in errors_df['_cid_'].values)
+        query = 'SELECT _cid_ FROM %s WHERE _cid_ IN (%s)' % (AuxTables.dk_cells.name, cids)
+        known = [row[0] for row in self.ds.engine.execute_query(query)]
+        errors_df = errors_df[~errors_df['_cid_'].isin(known)]
+        if not errors_df.empty:
+            self.ds.append_aux_table(AuxTables.dk_cells, errors_df[dk_cells.df.columns])
+
     def store_detected_errors(self, errors_df):
         if errors_df.empty:
             raise Exception("ERROR: Detected errors dataframe is empty.")
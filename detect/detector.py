@@ -28,4 +28,12 @@ class Detector:
          (tuple index,attribute) for the dk_cells
         :return dataframe  for the dk_cell
         """
-        raise NotImplementedError
\ No newline at end of file
+        raise NotImplementedError
+
+    def detect_new_cells(self, new_tids):
+        """
+        Detects the noisy cells after the tuples <new_tids> were appended to the dataset.
+        Detectors that cannot restrict their work to the new tuples run the full detection.
+        :return dataframe  for the dk_cell
+        """
+        return self.detect_noisy_cells()
\ No newline at end of file
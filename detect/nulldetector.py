@@ -1,3 +1,4 @@
+import numpy as np
 import pandas as pd
 from .detector import Detector
 
@@ -8,15 +9,18 @@ class NullDetector(Detector):
     def setup(self, dataset, env):
         self.ds = dataset
         self.env = env
-        self.df = self.ds.get_raw_data()
+        self.enc = self.ds.get_encoded_data()
 
     def detect_noisy_cells(self):
-        attributes = self.ds.get_attributes()
-        errors = []
-        for attr in attributes:
-            tmp_df = self.df[self.df[attr].str.match('_nan_')]['_tid_'].to_frame()
-            tmp_df.insert(1, "attribute", attr)
-            errors.append(tmp_df)
-        errors_df = pd.concat(errors, ignore_index=True).drop_duplicates().reset_index(drop=True)
-        return errors_df
+        # The encoded dataset keeps the null cells recorded at load time.
+        return self.gen_output(np.ones(len(self.enc.null_tids), dtype=bool))
 
+    def detect_new_cells(self, new_tids):
+        # Null cells are recorded in _tid_ order and new tuples have the highest _tid_.
+        start = np.searchsorted(self.enc.null_tids, np.min(new_tids)) if len(new_tids) else len(self.enc.null_tids)
+        return self.gen_output(slice(start, None))
+
+    def gen_output(self, keep):
+        attrs = np.array(self.enc.attrs, dtype=object)
+        return pd.DataFrame({'_tid_': self.enc.null_tids[keep], 'attribute': attrs[self.enc.null_attr_idx[keep]]},
+                            columns=['_tid_', 'attribute'])
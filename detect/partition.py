@@ -0,0 +1,157 @@
+import numpy as np
+import pandas as pd
+
+# Upper bound on the number of (t1, t2) pairs materialized at once when a
+# constraint has several residual predicates.
+PAIR_CHUNKSIZE = 1000000
+
+
+class PartitionPlan:
+    """
+    In-memory execution plan of a denial constraint over the encoded dataset.
+    Equality predicates on the same attribute of t1 and t2 become the partition
+    (group) key, inequality predicates on the same attribute are residuals checked
+    within each group and predicates against a literal are filters on t1 or t2.
+    """
+
+    def __init__(self, tuple_names):
+        self.tuple_names = tuple_names
+        # attributes equated between t1 and t2
+        self.keys = []
+        # attributes that must differ between t1 and t2
+        self.residuals = []
+        # (tuple name, attribute, operation, literal)
+        self.filters = []
+
+
+def plan_constraint(c):
+    """
+    :param c: compiled ConstraintPlan
+    :return: PartitionPlan for <c> or None if the constraint cannot be evaluated in memory
+    (e.g. order predicates or comparisons across different attributes).
+    """
+    if len(c.tuple_names) not in (1, 2):
+        return None
+    plan = PartitionPlan(c.tuple_names)
+    plan.keys = list(c.join_attrs)
+    for pred in c.residuals:
+        if pred.operation != '<>' or len(set(pred.attrs)) != 1:
+            return None
+        plan.residuals.append(pred.attrs[0])
+    for pred in c.filters:
+        # Only comparisons of an attribute against a literal.
+        if pred.operation not in ('=', '<>') or len(pred.attrs) != 1 or len(pred.components) != 2:
+            return None
+        literal = [comp for comp in pred.components if isinstance(comp, str)][0]
+        plan.filters.append((pred.tuples[0], pred.attrs[0], pred.operation, literal.strip("'")))
+    return plan
+
+
+def group_ids(enc, attrs, rows):
+    """
+    :return: dense group id of every row in <rows> for the combination of values of <attrs>.
+    """
+    gid = np.zeros(len(rows), dtype=np.int64)
+    for attr in attrs:
+        gid = gid*enc.domain_size(attr) + enc.get_codes(attr)[rows]
+        gid = np.unique(gid, return_inverse=True)[1].astype(np.int64)
+    return gid
+
+
+class PartitionCache:
+    """
+    Memoizes group ids per set of attributes so constraints that share their
+    equality keys (and residuals) partition the dataset only once.
+    """
+
+    def __init__(self, enc):
+        self.enc = enc
+        self.rows = np.arange(enc.num_tuples)
+        self.gids = {}
+
+    def group_ids(self, attrs):
+        key = tuple(sorted(set(attrs)))
+        if key not in self.gids:
+            self.gids[key] = group_ids(self.enc, key, self.rows)
+        return self.gids[key]
+
+
+def filter_mask(enc, plan, tuple_name):
+    mask = np.ones(enc.num_tuples, dtype=bool)
+    for name, attr, op, literal in plan.filters:
+        if name != tuple_name:
+            continue
+        match = enc.get_codes(attr) == enc.encode(attr, literal)
+        mask &= match if op == '=' else ~match
+    return mask
+
+
+def find_violations(enc, plan, partitions=None):
+    """
+    Evaluates the plan with the same semantics as the SQL detection query: t1 is reported
+    if some tuple t2 (possibly t1 itself) satisfies all predicates together with t1.
+    :param partitions: optional PartitionCache shared across constraints
+    :return: np.array with the positions of the violating t1 tuples
+    """
+    if enc.num_tuples == 0:
+        return np.zeros(0, dtype=np.int64)
+    if partitions is None:
+        partitions = PartitionCache(enc)
+    mask1 = filter_mask(enc, plan, plan.tuple_names[0])
+    if len(plan.tuple_names) == 1:
+        return np.nonzero(mask1)[0]
+    mask2 = filter_mask(enc, plan, plan.tuple_names[1])
+    gid = partitions.group_ids(plan.keys)
+    num_groups = int(gid.max()) + 1 if len(gid) else 0
+    group_size = np.bincount(gid[mask2], minlength=num_groups)
+    if not plan.residuals:
+        violating = mask1 & (group_size[gid] > 0)
+    elif len(plan.residuals) == 1:
+        # Some t2 differs on the residual attribute iff the group has more t2 candidates
+        # than the ones sharing t1's value.
+        sub_gid = partitions.group_ids(plan.keys + plan.residuals)
+        same_value = np.bincount(sub_gid[mask2], minlength=int(sub_gid.max()) + 1)
+        violating = mask1 & (group_size[gid] - same_value[sub_gid] > 0)
+    else:
+        violating = mask1 & pairwise_violations(enc, plan, gid, mask1, mask2)
+    return np.nonzero(violating)[0]
+
+
+def pairwise_violations(enc, plan, gid, mask1, mask2):
+    """
+    Checks the residual predicates for every (t1, t2) pair of the same group, in chunks.
+    """
+    cand = np.nonzero(mask2)[0]
+    cand = cand[np.argsort(gid[cand], kind='mergesort')]
+    starts = np.searchsorted(gid[cand], np.arange(int(gid.max()) + 2 if len(gid) else 1))
+    residual_codes = [enc.get_codes(attr) for attr in plan.residuals]
+    violating = np.zeros(enc.num_tuples, dtype=bool)
+    t1 = np.nonzero(mask1)[0]
+    sizes = starts[gid[t1]+1] - starts[gid[t1]]
+    t1, sizes = t1[sizes > 0], sizes[sizes > 0]
+    ends = np.cumsum(sizes)
+    lo = 0
+    while lo < len(t1):
+        hi = max(lo + 1, int(np.searchsorted(ends, ends[lo] - sizes[lo] + PAIR_CHUNKSIZE, side='right')))
+        chunk, chunk_sizes = t1[lo:hi], sizes[lo:hi]
+        chunk_ends = np.cumsum(chunk_sizes)
+        left = np.repeat(chunk, chunk_sizes)
+        right = cand[np.repeat(starts[gid[chunk]] - (chunk_ends - chunk_sizes), chunk_sizes) +
+                     np.arange(chunk_ends[-1])]
+        match = np.ones(len(left), dtype=bool)
+        for codes in residual_codes:
+            match &= codes[left] != codes[right]
+        violating[left[match]] = True
+        lo = hi
+    return violating
+
+
+def violations_df(enc, plan, attrs, partitions=None):
+    """
+    :return: dataframe [_tid_, attribute] with the cells of <attrs> in every violating tuple.
+    """
+    tids = enc.tids[find_violations(enc, plan, partitions)]
+    attrs = [attr.lower() for attr in attrs]
+    return pd.DataFrame({'_tid_': np.repeat(tids, len(attrs)),
+                         'attribute': np.tile(np.array(attrs, dtype=object), len(tids))},
+                        columns=['_tid_', 'attribute'])
@@ -1,15 +1,37 @@
+import numpy as np
 import pandas as pd
+from collections import OrderedDict
 from string import Template
 
 from .detector import Detector
+from .partition import PartitionCache, plan_constraint, violations_df
 
 unary_template = Template('SELECT t1._tid_ FROM $table as t1 WHERE $cond')
 
 mult_template = Template ('SELECT t1._tid_ FROM $table as t1 WHERE $cond1 $c EXISTS (SELECT t2._tid_ FROM $table as t2 WHERE $cond2)')
 
+# Incremental detection: t1 is new, or t2 is new and t1 is an existing tuple.
+incr_unary_template = Template('SELECT t1._tid_ FROM $table as t1 WHERE t1._tid_ >= $start AND $cond')
+
+incr_mult_template = Template('SELECT t1._tid_ FROM $table as t1, $table as t2 WHERE t1._tid_ >= $start AND $cond '
+                              'UNION '
+                              'SELECT t1._tid_ FROM $table as t1, $table as t2 WHERE t2._tid_ >= $start AND $cond')
+
+shared_unary_template = Template('SELECT t1._tid_, $flags FROM $table as t1 WHERE $cond')
+
+shared_mult_template = Template('SELECT * FROM (SELECT t1._tid_, $flags FROM $table as t1) AS flags WHERE $cond')
+
+shared_exists_template = Template('($cond1 EXISTS (SELECT t2._tid_ FROM $table as t2 WHERE $cond2)) AS v$idx')
+
 class ViolationDetector(Detector):
-    def __init__(self, name='ViolationDetector'):
+    def __init__(self, name='ViolationDetector', in_memory=True):
+        """
+        :param in_memory: evaluate constraints made of equality/inequality predicates on the
+        encoded dataset by hash-partitioning on their equality predicates. Other constraints
+        are always translated to SQL.
+        """
         super(ViolationDetector, self).__init__(name)
+        self.in_memory = in_memory
 
     def setup(self, dataset, env):
         self.ds = dataset
@@ -17,28 +39,113 @@ class ViolationDetector(Detector):
         self.constraints = dataset.constraints
 
     def detect_noisy_cells(self):
-        # Convert  Constraints to SQL queries
         tbl = self.ds.raw_data.name
-        queries = []
-        attrs = []
+        enc = self.ds.get_encoded_data()
+        partitions = PartitionCache(enc)
+        errors = []
+        sql_dcs = []
         for c_key in self.constraints:
             c = self.constraints[c_key]
-            q = self.to_sql(tbl, c)
-            queries.append(q)
-            attrs.append(c.components)
+            plan = plan_constraint(c) if self.in_memory else None
+            if plan is not None:
+                errors.append(violations_df(enc, plan, c.components, partitions))
+            else:
+                sql_dcs.append(c)
+        # Convert the remaining constraints to SQL queries, one per group of constraints
+        # sharing the same join keys.
+        groups = self.group_by_join_keys(sql_dcs)
+        queries = [self.to_shared_sql(tbl, group) if len(group) > 1 else self.to_sql(tbl, group[0])
+                   for group in groups]
         # Execute Queries over the DBEngine of Dataset
-        results = self.ds.engine.execute_queries(queries)
+        results = self.ds.engine.execute_queries(queries) if queries else []
 
         # Generate final output
-        errors = []
-        for i in range(len(attrs)):
-            res = results[i]
-            attr_list = attrs[i]
-            tmp_df = self.gen_tid_attr_output(res, attr_list)
-            errors.append(tmp_df)
+        for group, res in zip(groups, results):
+            if len(group) == 1:
+                errors.append(self.gen_tid_attr_output(res, group[0].components))
+                continue
+            for idx, c in enumerate(group):
+                errors.append(self.gen_tid_attr_output([row for row in res if row[idx+1]], c.components))
+        if not errors:
+            return pd.DataFrame(columns=['_tid_', 'attribute'])
         errors_df = pd.concat(errors, ignore_index=True).drop_duplicates().reset_index(drop=True)
         return errors_df
 
+    def detect_new_cells(self, new_tids):
+        """
+        Only checks pairs that involve the appended tuples (new-vs-new and new-vs-existing).
+        Tuples are appended with increasing _tid_, so the new tuples are the ones with
+        _tid_ >= min(new_tids). Lookups of the matching tuples use indexes on the join keys.
+        """
+        if len(new_tids) == 0:
+            return pd.DataFrame(columns=['_tid_', 'attribute'])
+        tbl = self.ds.raw_data.name
+        start = int(np.min(new_tids))
+        self.create_join_indexes()
+        constraints = [self.constraints[c_key] for c_key in self.constraints]
+        queries = [self.to_incremental_sql(tbl, c, start) for c in constraints]
+        results = self.ds.engine.execute_queries(queries) if queries else []
+        errors = [self.gen_tid_attr_output(res, c.components) for c, res in zip(constraints, results)]
+        if not errors:
+            return pd.DataFrame(columns=['_tid_', 'attribute'])
+        return pd.concat(errors, ignore_index=True).drop_duplicates().reset_index(drop=True)
+
+    def create_join_indexes(self):
+        """
+        Creates (once) a composite index on the equality join attributes of every constraint.
+        """
+        for c_key in self.constraints:
+            attrs = self.constraints[c_key].join_attrs
+            if attrs and tuple(attrs) not in self.ds.raw_data.db_indexes:
+                self.ds.raw_data.create_db_index(self.ds.engine, attrs)
+
+    def to_incremental_sql(self, tbl, c, start):
+        if len(c.tuple_names) == 1:
+            return incr_unary_template.substitute(table=tbl, start=start, cond=c.cnf_form)
+        return incr_mult_template.substitute(table=tbl, start=start, cond=c.cnf_form)
+
+    def group_by_join_keys(self, constraints):
+        """
+        Groups constraints that can be evaluated with the same scan of t1: single tuple
+        constraints, or two-tuple constraints with the same equality join keys.
+        Constraints without join keys are kept alone.
+        :return: list of lists of constraints
+        """
+        groups = OrderedDict()
+        singles = []
+        for c in constraints:
+            if len(c.tuple_names) == 1:
+                key = ()
+            else:
+                key = tuple(c.join_attrs)
+                if not key or len(c.tuple_names) != 2:
+                    singles.append([c])
+                    continue
+            groups.setdefault(key, []).append(c)
+        return list(groups.values()) + singles
+
+    def to_shared_sql(self, tbl, constraints):
+        """
+        :return: query with one row per violating t1 and one boolean column per constraint.
+        Only the outer scan of t1 is shared: multi-tuple constraints still run one correlated
+        EXISTS sub-query per constraint and t1, which stops at the first matching t2.
+        A single join on the shared keys with one bool_or per constraint would build every
+        pair of tuples of a key group, which is quadratic in the size of the group.
+        """
+        if len(constraints[0].tuple_names) == 1:
+            conds = ['(%s)' % c.cnf_form for c in constraints]
+            return shared_unary_template.substitute(table=tbl,
+                                                    flags=', '.join(conds),
+                                                    cond=' OR '.join(conds))
+        flags = []
+        for idx, c in enumerate(constraints):
+            cond1, cond2 = self.split_mult_predicates(c)
+            flags.append(shared_exists_template.substitute(table=tbl, idx=idx, cond2=cond2,
+                                                           cond1=cond1 + ' AND' if cond1 else ''))
+        return shared_mult_template.substitute(table=tbl,
+                                               flags=', '.join(flags),
+                                               cond=' OR '.join('v%d' % idx for idx in range(len(constraints))))
+
     def to_sql(self, tbl, c):
         # Check tuples in constraint
         unary = len(c.tuple_names)==1
@@ -52,27 +159,21 @@ class ViolationDetector(Detector):
         query = unary_template.substitute(table=tbl, cond=c.cnf_form)
         return query
 
+    def split_mult_predicates(self, c):
+        """
+        Filters on t1 alone go to the outer query, all other predicates to the EXISTS sub-query.
+        :return: (outer condition, sub-query condition)
+        """
+        cond1_preds = c.get_filters(c.tuple_names[0])
+        cond2_preds = [pred for pred in c.predicates if pred not in cond1_preds]
+        if not cond2_preds:
+            raise Exception("ERROR in violation detector. Cannot ground mult-tuple template.")
+        cond1 = " AND ".join([pred.cnf_form for pred in cond1_preds])
+        cond2 = " AND ".join([pred.cnf_form for pred in cond2_preds])
+        return cond1, cond2
+
     def gen_mult_query(self, tbl, c):
-        # Iterate over constraint predicates to identify cond1 and cond2
-        cond1_preds = []
-        cond2_preds = []
-        for pred in c.predicates:
-            if pred.cnf_form.find('t1'):
-                if pred.cnf_form.find('t2'):
-                    cond2_preds.append(pred.cnf_form)
-                else:
-                    cond1_preds.append(pred.cnf_form)
-            elif pred.cnf_form.find('t2'):
-                cond2_preds.append(pred.cnf_form)
-            else:
-                raise Exception("ERROR in violation detector. Cannot ground mult-tuple template.")
-        cond1 = " AND ".join(cond1_preds)
-        cond2 = " AND ".join(cond2_preds)
-        a = ','.join(c.components)
-        a = []
-        for b in c.components:
-            a.append("'"+b+"'")
-        a = ','.join(a)
+        cond1, cond2 = self.split_mult_predicates(c)
         if cond1 != '':
             query = mult_template.substitute(table=tbl, cond1=cond1, c='AND', cond2=cond2)
         else:
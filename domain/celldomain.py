@@ -0,0 +1,181 @@
+import numpy as np
+import pandas as pd
+
+
+def gather_segments(offsets, values, order):
+    """
+    Reorders the segments values[offsets[i]:offsets[i+1]] of a CSR layout.
+    :return: (offsets, values) with the segments in the given order
+    """
+    sizes = np.diff(offsets)[order]
+    ends = np.cumsum(sizes)
+    total = ends[-1] if len(ends) else 0
+    idx = np.repeat(offsets[:-1][order] - (ends - sizes), sizes) + np.arange(total)
+    return np.concatenate([[0], ends]).astype(np.int64), values[idx]
+
+
+class CellDomain:
+    """
+    Compact (CSR) representation of the domains of all random variables.
+    The candidate values of the variable with _vid_ = v are codes[offsets[v]:offsets[v+1]],
+    where codes index into the value dictionary of attribute attrs[attr_idx[v]] in the encoded
+    dataset. val_id i of v (0-based) is the i-th entry of its segment.
+    """
+
+    def __init__(self, attrs):
+        self.attrs = list(attrs)
+        self.tids = np.zeros(0, dtype=np.int64)
+        self.attr_idx = np.zeros(0, dtype=np.int64)
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.codes = np.zeros(0, dtype=np.int64)
+        self.init_index = np.zeros(0, dtype=np.int64)
+        self.fixed = np.zeros(0, dtype=np.int64)
+        self._chunks = []
+
+    @classmethod
+    def from_shard(cls, shard, attrs):
+        """
+        Builds the domain of a shard of tuples with variables in (tuple, attribute) order.
+        :param shard: list of (attr, rows, offsets, codes, init_index, fixed) per attribute,
+        rows being tuple positions (i.e. _tid_) in the encoded dataset
+        """
+        dom = cls(attrs)
+        attr_to_pos = {attr: idx for idx, attr in enumerate(dom.attrs)}
+        tids, attr_idx, sizes, codes, init_index, fixed = [], [], [], [], [], []
+        for attr, rows, offsets, attr_codes, attr_init_index, attr_fixed in shard:
+            tids.append(rows)
+            attr_idx.append(np.full(len(rows), attr_to_pos[attr], dtype=np.int64))
+            sizes.append(np.diff(offsets))
+            codes.append(attr_codes)
+            init_index.append(attr_init_index)
+            fixed.append(attr_fixed)
+        if not tids:
+            return dom
+        tids = np.concatenate(tids).astype(np.int64)
+        attr_idx = np.concatenate(attr_idx)
+        offsets = np.concatenate([[0], np.cumsum(np.concatenate(sizes))]).astype(np.int64)
+        order = np.lexsort((attr_idx, tids))
+        dom.tids = tids[order]
+        dom.attr_idx = attr_idx[order]
+        dom.offsets, dom.codes = gather_segments(offsets, np.concatenate(codes).astype(np.int64), order)
+        dom.init_index = np.concatenate(init_index).astype(np.int64)[order]
+        dom.fixed = np.concatenate(fixed).astype(np.int64)[order]
+        return dom
+
+    def extend(self, other):
+        """
+        Appends the variables of <other> after the current ones. Call finalize when done.
+        """
+        self._chunks.append(other)
+
+    def finalize(self):
+        if not self._chunks:
+            return
+        chunks = [self] + self._chunks
+        self._chunks = []
+        ends = np.cumsum([len(c.codes) for c in chunks])
+        self.offsets = np.concatenate([chunks[0].offsets[:-1]] +
+                                      [c.offsets[:-1] + start for c, start in zip(chunks[1:], ends[:-1])] +
+                                      [[ends[-1]]]).astype(np.int64)
+        self.tids = np.concatenate([c.tids for c in chunks])
+        self.attr_idx = np.concatenate([c.attr_idx for c in chunks])
+        self.codes = np.concatenate([c.codes for c in chunks])
+        self.init_index = np.concatenate([c.init_index for c in chunks])
+        self.fixed = np.concatenate([c.fixed for c in chunks])
+
+    def num_vars(self):
+        return len(self.tids)
+
+    def domain_sizes(self):
+        return np.diff(self.offsets)
+
+    def get_domain(self, vid):
+        return self.codes[self.offsets[vid]:self.offsets[vid+1]]
+
+    def entry_vids(self):
+        """
+        :return: the _vid_ of every (variable, candidate value) entry
+        """
+        return np.repeat(np.arange(self.num_vars()), self.domain_sizes())
+
+    def entry_pos(self):
+        """
+        :return: the 0-based val_id of every (variable, candidate value) entry
+        """
+        return np.arange(len(self.codes)) - np.repeat(self.offsets[:-1], self.domain_sizes())
+
+    def init_codes(self):
+        return self.codes[self.offsets[:-1] + self.init_index]
+
+    def get_attr_vars(self, attr):
+        """
+        :return: _vid_ of all variables of <attr> (empty if <attr> has no random variables)
+        """
+        if attr not in self.attrs:
+            return np.zeros(0, dtype=np.int64)
+        return np.nonzero(self.attr_idx == self.attrs.index(attr))[0]
+
+    def get_attr_entries(self, attr):
+        """
+        :return: (vids, pos, codes) of all (variable, candidate value) entries of <attr>
+        (empty if <attr> has no random variables)
+        """
+        if attr not in self.attrs:
+            empty = np.zeros(0, dtype=np.int64)
+            return empty, empty, empty
+        vids = self.entry_vids()
+        keep = self.attr_idx[vids] == self.attrs.index(attr)
+        return vids[keep], self.entry_pos()[keep], self.codes[keep]
+
+    def decode_entries(self, enc):
+        """
+        :return: np.array with the value of every (variable, candidate value) entry
+        """
+        values = np.empty(len(self.codes), dtype=object)
+        entry_attr = self.attr_idx[self.entry_vids()]
+        for idx, attr in enumerate(self.attrs):
+            keep = entry_attr == idx
+            values[keep] = enc.get_values(attr)[self.codes[keep]]
+        return values
+
+    def decode_init_values(self, enc):
+        values = np.empty(self.num_vars(), dtype=object)
+        init_codes = self.init_codes()
+        for idx, attr in enumerate(self.attrs):
+            keep = self.attr_idx == idx
+            values[keep] = enc.get_values(attr)[init_codes[keep]]
+        return values
+
+    def cell_ids(self, attr_to_idx, attr_number):
+        attr_offsets = np.array([attr_to_idx[attr] for attr in self.attrs], dtype=np.int64)
+        return self.tids*attr_number + attr_offsets[self.attr_idx]
+
+    def to_cell_domain_df(self, enc, attr_to_idx, attr_number, vid_start=0):
+        """
+        :return: dataframe with the schema of the cell_domain table
+        """
+        return pd.DataFrame({'_vid_': np.arange(vid_start, vid_start+self.num_vars()),
+                             '_tid_': self.tids,
+                             'attribute': np.array(self.attrs, dtype=object)[self.attr_idx],
+                             '_cid_': self.cell_ids(attr_to_idx, attr_number),
+                             'domain_size': self.domain_sizes(),
+                             'init_value': self.decode_init_values(enc),
+                             'init_index': self.init_index,
+                             'fixed': self.fixed},
+                            columns=['_vid_', '_tid_', 'attribute', '_cid_', 'domain_size',
+                                     'init_value', 'init_index', 'fixed'])
+
+    def to_pos_values_df(self, enc, attr_to_idx, attr_number, vid_start=0):
+        """
+        :return: normalized dataframe with one row per (variable, candidate value) and
+        schema [_vid_, _cid_, _tid_, attribute, rv_val, val_id, value_code]. val_id is 1-based.
+        """
+        vids = self.entry_vids()
+        return pd.DataFrame({'_vid_': vids + vid_start,
+                             '_cid_': self.cell_ids(attr_to_idx, attr_number)[vids],
+                             '_tid_': self.tids[vids],
+                             'attribute': np.array(self.attrs, dtype=object)[self.attr_idx[vids]],
+                             'rv_val': self.decode_entries(enc),
+                             'val_id': self.entry_pos() + 1,
+                             'value_code': self.codes},
+                            columns=['_vid_', '_cid_', '_tid_', 'attribute', 'rv_val', 'val_id', 'value_code'])
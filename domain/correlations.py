@@ -0,0 +1,140 @@
+import numpy as np
+import pandas as pd
+
+
+def entropy(counts):
+    p = counts[counts > 0]/float(counts.sum())
+    return -np.sum(p*np.log(p))
+
+
+def contingency(codes1, codes2):
+    """
+    :return: (rows, cols, counts) of the non-zero cells of the contingency table of two code arrays.
+    """
+    size2 = int(codes2.max()) + 1 if len(codes2) else 1
+    keys, counts = np.unique(codes1.astype(np.int64)*size2 + codes2, return_counts=True)
+    return keys // size2, keys % size2, counts
+
+
+def nmi(codes1, codes2):
+    """
+    Mutual information normalized by the geometric mean of the entropies, in [0, 1].
+    """
+    n = float(len(codes1))
+    h1 = entropy(np.bincount(codes1))
+    h2 = entropy(np.bincount(codes2))
+    if n == 0 or h1 == 0 or h2 == 0:
+        return 0.0
+    rows, cols, counts = contingency(codes1, codes2)
+    marg1 = np.bincount(codes1)[rows]
+    marg2 = np.bincount(codes2)[cols]
+    mi = np.sum(counts/n*np.log(counts*n/(marg1*marg2.astype(np.float64))))
+    return float(min(1.0, max(0.0, mi/np.sqrt(h1*h2))))
+
+
+def cramers_v(codes1, codes2):
+    """
+    Cramer's V computed from the chi-squared statistic of the contingency table, in [0, 1].
+    """
+    n = float(len(codes1))
+    count1 = np.bincount(codes1)
+    count2 = np.bincount(codes2)
+    k = min(np.count_nonzero(count1), np.count_nonzero(count2)) - 1
+    if n == 0 or k <= 0:
+        return 0.0
+    rows, cols, counts = contingency(codes1, codes2)
+    chi2 = n*(np.sum(counts.astype(np.float64)**2/(count1[rows]*count2[cols].astype(np.float64))) - 1.0)
+    return float(min(1.0, np.sqrt(max(chi2, 0.0)/(n*k))))
+
+
+def pearson(codes1, codes2):
+    if len(codes1) == 0 or codes1.std() == 0 or codes2.std() == 0:
+        return 0.0
+    return float(np.corrcoef(codes1, codes2)[0, 1])
+
+
+measures = {'nmi': nmi, 'cramers_v': cramers_v, 'pearson': pearson}
+
+
+def compute_pair(ctx, args):
+    """
+    :param ctx: sampled codes of all attributes and the dependence measure
+    """
+    i, j = args
+    codes = ctx['codes']
+    return i, j, measures[ctx['method']](codes[i], codes[j])
+
+
+class CorrelationEngine:
+    """
+    Estimates the dependence between every pair of attributes from a uniform sample
+    of the encoded dataset and keeps, for every attribute, the list of attributes whose
+    dependence is above a threshold. Supported measures are normalized mutual information
+    ('nmi'), Cramer's V ('cramers_v') and Pearson correlation of the value codes ('pearson',
+    the default). The thresholds used with Pearson correlation are not calibrated for the other
+    measures, and NMI estimated on a sample is biased upwards for near-unique attributes.
+    """
+
+    def __init__(self, enc, method='pearson', sample_size=100000, seed=45, executor=None, cache=None):
+        if method not in measures:
+            raise Exception("Unknown correlation measure %s. Use one of %s." % (method, ', '.join(measures)))
+        self.enc = enc
+        self.method = method
+        self.sample_size = sample_size
+        self.seed = seed
+        self.executor = executor
+        self.cache = cache
+        self.correlations = None
+        self.neighbors = {}
+
+    def cache_key(self):
+        return 'corr_%s_%d_%d' % (self.method, self.sample_size, self.seed)
+
+    def sample_codes(self):
+        n = self.enc.num_tuples
+        if self.sample_size and n > self.sample_size:
+            rows = np.sort(np.random.RandomState(self.seed).choice(n, self.sample_size, replace=False))
+        else:
+            rows = np.arange(n)
+        return [self.enc.get_codes(attr)[rows] for attr in self.enc.attrs]
+
+    def compute(self):
+        """
+        :return: dataframe with the (symmetric) dependence matrix of all attributes
+        """
+        if self.cache:
+            self.correlations = self.cache.load_correlations(self.cache_key())
+            if self.correlations is not None:
+                return self.correlations
+        attrs = self.enc.attrs
+        ctx = {'codes': self.sample_codes(), 'method': self.method}
+        pairs = [(i, j) for i in range(len(attrs)) for j in range(i+1, len(attrs))]
+        if self.executor is not None:
+            results = list(self.executor.imap_context(compute_pair, ctx, pairs))
+        else:
+            results = [compute_pair(ctx, pair) for pair in pairs]
+        matrix = np.eye(len(attrs))
+        for i, j, score in results:
+            matrix[i, j] = score
+            matrix[j, i] = score
+        self.correlations = pd.DataFrame(matrix, index=attrs, columns=attrs)
+        if self.cache:
+            self.cache.save_correlations(self.correlations, self.cache_key())
+        return self.correlations
+
+    def build_neighbors(self, threshold):
+        """
+        Precomputes for every attribute the attributes with |dependence| > threshold,
+        strongest first.
+        """
+        if self.correlations is None:
+            self.compute()
+        self.neighbors = {}
+        for attr in self.correlations.columns.values:
+            scores = self.correlations[attr].abs().drop(attr)
+            scores = scores[scores > threshold].sort_values(ascending=False, kind='mergesort')
+            self.neighbors[attr] = list(scores.index.values)
+        return self.neighbors
+
+    def get_neighbors(self, attr):
+        return self.neighbors.get(attr, [])
@@ -1,40 +1,50 @@
-import pandas as pd
+import numpy as np
 import time
 from tqdm import tqdm
 import itertools
-import random
 
 from dataset import AuxTables
-from dataset.dataset import dictify
+from .celldomain import CellDomain
+from .correlations import CorrelationEngine
 
 
 class DomainEngine:
-    def __init__(self, env, dataset, cor_strength = 0.1, sampling_prob=0.3, max_sample=5):
+    def __init__(self, env, dataset, cor_strength = 0.1, sampling_prob=0.3, max_sample=5, shard_size=100000,
+                 stream=True, corr_method='pearson', corr_sample_size=100000):
         self.env = env
         self.ds = dataset
         self.topk = env["pruning_topk"]
         self.verbose = env['verbose']
         self.setup_complete = False
         self.active_attributes = None
-        self.raw_data = None
         self.domain = None
         self.total = None
         self.correlations = None
+        self.corr_engine = None
+        self.corr_method = corr_method
+        self.corr_sample_size = corr_sample_size
         self.cor_strength = cor_strength
         self.sampling_prob = sampling_prob
         self.max_sample = max_sample
-        self.single_stats = {}
-        self.pair_stats = {}
-        self.all_attrs = {}
+        self.shard_size = shard_size
+        self.stream = stream
+        self.stats = None
+        # active attr -> list of (correlated attr, csr matrix of candidate codes)
+        self.candidates = {}
 
     def setup(self):
         tic = time.time()
         try:
-            random.seed(self.env['seed'])
+            # Correlations and candidate orders assume codes in sorted order, which appended
+            # tuples may have broken.
+            self.ds.sort_encoding()
             self.find_correlations()
             self.setup_attributes()
-            domain = self.generate_domain()
-            self.store_domains(domain)
+            if self.stream:
+                self.stream_domains()
+            else:
+                domain = self.generate_domain()
+                self.store_domains(domain)
             status = "DONE with domain preparation."
         except Exception as e:
             status = "ERROR setting up domain: %s"%str(e)
@@ -42,39 +52,71 @@ class DomainEngine:
         return status, toc - tic
 
     def find_correlations(self):
-        self.raw_data = self.ds.get_raw_data().copy()
-        # convert dataset to numberic categories
-        d = pd.DataFrame()
-        for attr in self.raw_data.columns.values:
-            d[attr] = self.raw_data[attr].astype('category').cat.codes
-        # drop columns with only one value and tid column
-        d = d.loc[:, (d != 0).any(axis=0)]
-        d = d.drop(['_tid_'], axis=1)
-        # Computer correlation across attributes
-        m_corr = d.corr()
-        self.correlations = m_corr
+        """
+        Estimates the dependence between attributes (see CorrelationEngine) and precomputes
+        the list of correlated attributes of every attribute.
+        """
+        self.corr_engine = CorrelationEngine(self.ds.get_encoded_data(), method=self.corr_method,
+                                             sample_size=self.corr_sample_size, seed=self.env['seed'],
+                                             executor=self.ds.executor, cache=self.ds.get_stats_cache())
+        self.correlations = self.corr_engine.compute()
+        self.corr_engine.build_neighbors(self.cor_strength)
 
     def store_domains(self, domain):
-        if domain.empty:
+        """
+        Keeps the CSR domain in the dataset and persists it as cell_domain (one row per
+        random variable) and pos_values (one row per variable and candidate value).
+        """
+        if domain.num_vars() == 0:
             raise Exception("ERROR: Generated domain is empty.")
         else:
-            self.ds.generate_aux_table(AuxTables.cell_domain, domain, store=True, index_attrs=['_vid_'])
+            self.ds.set_domain(domain)
+            enc = self.ds.get_encoded_data()
+            cell_domain = domain.to_cell_domain_df(enc, self.ds.attr_to_idx, self.ds.attr_number)
+            self.ds.generate_aux_table(AuxTables.cell_domain, cell_domain, store=True, index_attrs=['_vid_'])
             self.ds.aux_table[AuxTables.cell_domain].create_db_index(self.ds.engine, ['_tid_'])
             self.ds.aux_table[AuxTables.cell_domain].create_db_index(self.ds.engine, ['_cid_'])
-            query = "SELECT _vid_, _cid_, _tid_, attribute, a.rv_val, a.val_id from %s , unnest(string_to_array(regexp_replace(domain,\'[{\"\"}]\',\'\',\'gi\'),\'|||\')) WITH ORDINALITY a(rv_val,val_id)" % AuxTables.cell_domain.name
-            self.ds.generate_aux_table_sql(AuxTables.pos_values, query, index_attrs=['_tid_', 'attribute'])
+            pos_values = domain.to_pos_values_df(enc, self.ds.attr_to_idx, self.ds.attr_number)
+            self.ds.generate_aux_table(AuxTables.pos_values, pos_values, store=True, index_attrs=['_tid_', 'attribute'])
+            self.ds.aux_table[AuxTables.pos_values].create_db_index(self.ds.engine, ['_vid_'])
+
+    def stream_domains(self):
+        """
+        Generates the domain shard by shard and bulk-writes the cell_domain and pos_values
+        rows of every shard as soon as it is ready, so memory for the tables is bounded by
+        the shard size. Only the compact CSR domain is kept in memory.
+        """
+        if not self.setup_complete:
+            raise Exception(
+                "Call <setup_attributes> to setup active attributes. Error detection should be performed before setup.")
+        enc = self.ds.get_encoded_data()
+        domain = CellDomain(sorted(self.active_attributes))
+        for vid, shard_domain in self.generate_domain_shards():
+            new = vid == 0
+            self.ds.append_aux_table(AuxTables.cell_domain,
+                shard_domain.to_cell_domain_df(enc, self.ds.attr_to_idx, self.ds.attr_number, vid_start=vid), new=new)
+            self.ds.append_aux_table(AuxTables.pos_values,
+                shard_domain.to_pos_values_df(enc, self.ds.attr_to_idx, self.ds.attr_number, vid_start=vid), new=new)
+            domain.extend(shard_domain)
+        domain.finalize()
+        if domain.num_vars() == 0:
+            raise Exception("ERROR: Generated domain is empty.")
+        self.ds.set_domain(domain)
+        for attrs in [['_vid_'], ['_tid_'], ['_cid_']]:
+            self.ds.aux_table[AuxTables.cell_domain].create_db_index(self.ds.engine, attrs)
+        for attrs in [['_tid_', 'attribute'], ['_vid_']]:
+            self.ds.aux_table[AuxTables.pos_values].create_db_index(self.ds.engine, attrs)
 
     def setup_attributes(self):
         try:
             self.active_attributes = self.get_active_attributes()
         except Exception as e:
             print("ERROR in domain generation: %s"%str(e))
-        total, single_stats, pair_stats = self.ds.get_statistics()
-        self.total = total
-        self.single_stats = single_stats
+        self.stats = self.ds.get_statistics()
+        self.total = self.stats.total
         try:
             tic = time.clock()
-            self.pair_stats = self.preproc_pair_stats(pair_stats)
+            self.candidates = self.setup_candidates(self.stats)
             toc = time.clock()
             if self.verbose:
                 prep_time = toc - tic
@@ -83,25 +125,21 @@ class DomainEngine:
             print("ERROR in pair statistics preprocessing: %s" % str(e))
         self.setup_complete = True
 
-    def preproc_pair_stats(self, pair_stats):
+    def setup_candidates(self, stats):
+        """
+        Precomputes the candidate tables used during domain generation, one per pair
+        (correlated attribute -> active attribute). Row x of a table holds the codes of the
+        active attribute whose co-occurrence count with (correlated attribute = x)
+        is above topk*count(correlated attribute = x).
+        Pair statistics are computed lazily, so only these pairs are materialized.
+        """
         out = {}
-        for key1 in tqdm(pair_stats):
-            if key1 == '_tid_':
-                continue
-            out[key1] = {}
-            for key2 in pair_stats[key1]:
-                if key1 == '_tid_':
+        for attr in tqdm(sorted(self.active_attributes)):
+            out[attr] = []
+            for cond_attr in self.get_corr_attributes(attr):
+                if cond_attr == attr:
                     continue
-                df = pair_stats[key1][key2]
-                if not df.empty:
-                    out[key1][key2] = dictify(df)
-                    for val in out[key1][key2]:
-                        denominator = self.single_stats[key1][val]
-                        tau = float(self.topk*denominator)
-                        top_cands = [k for (k, v) in out[key1][key2][val].items() if v > tau]
-                        out[key1][key2][val] = top_cands
-                else:
-                    out[key1][key2] = {}
+                out[attr].append((cond_attr, stats.cond_candidates(cond_attr, attr, self.topk)))
         return out
 
     # Method to find attributes to be modeled.
@@ -115,91 +153,168 @@ class DomainEngine:
         return set(itertools.chain(*result))
 
     def get_corr_attributes(self, attr):
-        cor_attrs = []
-        if attr in self.correlations:
-            d_temp = self.correlations[attr]
-            d_temp = d_temp.abs()
-            cor_attrs = [rec[0] for rec in d_temp[d_temp > self.cor_strength].iteritems()]
-            cor_attrs.remove(attr)
-        return cor_attrs
+        return self.corr_engine.get_neighbors(attr)
 
     def generate_domain(self):
         """
         Generate the domain for each cell in the active attributes.
-        :return: a dataframe of schema [tid, attr, value]
+        Domains are computed per attribute over whole columns of the encoded dataset.
+        :return: a dataframe with the schema of cell_domain
         """
         if not self.setup_complete:
             raise Exception(
                 "Call <setup_attributes> to setup active attributes. Error detection should be performed before setup.")
-        # Iterate over dataset rows
-        cells = []
+        domain = CellDomain(sorted(self.active_attributes))
+        for _, shard_domain in self.generate_domain_shards():
+            domain.extend(shard_domain)
+        domain.finalize()
+        return domain
+
+    def generate_domain_shards(self):
+        """
+        Splits the tuples into shards of shard_size tuples and generates their domains,
+        in the process pool of the session. Every shard draws from its own RNG
+        stream seeded with (seed, shard index), so results do not depend on the number of workers.
+        :return: generator of (first _vid_, CellDomain) per shard, in tuple order.
+        """
+        enc = self.ds.get_encoded_data()
+        attrs = sorted(self.active_attributes)
+        ctx = {'attrs': attrs, 'seed': self.env['seed'],
+               'sampling_prob': self.sampling_prob, 'max_sample': self.max_sample}
+        for attr in attrs:
+            ctx[attr] = {'codes': enc.get_codes(attr),
+                         'cond_codes': [enc.get_codes(cond_attr) for cond_attr, _ in self.candidates[attr]],
+                         'cands': [c for _, c in self.candidates[attr]],
+                         'nan_code': enc.encode(attr, '_nan_'),
+                         'pool_size': enc.domain_size(attr)}
+        shards = [(idx, start, min(start+self.shard_size, enc.num_tuples))
+                  for idx, start in enumerate(range(0, enc.num_tuples, self.shard_size))]
+        results = self.ds.executor.imap_context(gen_domain_shard, ctx, shards)
         vid = 0
-        records = self.ds.get_raw_data().to_records()
-        self.all_attrs = list(records.dtype.names)
-        for row in tqdm(list(records)):
-            tid = row['_tid_']
-            app = []
-            for attr in self.active_attributes:
-                init_value, dom = self.get_domain_cell(attr, row)
-                init_value_idx = dom.index(init_value)
-                if len(dom) > 1:
-                    cid = self.ds.get_cell_id(tid, attr)
-                    app.append({"_tid_": tid, "attribute": attr, "_cid_": cid, "_vid_":vid, "domain": "|||".join(dom),  "domain_size": len(dom),
-                                "init_value": init_value, "init_index": init_value_idx, "fixed":0})
-                    vid += 1
-                else:
-                    add_domain = self.get_random_domain(attr,init_value)
-                    # Check if attribute has more than one unique values
-                    if len(add_domain) > 0:
-                        dom.extend(self.get_random_domain(attr,init_value))
-                        cid = self.ds.get_cell_id(tid, attr)
-                        app.append({"_tid_": tid, "attribute": attr, "_cid_": cid, "_vid_": vid, "domain": "|||".join(dom),
-                                    "domain_size": len(dom),
-                                    "init_value": init_value, "init_index": init_value_idx, "fixed": 1})
-                        vid += 1
-            cells.extend(app)
-        domain_df = pd.DataFrame(data=cells)
-        return domain_df
-
-    def get_domain_cell(self, attr, row):
-        domain = set([])
-        correlated_attributes = self.get_corr_attributes(attr)
-        for cond_attr in correlated_attributes:
-            if cond_attr == attr or cond_attr == 'index' or cond_attr == '_tid_':
-                continue
-            cond_val = row[cond_attr]
-            if not pd.isnull(cond_val):
-                if not self.pair_stats[cond_attr][attr]:
-                    break
-                s = self.pair_stats[cond_attr][attr]
-                try:
-                    candidates = s[cond_val]
-                    domain.update(set(candidates))
-                except KeyError as missing_val:
-                    if pd.isnull(row[attr]):
-                        pass
-                    else:
-                        raise Exception(missing_val)
-        # Remove _nan_ if added due to correlated attributes
-        domain.discard('_nan_')
-        # Add initial value in domain
-        if pd.isnull(row[attr]):
-            domain.update(set(['_nan_']))
-            init_value = '_nan_'
-        else:
-            domain.update(set([row[attr]]))
-            init_value = row[attr]
-        return init_value, list(domain)
-
-    def get_random_domain(self, attr, cur_value):
-        if random.random() > self.sampling_prob:
-            return []
-        domain_pool = set(self.single_stats[attr].index.astype(str))
-        domain_pool.remove(cur_value)
-        size = len(domain_pool)
-        if size > 0:
-            k = min(self.max_sample, size)
-            additional_values = random.sample(domain_pool, k)
-        else:
-            additional_values = []
-        return additional_values
+        for shard in tqdm(results, total=len(shards)):
+            # Variables are numbered in (tuple, attribute) order.
+            shard_domain = CellDomain.from_shard(shard, attrs)
+            yield vid, shard_domain
+            vid += shard_domain.num_vars()
+
+    def get_random_domain(self, attr, init_codes, rng):
+        """
+        Samples up to max_sample additional values of <attr> for each of the given cells,
+        excluding the initial value of the cell.
+        :return: np.array of shape (len(init_codes), k) with the sampled codes.
+        """
+        return sample_other_codes(rng, init_codes, self.ds.get_encoded_data().domain_size(attr), self.max_sample)
+
+
+def shard_rng(seed, shard_idx):
+    return np.random.RandomState([seed, shard_idx])
+
+
+def gen_domain_shard(ctx, args):
+    """
+    Generates the domains of all active attributes for the tuples in [start, end).
+    :param ctx: read-only state (codes, candidate tables, ...) shared by all the shards
+    :return: list of (attr, rows, offsets, codes, init_index, fixed) per active attribute.
+    """
+    shard_idx, start, end = args
+    rng = shard_rng(ctx['seed'], shard_idx)
+    out = []
+    for attr in ctx['attrs']:
+        a = ctx[attr]
+        offsets, codes, init_index, fixed, rows = gen_attr_domain(a['codes'][start:end],
+            [c[start:end] for c in a['cond_codes']], a['cands'], a['nan_code'], a['pool_size'],
+            ctx['sampling_prob'], ctx['max_sample'], rng)
+        out.append((attr, rows + start, offsets, codes, init_index, fixed))
+    return out
+
+
+def expand_candidates(cond_codes, cands):
+    """
+    Joins every tuple with the candidate table of its correlated value.
+    :param cond_codes: codes of the correlated attribute for each tuple
+    :param cands: csr matrix of candidate codes per value of the correlated attribute
+    :return: (rows, codes) with one entry per (tuple, candidate)
+    """
+    lengths = np.diff(cands.indptr)[cond_codes]
+    rows = np.repeat(np.arange(len(cond_codes)), lengths)
+    ends = np.cumsum(lengths)
+    pos = np.arange(ends[-1] if len(ends) else 0) - np.repeat(ends - lengths, lengths)
+    codes = cands.indices[np.repeat(cands.indptr[cond_codes], lengths) + pos]
+    return rows, codes
+
+
+def sample_without_replacement(rng, n, pool_size, k):
+    """
+    :return: np.array of shape (n, k) where every row holds k distinct integers in [0, pool_size).
+    """
+    if n == 0 or k == 0:
+        return np.zeros((n, k), dtype=np.int64)
+    if pool_size <= 4*k:
+        # Small pools: keep the k smallest of random keys, in chunks to bound memory.
+        out = np.empty((n, k), dtype=np.int64)
+        step = max(1, 1000000 // pool_size)
+        for start in range(0, n, step):
+            end = min(n, start+step)
+            out[start:end] = np.argsort(rng.rand(end-start, pool_size), axis=1)[:, :k]
+        return out
+    # Large pools: draw with replacement and redraw the (few) rows with collisions.
+    out = rng.randint(0, pool_size, size=(n, k)).astype(np.int64)
+    while True:
+        srt = np.sort(out, axis=1)
+        dup = (srt[:, 1:] == srt[:, :-1]).any(axis=1)
+        if not dup.any():
+            return out
+        out[dup] = rng.randint(0, pool_size, size=(int(dup.sum()), k))
+
+
+def sample_other_codes(rng, init_codes, pool_size, max_sample):
+    """
+    Samples min(max_sample, pool_size-1) distinct codes per cell, all different from the cell's code.
+    """
+    k = min(max_sample, pool_size - 1)
+    sampled = sample_without_replacement(rng, len(init_codes), pool_size - 1, k)
+    # Skip over the initial value: [0, pool_size-1) -> [0, pool_size) \ {init}
+    return sampled + (sampled >= init_codes[:, None])
+
+
+def gen_attr_domain(attr_codes, cond_codes, cands, nan_code, pool_size, sampling_prob, max_sample, rng):
+    """
+    Generates the domains of all cells of one attribute.
+    The domain of a cell is its initial value plus the candidates of its correlated values
+    (without _nan_). Cells whose domain is a single value get, with probability sampling_prob,
+    randomly sampled extra values and are marked as fixed; the remaining ones are dropped.
+    :return: (offsets, codes, init_index, fixed, rows): the domain of the i-th generated cell
+    is codes[offsets[i]:offsets[i+1]] and belongs to tuple position rows[i].
+    """
+    n = len(attr_codes)
+    all_rows = [np.arange(n)]
+    all_codes = [attr_codes]
+    for codes, cand in zip(cond_codes, cands):
+        r, c = expand_candidates(codes, cand)
+        if nan_code >= 0:
+            keep = c != nan_code
+            r, c = r[keep], c[keep]
+        all_rows.append(r)
+        all_codes.append(c)
+    keys = np.unique(np.concatenate(all_rows).astype(np.int64)*pool_size + np.concatenate(all_codes))
+    sizes = np.bincount(keys // pool_size, minlength=n)
+    # Single-valued domains: sample extra values with probability sampling_prob.
+    single = np.nonzero(sizes == 1)[0]
+    fixed_rows = np.zeros(0, dtype=np.int64)
+    if pool_size > 1 and len(single) > 0:
+        fixed_rows = single[rng.rand(len(single)) <= sampling_prob]
+        extra = sample_other_codes(rng, attr_codes[fixed_rows], pool_size, max_sample)
+        extra_keys = np.repeat(fixed_rows.astype(np.int64), extra.shape[1])*pool_size + extra.ravel()
+        keys = np.unique(np.concatenate([keys, extra_keys]))
+    rows_per_key = keys // pool_size
+    codes = keys % pool_size
+    sizes = np.bincount(rows_per_key, minlength=n)
+    fixed = np.zeros(n, dtype=np.int64)
+    fixed[fixed_rows] = 1
+    # Keep cells with more than one candidate value.
+    rows = np.nonzero(sizes > 1)[0]
+    keep = sizes[rows_per_key] > 1
+    codes = codes[keep]
+    offsets = np.concatenate([[0], np.cumsum(sizes[rows])])
+    init_index = np.nonzero(codes == np.repeat(attr_codes[rows], sizes[rows]))[0] - offsets[:-1]
+    return offsets, codes, init_index, fixed[rows], rows
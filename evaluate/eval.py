@@ -42,6 +42,7 @@ class EvalEngine:
             raw_data['_value_'] = raw_data['_value_'].apply(lambda x: x.strip())
             self.clean_data = Table(name, Source.DF, raw_data)
             self.clean_data.store_to_db(self.ds.engine.engine)
+            self.ds.engine.invalidate(name, raw_data)
             self.clean_data.create_db_index(self.ds.engine, ['_tid_'])
             self.clean_data.create_db_index(self.ds.engine, ['_attribute_'])
             status = 'DONE Loading '+f_name
@@ -1,4 +1,4 @@
-from dataset import Dataset
+from dataset import Dataset, Executor
 from dcparser import Parser
 from domain import DomainEngine
 from detect import DetectEngine
@@ -90,7 +90,27 @@ arguments = [
       'dest': 'batch_size',
       'default': 1,
       'type': int,
-      'help': 'The batch size during training.'})
+      'help': 'The batch size during training.'}),
+    (('-c', '--cache-dir'),
+     {'metavar': 'CACHE_DIR',
+      'dest': 'cache_dir',
+      'default': None,
+      'type': str,
+      'help': 'Directory to cache statistics and correlations across runs. Disabled if not set.'}),
+    (('--corr-method',),
+     {'metavar': 'CORR_METHOD',
+      'dest': 'corr_method',
+      'default': 'pearson',
+      'type': str,
+      'help': 'Measure of attribute dependence used to find correlated attributes (pearson, nmi or cramers_v). '
+              'The correlation threshold of the domain engine is calibrated for pearson: nmi and cramers_v '
+              'select different attributes and nmi is biased upwards for near-unique attributes.'}),
+    (('--corr-sample-size',),
+     {'metavar': 'CORR_SAMPLE_SIZE',
+      'dest': 'corr_sample_size',
+      'default': 100000,
+      'type': int,
+      'help': 'Number of sampled tuples used to estimate attribute correlations.'})
 ]
 
 # Flags for Holoclean mode
@@ -104,7 +124,14 @@ flags = [
         {'default': False,
          'dest': 'bias',
          'action': 'store_true',
-         'help': 'Use bias term'})
+         'help': 'Use bias term'}),
+    (tuple(['--lossy-backup']),
+        {'default': False,
+         'dest': 'lossy_backup',
+         'action': 'store_true',
+         'help': 'Run the backup of a featurization query instead of the query whenever it is faster. '
+                 'Backups report whether a candidate value violates a constraint instead of the '
+                 'number of violations. By default backups only replace queries that time out.'})
 ]
 
 class HoloClean:
@@ -157,15 +184,24 @@ class Session:
         # Initialize members
         self.name = name
         self.env = env
-        self.ds = Dataset(name,env)
+        # Process pool shared by the dataset, its database engine, the domain engine and the featurizers.
+        self.executor = Executor(env['threads'])
+        self.ds = Dataset(name, env, executor=self.executor)
         self.dc_parser = Parser(env, self.ds)
-        self.domain_engine = DomainEngine(env, self.ds)
+        self.domain_engine = DomainEngine(env, self.ds, corr_method=env['corr_method'],
+                                          corr_sample_size=env['corr_sample_size'])
         self.detect_engine = DetectEngine(env, self.ds)
         self.repair_engine = RepairEngine(env, self.ds)
         self.eval_engine = EvalEngine(env, self.ds)
 
-    def load_data(self, name, f_path, f_name, na_values=None):
-        status, load_time = self.ds.load_data(name, f_path,f_name, na_values=na_values)
+    def close(self):
+        """
+        Shuts down the processes of the session.
+        """
+        self.executor.close()
+
+    def load_data(self, name, f_path, f_name, na_values=None, chunksize=None):
+        status, load_time = self.ds.load_data(name, f_path,f_name, na_values=na_values, chunksize=chunksize)
         print(status)
         if self.env['verbose']:
             print('Time to load dataset: %.2f secs'%load_time)
@@ -185,6 +221,16 @@ class Session:
         if self.env['verbose']:
             print('Time to detect errors: %.2f secs'%detect_time)
 
+    def detect_new_errors(self, detect_list, df):
+        """
+        Appends the tuples in <df> to the dataset and detects the errors they introduce.
+        The domain does not cover the new tuples: call setup_domain again before repairing.
+        """
+        status, detect_time = self.detect_engine.detect_new_errors(detect_list, df)
+        print(status)
+        if self.env['verbose']:
+            print('Time to detect errors in new tuples: %.2f secs'%detect_time)
+
     def setup_domain(self):
         status, domain_time = self.domain_engine.setup()
         print(status)
@@ -1,9 +1,11 @@
 from string import Template
-from functools import partial
+from collections import OrderedDict
+import numpy as np
 import torch
 import torch.nn.functional as F
 
 from .featurizer import Featurizer
+from .violationcount import ViolationCounter
 from dataset import AuxTables
 from dcparser.constraint import is_symmetric
 
@@ -26,47 +28,156 @@ ex_binary_template = Template ('SELECT _vid_, val_id, 1 violations '\
                                'WHERE $join_rel._tid_ != $other_rel._tid_ ' \
                                'AND $orig_predicates AND t3.rv_val $operation $rv_val)')
 
-def gen_feat_tensor(violations, total_vars, classes):
-    tensor = torch.zeros(total_vars,classes,1)
-    if violations:
-        for entry in violations:
-            vid = int(entry[0])
-            val_id = int(entry[1]) - 1
-            feat_val = float(entry[2])
-            tensor[vid][val_id][0] = feat_val
-    return tensor
+# Shared-scan variants: relaxed queries that only differ in their remaining (non join key)
+# predicates are evaluated once, with one violation count per original query.
+shared_unary_template = Template('SELECT _vid_, val_id, $counts '\
+                                 'FROM $init_table as t1, $pos_values as t2 '\
+                                 'WHERE t1._tid_ = t2._tid_ AND t2.attribute = \'$rv_attr\' '\
+                                   'AND t2.rv_val $operation $rv_val AND ($any_predicates) '\
+                                 'GROUP BY _vid_, val_id')
+
+shared_binary_template = Template('SELECT _vid_, val_id, $counts '\
+                                  'FROM $init_table as t1, $init_table as t2, $pos_values as t3 '\
+                                  'WHERE t1._tid_ != t2._tid_ AND $join_rel._tid_ = t3._tid_ AND t3.attribute = \'$rv_attr\' '\
+                                    'AND $key_predicates t3.rv_val $operation $rv_val AND ($any_predicates) '\
+                                  'GROUP BY _vid_, val_id')
+
+shared_ex_binary_template = Template('SELECT * FROM (SELECT _vid_, val_id, $exists '\
+                                     'FROM $init_table as $join_rel, $pos_values as t3 '\
+                                     'WHERE $join_rel._tid_ = t3._tid_ AND t3.attribute = \'$rv_attr\') AS q '\
+                                     'WHERE $any_violation')
+
+ex_column_template = Template('(EXISTS (SELECT $other_rel._tid_ FROM $init_table AS $other_rel '\
+                              'WHERE $join_rel._tid_ != $other_rel._tid_ '\
+                              'AND $orig_predicates AND t3.rv_val $operation $rv_val))::int AS v$idx')
+
+
+def to_cnf(predicates):
+    return " AND ".join([pred.cnf_form for pred in predicates]) or 'TRUE'
 
 
 class ConstraintFeat(Featurizer):
 
-    def __init__(self, name='ConstraintFeat'):
+    def __init__(self, name='ConstraintFeat', in_memory=True):
+        """
+        :param in_memory: compute the violation counts of relaxed constraints made of equality
+        predicates (see ViolationCounter) from group sizes instead of SQL self-joins.
+        """
         super(ConstraintFeat, self).__init__(name)
+        self.in_memory = in_memory
 
     def specific_setup(self):
         self.constraints = self.ds.constraints
         self.init_table_name = self.ds.raw_data.name
+        self.counter = None
+        if self.in_memory:
+            self.counter = ViolationCounter(self.ds.get_encoded_data(), self.ds.get_domain())
 
     def create_tensor(self):
-        queries = self.generate_relaxed_sql()
-        results = self.ds.engine.execute_queries_w_backup(queries)
-        # tensors = self.pool.map(partial(gen_feat_tensor, total_vars=self.total_vars, classes=self.classes), results)
-        tensors = list(map(partial(gen_feat_tensor, total_vars=self.total_vars, classes=self.classes), results))
-        combined = torch.cat(tensors,2)
+        relaxed = self.gen_relaxed_predicates()
+        tensor = np.zeros((self.total_vars, self.classes, len(relaxed)), dtype=np.float32)
+        in_memory = [self.counter is not None and self.counter.supports(*entry[3]) for entry in relaxed]
+        mem_idx = [idx for idx in range(len(relaxed)) if in_memory[idx]]
+        sql_idx = [idx for idx in range(len(relaxed)) if not in_memory[idx]]
+        results = []
+        if sql_idx:
+            queries, slices = self.generate_relaxed_sql([relaxed[idx] for idx in sql_idx])
+            # Every relaxed query is a column of a (possibly shared) query result.
+            columns = [[] for _ in queries]
+            for idx, (q_idx, col) in zip(sql_idx, slices):
+                columns[q_idx].append((idx, col))
+            results = self.ds.engine.imap_queries_w_backup(queries)
+        # The in-memory counts are computed while the queries run.
+        for idx in mem_idx:
+            vids, pos, violations = self.counter.count(*relaxed[idx][3])
+            tensor[vids, pos, idx] = violations
+        # Scatter the violations of every query as soon as it completes.
+        for q_idx, res in results:
+            for idx, col in columns[q_idx]:
+                rows = np.array([(row[0], row[1], row[2+col]) for row in res if row[2+col]],
+                                dtype=np.float64).reshape(-1, 3)
+                tensor[rows[:, 0].astype(np.int64), rows[:, 1].astype(np.int64) - 1, idx] = rows[:, 2]
+        combined = torch.from_numpy(tensor)
         combined = F.normalize(combined, p=2, dim=1)
         return combined
 
-    def generate_relaxed_sql(self):
-        query_list = []
+    def gen_relaxed_predicates(self):
+        """
+        :return: list of (template kind, template parameters, original predicates,
+        (constraint, relaxed predicate, relaxed tuple)), one per feature.
+        """
+        relaxed = []
         for key in self.constraints:
             # Check tuples in constraint
             c = self.constraints[key]
             unary = len(c.tuple_names)==1
             if unary:
-                queries = self.gen_unary_queries(c)
+                relaxed.extend(self.gen_unary_queries(c))
             else:
-                queries = self.gen_binary_queries(c)
-            query_list.extend(queries)
-        return query_list
+                relaxed.extend(self.gen_binary_queries(c))
+        return relaxed
+
+    def generate_relaxed_sql(self, relaxed=None):
+        """
+        :return: (queries, slices) where queries is a list of (query, backup query) and slices
+        holds, for every relaxed predicate, the (query index, count column) of its violations.
+        """
+        if relaxed is None:
+            relaxed = self.gen_relaxed_predicates()
+        return self.share_relaxed_queries(relaxed)
+
+    def share_relaxed_queries(self, relaxed):
+        """
+        Groups relaxed queries with the same template, relaxed predicate and join keys
+        and generates one query per group.
+        """
+        groups = OrderedDict()
+        slices = []
+        for kind, params, orig_preds, _ in relaxed:
+            keys = [p for p in orig_preds if p.is_join_key()] if kind != 'unary' else []
+            rest = [p for p in orig_preds if p not in keys]
+            shape = (kind, tuple(sorted(params.items())), tuple(sorted(p.cnf_form for p in keys)))
+            if shape not in groups:
+                groups[shape] = (len(groups), [])
+            q_idx, group = groups[shape]
+            slices.append((q_idx, len(group)))
+            group.append((kind, params, orig_preds, keys, rest))
+        queries = [self.gen_shared_query(group) for _, group in groups.values()]
+        return queries, slices
+
+    def gen_shared_query(self, group):
+        kind, params, _, keys, _ = group[0]
+        tables = dict(init_table=self.init_table_name, pos_values=AuxTables.pos_values.name)
+        if len(group) == 1:
+            orig_cnf = to_cnf(group[0][2])
+            if kind == 'unary':
+                return unary_template.substitute(orig_predicates=orig_cnf, **dict(tables, **params)), ''
+            query = binary_template.substitute(orig_predicates=orig_cnf, join_rel=params['join_rel'],
+                                               rv_attr=params['rv_attr'], operation=params['operation'],
+                                               rv_val=params['rv_val'], **tables)
+            if kind == 'binary':
+                return query, ''
+            return query, ex_binary_template.substitute(orig_predicates=orig_cnf, **dict(tables, **params))
+        counts = ', '.join(['count(*) FILTER (WHERE %s)' % to_cnf(rest) for _, _, _, _, rest in group])
+        any_predicates = ' OR '.join(['(%s)' % to_cnf(rest) for _, _, _, _, rest in group])
+        if kind == 'unary':
+            return shared_unary_template.substitute(counts=counts, any_predicates=any_predicates,
+                                                    **dict(tables, **params)), ''
+        key_predicates = ''.join(['%s AND ' % p.cnf_form for p in keys])
+        query = shared_binary_template.substitute(counts=counts, any_predicates=any_predicates,
+                                                  key_predicates=key_predicates, join_rel=params['join_rel'],
+                                                  rv_attr=params['rv_attr'], operation=params['operation'],
+                                                  rv_val=params['rv_val'], **tables)
+        if kind == 'binary':
+            return query, ''
+        exists = ', '.join([ex_column_template.substitute(orig_predicates=to_cnf(orig_preds), idx=idx,
+                                                          **dict(tables, **params))
+                            for idx, (_, _, orig_preds, _, _) in enumerate(group)])
+        any_violation = ' + '.join(['v%d' % idx for idx in range(len(group))]) + ' > 0'
+        backup = shared_ex_binary_template.substitute(exists=exists, any_violation=any_violation,
+                                                      join_rel=params['join_rel'], rv_attr=params['rv_attr'],
+                                                      **tables)
+        return query, backup
 
     def execute_queries(self,queries):
         return self.ds.engine.execute_queries_w_backup(queries)
@@ -84,27 +195,26 @@ class ConstraintFeat(Featurizer):
         return attr, op, const
 
     def get_binary_predicate_join_rel(self, predicate):
-        if 't1' in predicate.cnf_form and 't2' in predicate.cnf_form:
+        if len(predicate.tuples) == 2:
             if is_symmetric(predicate.operation):
                 return True, ['t1'], ['t2']
             else:
                 return True, ['t1','t2'], ['t2', 't1']
-        elif 't1' in predicate.cnf_form and 't2' not in predicate.cnf_form:
-            return False, ['t1'], None
-        elif 't1' not in predicate.cnf_form and 't2' in predicate.cnf_form:
-            return False, ['t2'], None
+        return False, predicate.tuples[:1], None
 
     def gen_unary_queries(self, constraint):
+        """
+        :return: list of (template kind, template parameters, original predicates,
+        (constraint, relaxed predicate, relaxed tuple)), one per relaxed predicate.
+        """
         # Iterate over predicates and relax one predicate at a time
         queries = []
         predicates = constraint.predicates
         for k in range(len(predicates)):
             orig_preds = predicates[:k] + predicates[(k+1):]
-            orig_cnf = " AND ".join([pred.cnf_form for pred in orig_preds])
             rv_attr, op, rv_val = self.relax_unary_predicate(predicates[k])
-            query = unary_template.substitute(init_table=self.init_table_name, pos_values=AuxTables.pos_values.name,
-                                              orig_predicates=orig_cnf, rv_attr=rv_attr, operation=op, rv_val=rv_val)
-            queries.append((query, ''))
+            queries.append(('unary', dict(rv_attr=rv_attr, operation=op, rv_val=rv_val), orig_preds,
+                            (constraint, predicates[k], constraint.tuple_names[0])))
         return queries
 
     def gen_binary_queries(self, constraint):
@@ -112,27 +222,15 @@ class ConstraintFeat(Featurizer):
         predicates = constraint.predicates
         for k in range(len(predicates)):
             orig_preds = predicates[:k] + predicates[(k+1):]
-            orig_cnf = " AND ".join([pred.cnf_form for pred in orig_preds])
             isBinary, join_rel, other_rel = self.get_binary_predicate_join_rel(predicates[k])
             if not isBinary:
                 rv_attr, op, rv_val = self.relax_unary_predicate(predicates[k])
-                query = binary_template.substitute(init_table=self.init_table_name,
-                                                   pos_values=AuxTables.pos_values.name, join_rel=join_rel[0],
-                                                   orig_predicates=orig_cnf, rv_attr=rv_attr, operation=op,
-                                                   rv_val=rv_val)
-                queries.append((query, ''))
+                queries.append(('binary', dict(join_rel=join_rel[0], rv_attr=rv_attr, operation=op, rv_val=rv_val),
+                                orig_preds, (constraint, predicates[k], join_rel[0])))
             else:
                 for idx, rel in enumerate(join_rel):
                     rv_attr, op, rv_val = self.relax_binary_predicate(predicates[k], idx)
-                    query = binary_template.substitute(init_table=self.init_table_name,
-                                                       pos_values=AuxTables.pos_values.name, join_rel=rel,
-                                                       orig_predicates=orig_cnf, rv_attr=rv_attr, operation=op,
-                                                       rv_val=rv_val)
-                    ex_query = ex_binary_template.substitute(init_table=self.init_table_name,
-                                                       pos_values=AuxTables.pos_values.name, join_rel=rel,
-                                                       orig_predicates=orig_cnf, rv_attr=rv_attr, operation=op,
-                                                       rv_val=rv_val, other_rel=other_rel[idx])
-                    queries.append((query, ex_query))
+                    queries.append(('binary_ex', dict(join_rel=rel, other_rel=other_rel[idx], rv_attr=rv_attr,
+                                                      operation=op, rv_val=rv_val), orig_preds,
+                                    (constraint, predicates[k], rel)))
         return queries
-
-
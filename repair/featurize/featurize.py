@@ -1,5 +1,5 @@
+import numpy as np
 import torch
-from tqdm import tqdm
 
 from dataset import AuxTables
 
@@ -9,9 +9,8 @@ class FeaturizedDataset:
         self.ds = dataset
         self.env = env
         self.total_vars, self.classes = self.ds.get_domain_info()
-        self.processes = self.env['threads']
         for f in featurizers:
-            f.setup_featurizer(self.ds, self.total_vars, self.classes, self.processes)
+            f.setup_featurizer(self.ds, self.total_vars, self.classes)
         tensors = [f.create_tensor() for f in featurizers]
         tensor = torch.cat(tensors,2)
         self.tensor = tensor
@@ -25,14 +24,14 @@ class FeaturizedDataset:
         query = 'SELECT _vid_, init_index FROM %s AS t1 LEFT JOIN %s AS t2 ' \
                 'ON t1._cid_ = t2._cid_ WHERE t2._cid_ is NULL OR t1.fixed = 1;' % (
         AuxTables.cell_domain.name, AuxTables.dk_cells.name)
-        res = self.ds.engine.execute_query(query)
-        if len(res) == 0:
+        labels = -1 * np.ones((self.total_vars, 1), dtype=np.int64)
+        count = 0
+        for batch in self.ds.engine.stream_query(query):
+            labels[batch['_vid_'].values.astype(np.int64), 0] = batch['init_index'].values
+            count += len(batch)
+        if count == 0:
             raise Exception("No weak labels available. Reduce pruning threshold.")
-        labels = -1 * torch.ones(self.total_vars, 1).type(torch.LongTensor)
-        for tuple in tqdm(res):
-            vid = int(tuple[0])
-            label = int(tuple[1])
-            labels[vid] = label
+        labels = torch.from_numpy(labels)
         if self.env['verbose']:
             print("DONE generating weak labels.")
         return labels
@@ -42,13 +41,14 @@ class FeaturizedDataset:
             print("Generating mask.")
         var_to_domsize = {}
         query = 'SELECT _vid_, domain_size FROM %s' % AuxTables.cell_domain.name
-        res = self.ds.engine.execute_query(query)
-        mask = torch.zeros(self.total_vars,self.classes)
-        for tuple in tqdm(res):
-            vid = int(tuple[0])
-            max_class = int(tuple[1])
-            mask[vid, max_class:] = -10e6
-            var_to_domsize[vid] = max_class
+        mask = np.zeros((self.total_vars, self.classes), dtype=np.float32)
+        classes = np.arange(self.classes)
+        for batch in self.ds.engine.stream_query(query):
+            vids = batch['_vid_'].values.astype(np.int64)
+            domsize = batch['domain_size'].values.astype(np.int64)
+            mask[vids] = np.where(classes[None, :] >= domsize[:, None], -10e6, 0.0)
+            var_to_domsize.update(zip(vids.tolist(), domsize.tolist()))
+        mask = torch.from_numpy(mask)
         if self.env['verbose']:
             print("DONE generating mask.")
         return mask, var_to_domsize
@@ -1,5 +1,4 @@
 from abc import ABCMeta, abstractmethod
-from multiprocessing import Pool
 
 
 class Featurizer:
@@ -9,11 +8,10 @@ class Featurizer:
         self.name = name
         self.setup_done = False
 
-    def setup_featurizer(self, dataset, total_vars, classes, processes=20):
+    def setup_featurizer(self, dataset, total_vars, classes):
         self.ds = dataset
         self.total_vars = total_vars
         self.classes = classes
-        self.pool = Pool(processes)
         self.setup_done = True
         self.specific_setup()
 
@@ -1,25 +1,14 @@
-from functools import partial
+import numpy as np
 import torch
 import Levenshtein
 
-from dataset import AuxTables
 from .featurizer import Featurizer
 
 
-def gen_feat_tensor(input, classes, total_attrs):
-    vid = int(input[0])
-    attr_idx = input[1]
-    init_value = input[2]
-    # TODO: To add more similarity metrics increase the last dimension of tensor.
-    tensor = torch.zeros(1, classes, total_attrs)
-    domain = input[2].split('|||')
-    for idx, val in enumerate(domain):
-        if val == init_value:
-            sim = -1.0
-        else:
-            sim = 2*Levenshtein.ratio(val, init_value) - 1
-        tensor[0][idx][attr_idx] = sim
-    return tensor
+def gen_sim(val, init_value):
+    if val == init_value:
+        return -1.0
+    return 2*Levenshtein.ratio(val, init_value) - 1
 
 
 class InitSimFeaturizer(Featurizer):
@@ -31,11 +20,19 @@ class InitSimFeaturizer(Featurizer):
         self.total_attrs = len(self.ds.attr_to_idx)
 
     def create_tensor(self):
-        query = 'SELECT _vid_, attribute, init_value, domain FROM %s ORDER BY _vid_'%AuxTables.cell_domain.name
-        results = self.ds.engine.execute_query(query)
-        map_input = []
-        for res in results:
-            map_input.append((res[0],self.attr_to_idx[res[1]],res[2]))
-        tensors = self.pool.map(partial(gen_feat_tensor, classes=self.classes, total_attrs=self.total_attrs), map_input)
-        combined = torch.cat(tensors)
-        return combined
+        domain = self.ds.get_domain()
+        enc = self.ds.get_encoded_data()
+        # TODO: To add more similarity metrics increase the last dimension of tensor.
+        tensor = np.zeros((self.total_vars, self.classes, self.total_attrs), dtype=np.float32)
+        init_codes = domain.init_codes()
+        for attribute in domain.attrs:
+            vids, pos, codes = domain.get_attr_entries(attribute)
+            if len(vids) == 0:
+                continue
+            values = enc.get_values(attribute)
+            # Compute the similarity once per distinct (init value, candidate value) pair.
+            pairs = np.stack([init_codes[vids], codes], axis=1)
+            uniq_pairs, inverse = np.unique(pairs, axis=0, return_inverse=True)
+            sims = np.array([gen_sim(values[c], values[i]) for i, c in uniq_pairs], dtype=np.float32)
+            tensor[vids, pos, self.attr_to_idx[attribute]] = sims[inverse.ravel()]
+        return torch.from_numpy(tensor)
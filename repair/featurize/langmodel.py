@@ -1,8 +1,8 @@
+import numpy as np
 import torch
 from gensim.models import FastText
 
 
-from dataset import AuxTables
 from .featurizer import Featurizer
 
 
@@ -14,29 +14,23 @@ class LangModelFeat(Featurizer):
         self.emb_size = 10
         self.attrs_number = len(self.ds.attr_to_idx)
         self.attr_language_model = {}
-        raw_data = self.ds.get_raw_data()
+        enc = self.ds.get_encoded_data()
         for attr in self.ds.attr_to_idx:
-            attr_corpus = list(zip(raw_data[attr].tolist()))
+            attr_corpus = list(zip(enc.decode(attr).tolist()))
             model = FastText(attr_corpus, min_count=1, size=self.emb_size)
             self.attr_language_model[attr] = model
 
-    def gen_feat_tensor(self, input, classes):
-        vid = int(input[0])
-        attribute = input[1]
-        domain = input[2].split('|||')
-        attr_idx = self.ds.attr_to_idx[attribute]
-        model = self.attr_language_model[attribute]
-        tensor = torch.zeros(1, classes, self.attrs_number*self.emb_size)
-        for idx, val in enumerate(domain):
-            emb_val = model[val]
-            start = attr_idx*self.emb_size
-            end = start+self.emb_size
-            tensor[0][idx][start:end] = torch.tensor(emb_val)
-        return tensor
-
     def create_tensor(self):
-        query = 'SELECT _vid_, attribute, domain FROM %s ORDER BY _vid_' % AuxTables.cell_domain.name
-        results = self.ds.engine.execute_query(query)
-        tensors = [self.gen_feat_tensor(res, self.classes) for res in results]
-        combined = torch.cat(tensors)
-        return combined
+        domain = self.ds.get_domain()
+        enc = self.ds.get_encoded_data()
+        tensor = np.zeros((self.total_vars, self.classes, self.attrs_number*self.emb_size), dtype=np.float32)
+        for attribute in domain.attrs:
+            vids, pos, codes = domain.get_attr_entries(attribute)
+            model = self.attr_language_model[attribute]
+            # Embed every distinct candidate value once.
+            uniq_codes, inverse = np.unique(codes, return_inverse=True)
+            emb = np.array([model[val] for val in enc.get_values(attribute)[uniq_codes]], dtype=np.float32)
+            start = self.ds.attr_to_idx[attribute]*self.emb_size
+            end = start+self.emb_size
+            tensor[vids, pos, start:end] = emb.reshape(-1, self.emb_size)[inverse]
+        return torch.from_numpy(tensor)
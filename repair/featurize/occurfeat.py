@@ -1,10 +1,7 @@
-import pandas as pd
+import numpy as np
 import torch
-from tqdm import tqdm
 
 from .featurizer import Featurizer
-from dataset import AuxTables
-from dataset.dataset import dictify
 
 
 class OccurFeaturizer(Featurizer):
@@ -16,67 +13,30 @@ class OccurFeaturizer(Featurizer):
             raise Exception('Featurizer %s is not properly setup.'%self.name)
         self.all_attrs = self.ds.get_attributes()
         self.attrs_number = len(self.ds.attr_to_idx)
-        self.raw_data_dict = {}
+        self.enc = None
         self.total = None
-        self.single_stats = None
-        self.pair_stats = None
+        self.stats = None
         self.setup_stats()
 
     def setup_stats(self):
-        self.raw_data_dict = self.ds.raw_data.df.set_index('_tid_').to_dict('index')
-        total, single_stats, pair_stats = self.ds.get_statistics()
-        self.total = float(total)
-        self.single_stats = {}
-        for attr in single_stats:
-            self.single_stats[attr] = single_stats[attr].to_dict()
-        self.pair_stats = {}
-        for attr1 in tqdm(pair_stats):
-            self.pair_stats[attr1] = {}
-            for attr2 in pair_stats[attr1]:
-                if attr2 == '_tid_':
-                    continue
-                tmp_df = pair_stats[attr1][attr2]
-                self.pair_stats[attr1][attr2] = dictify(tmp_df)
+        self.enc = self.ds.get_encoded_data()
+        self.stats = self.ds.get_statistics()
+        self.total = float(self.stats.total)
 
     def create_tensor(self):
-        # Iterate over tuples in domain
-        tensors = []
-        # Set tuple_id index on raw_data
-        t = self.ds.aux_table[AuxTables.cell_domain]
-        sorted_domain = t.df.reset_index().sort_values(by=['_vid_'])[['_tid_','attribute','_vid_','domain']]
-        records = sorted_domain.to_records()
-        for row in tqdm(list(records)):
-            #Get tuple from raw_dataset
-            tid = row['_tid_']
-            tuple = self.raw_data_dict[tid]
-            feat_tensor = self.gen_feat_tensor(row, tuple)
-            tensors.append(feat_tensor)
-        combined = torch.cat(tensors)
-        return combined
-
-    def gen_feat_tensor(self, row, tuple):
-        tensor = torch.zeros(1, self.classes, self.attrs_number)
-        rv_attr = row['attribute']
-        domain = row['domain'].split('|||')
-        rv_domain_idx = {val: idx for idx, val in enumerate(domain)}
-        for attr in self.all_attrs:
-            if attr != rv_attr and (not pd.isnull(tuple[attr])):
-                attr_idx = self.ds.attr_to_idx[attr]
-                val = tuple[attr]
-                count1 = float(self.single_stats[attr][val])
-                # Get topK values
-                if val not in self.pair_stats[attr][rv_attr]:
-                    if not pd.isnull(tuple[rv_attr]):
-                        raise Exception('Something is wrong with the pairwise statistics. <Val> should be present in dictionary.')
-                else:
-                    all_vals = self.pair_stats[attr][rv_attr][val]
-                    if len(all_vals) <= len(rv_domain_idx):
-                        candidates = all_vals
-                    else:
-                        candidates = domain
-                    for rv_val in candidates:
-                        count2 = float(all_vals.get(rv_val,0.0))
-                        prob = count2/count1
-                        if rv_val in rv_domain_idx:
-                            tensor[0][rv_domain_idx[rv_val]][attr_idx] = prob
-        return tensor
+        domain = self.ds.get_domain()
+        tensor = np.zeros((self.total_vars, self.classes, self.attrs_number), dtype=np.float32)
+        for rv_attr in domain.attrs:
+            vids, pos, codes = domain.get_attr_entries(rv_attr)
+            if len(vids) == 0:
+                continue
+            tids = domain.tids[vids]
+            for attr in self.all_attrs:
+                if attr == rv_attr:
+                    continue
+                # P(rv_attr = candidate | attr = value of the tuple)
+                cond_codes = self.enc.get_codes(attr)[tids]
+                count1 = self.stats.single_counts(attr)[cond_codes].astype(np.float32)
+                count2 = np.asarray(self.stats.pair_counts(attr, rv_attr)[cond_codes, codes]).ravel()
+                tensor[vids, pos, self.ds.attr_to_idx[attr]] = count2/count1
+        return torch.from_numpy(tensor)
@@ -0,0 +1,157 @@
+import numpy as np
+
+from detect.partition import PartitionCache
+
+
+class ViolationCounter:
+    """
+    Computes the number of violations of a relaxed denial constraint for every candidate
+    value of the random variables from group sizes over the encoded dataset, i.e. without
+    joining the raw table with itself. Supported constraints are made of equality join keys,
+    at most one inequality residual on the same attribute of both tuples and equality or
+    inequality filters against literals. The relaxed predicate must be an equality or
+    inequality on the same attribute of both tuples or against a literal.
+
+    For tuple t, candidate value v of its attribute A, group G of the tuples sharing t's
+    join keys (restricted to the other tuples passing their filters):
+      no residual, A = v:    cnt_G(A=v) - [t.A = v]
+      no residual, A <> v:   (|G| - cnt_G(A=v)) - [t.A <> v]
+      residual on B, A = v:  cnt_G(A=v) - cnt_G(A=v, B=t.B)
+      residual on B, A <> v: (|G| - cnt_G(B=t.B)) - (cnt_G(A=v) - cnt_G(A=v, B=t.B))
+    """
+
+    def __init__(self, enc, domain):
+        self.enc = enc
+        self.domain = domain
+        self.partitions = PartitionCache(enc)
+        # (group attrs, filters, attr) -> (sorted keys, counts) of (group, value code) pairs
+        self.pair_counts = {}
+
+    def count(self, c, predicate, rel):
+        """
+        :param c: compiled ConstraintPlan
+        :param predicate: relaxed predicate of <c>
+        :param rel: name of the tuple whose cell takes the candidate values
+        :return: (vids, pos, counts) of all the candidate values of the relaxed attribute or
+        None if the relaxed constraint is not supported.
+        """
+        orig_preds = [p for p in c.predicates if p is not predicate]
+        plan = self.plan(c, orig_preds)
+        relaxed = self.plan_relaxed(c, predicate, rel)
+        if plan is None or relaxed is None:
+            return None
+        keys, residuals, filters = plan
+        attr, op, literal = relaxed
+        vids, pos, codes = self.domain.get_attr_entries(attr)
+        if len(vids) == 0:
+            return vids, pos, np.zeros(0, dtype=np.float32)
+        tids = self.domain.tids[vids]
+        mask1 = self.filter_mask(filters, rel)
+        if len(c.tuple_names) == 1:
+            match = (codes == literal) if op == '=' else (codes != literal)
+            return vids, pos, (mask1[tids] & match).astype(np.float32)
+        other = [name for name in c.tuple_names if name != rel][0]
+        mask2 = self.filter_mask(filters, other)
+        gid = self.partitions.group_ids(keys)
+        size = np.bincount(gid[mask2], minlength=int(gid.max())+1)[gid[tids]]
+        if residuals:
+            sub_gid = self.partitions.group_ids(keys + residuals)
+            # tuples of the group that differ from t on the residual attribute
+            total = size - np.bincount(sub_gid[mask2], minlength=int(sub_gid.max())+1)[sub_gid[tids]]
+        else:
+            # every tuple of the group but t itself
+            total = size - mask2[tids]
+        if literal is not None:
+            match = (codes == literal) if op == '=' else (codes != literal)
+            counts = np.where(match, total, 0)
+        else:
+            same = self.count_pairs(keys, filters, other, mask2, gid, attr, tids, codes)
+            if residuals:
+                same = same - self.count_pairs(keys + residuals, filters, other, mask2, sub_gid, attr, tids, codes)
+            else:
+                same = same - (mask2[tids] & (self.enc.get_codes(attr)[tids] == codes))
+            counts = same if op == '=' else total - same
+        return vids, pos, (counts*mask1[tids]).astype(np.float32)
+
+    def supports(self, c, predicate, rel):
+        """
+        :return: True if count() can compute the violations of the relaxed constraint.
+        """
+        orig_preds = [p for p in c.predicates if p is not predicate]
+        return self.plan(c, orig_preds) is not None and self.plan_relaxed(c, predicate, rel) is not None
+
+    def plan(self, c, orig_preds):
+        """
+        :return: (join key attrs, residual attrs, filters) of the original predicates or None
+        """
+        if len(c.tuple_names) not in (1, 2):
+            return None
+        keys, residuals, filters = [], [], []
+        for p in orig_preds:
+            if p.is_join_key():
+                keys.append(p.attrs[0])
+            elif len(p.tuples) == 2:
+                if p.operation != '<>' or len(set(p.attrs)) != 1:
+                    return None
+                residuals.append(p.attrs[0])
+            else:
+                literal = get_literal(p)
+                if p.operation not in ('=', '<>') or literal is None:
+                    return None
+                filters.append((p.tuples[0], p.attrs[0], p.operation, literal))
+        if len(residuals) > 1:
+            return None
+        return keys, residuals, filters
+
+    def plan_relaxed(self, c, predicate, rel):
+        """
+        :return: (attribute of <rel>, operation, code of the literal or None) of the relaxed predicate or None
+        """
+        if predicate.operation not in ('=', '<>'):
+            return None
+        if len(predicate.tuples) == 2:
+            if len(c.tuple_names) != 2 or len(set(predicate.attrs)) != 1 or predicate.components[0][0] != rel:
+                return None
+            return predicate.attrs[0], predicate.operation, None
+        literal = get_literal(predicate)
+        if literal is None or predicate.tuples != [rel]:
+            return None
+        attr = predicate.attrs[0]
+        # The relaxed query compares the candidate values with the lower-cased literal.
+        return attr, predicate.operation, self.enc.encode(attr, literal.lower())
+
+    def filter_mask(self, filters, tuple_name):
+        mask = np.ones(self.enc.num_tuples, dtype=bool)
+        for name, attr, op, literal in filters:
+            if name != tuple_name:
+                continue
+            match = self.enc.get_codes(attr) == self.enc.encode(attr, literal)
+            mask &= match if op == '=' else ~match
+        return mask
+
+    def count_pairs(self, group_attrs, filters, other, mask2, gid, attr, tids, codes):
+        """
+        :return: number of tuples passing the filters of <other> in the group of every tuple of
+        <tids> and with value <codes> on <attr>.
+        """
+        key = (tuple(sorted(set(group_attrs))), tuple(f for f in filters if f[0] == other), attr)
+        size = self.enc.domain_size(attr)
+        if key not in self.pair_counts:
+            pairs = gid[mask2]*size + self.enc.get_codes(attr)[mask2]
+            self.pair_counts[key] = np.unique(pairs, return_counts=True)
+        uniq, counts = self.pair_counts[key]
+        query = gid[tids]*size + codes
+        idx = np.minimum(np.searchsorted(uniq, query), max(len(uniq)-1, 0))
+        if len(uniq) == 0:
+            return np.zeros(len(tids), dtype=np.int64)
+        return np.where(uniq[idx] == query, counts[idx], 0)
+
+
+def get_literal(predicate):
+    """
+    :return: literal of a predicate comparing one attribute with a literal (without quotes) or None
+    """
+    literals = [comp for comp in predicate.components if isinstance(comp, str)]
+    if len(literals) != 1 or len(predicate.attrs) != 1:
+        return None
+    return literals[0].strip("'")
@@ -2,6 +2,10 @@
 # Set & move to home directory
 source ../set_env.sh
 
+# Launch unit tests (no database needed).
+echo "Launching unit tests..."
+python -m unittest discover unit || exit 1
+
 # Launch test.
 echo "Launching test..."
 python test_holoclean.py
@@ -38,3 +38,6 @@ def get_value(row):
     return row['correct_val'].lower()
 
 hc.evaluate('data', 'hospital_clean.csv', get_tid, get_attr, get_value)
+
+# 6. Shut down the processes of the session.
+hc.close()
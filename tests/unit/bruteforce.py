@@ -0,0 +1,65 @@
+"""
+Helpers shared by the unit tests: small encoded datasets and brute-force (nested loop)
+evaluation of denial constraints used as reference results.
+"""
+import operator
+
+import numpy as np
+import pandas as pd
+
+from dataset.encoding import EncodedDataset
+from dcparser.constraint import DenialConstraint
+from dcparser.plan import ConstraintPlan
+
+operations = {'=': operator.eq, '<>': operator.ne, '<': operator.lt, '>': operator.gt,
+              '<=': operator.le, '>=': operator.ge}
+
+
+def make_enc(rows, attrs):
+    df = pd.DataFrame(rows, columns=attrs)
+    df.insert(0, '_tid_', range(len(df)))
+    return EncodedDataset.from_df(df, attrs)
+
+
+def random_rows(seed, num_rows, sizes):
+    """
+    :param sizes: number of distinct values of every attribute
+    :return: list of rows with values 'v0', 'v1', ... drawn uniformly at random
+    """
+    rand = np.random.RandomState(seed)
+    return [['v%d' % rand.randint(size) for size in sizes] for _ in range(num_rows)]
+
+
+def compile_dc(dc, attrs):
+    return ConstraintPlan.compile(DenialConstraint(dc, attrs))
+
+
+def component_value(comp, rows):
+    """
+    :param rows: tuple name -> row (dict attribute -> value)
+    """
+    if isinstance(comp, str):
+        return comp.strip("'")
+    return rows[comp[0]][comp[1]]
+
+
+def holds(predicates, rows):
+    return all(operations[p.operation](*[component_value(comp, rows) for comp in p.components])
+               for p in predicates)
+
+
+def violating_tuples(c, rows):
+    """
+    :param rows: list of rows (dict attribute -> value)
+    :return: sorted positions of the tuples t1 for which some t2 (possibly t1 itself)
+    satisfies all the predicates of <c>.
+    """
+    names = c.tuple_names
+    result = []
+    for i, t1 in enumerate(rows):
+        if len(names) == 1:
+            if holds(c.predicates, {names[0]: t1}):
+                result.append(i)
+        elif any(holds(c.predicates, {names[0]: t1, names[1]: t2}) for t2 in rows):
+            result.append(i)
+    return result
@@ -0,0 +1,82 @@
+import unittest
+
+from bruteforce import make_enc, random_rows, compile_dc, violating_tuples
+from dcparser.analysis import prune_constraints
+from detect.partition import PartitionCache, plan_constraint, violations_df
+
+ATTRS = ['a', 'b', 'c']
+
+CONSTRAINTS = [
+    't1&t2&EQ(t1.a,t2.a)&IQ(t1.b,t2.b)',
+    # swapped tuples of a symmetric constraint
+    't1&t2&EQ(t2.a,t1.a)&IQ(t2.b,t1.b)',
+    # implied by the first one but flags the cells of c: kept
+    't1&t2&EQ(t1.a,t2.a)&IQ(t1.b,t2.b)&EQ(t1.c,t2.c)',
+    # implied by the first one, which flags all its cells
+    "t1&t2&EQ(t1.a,t2.a)&IQ(t1.b,t2.b)&EQ(t1.b,'v1')",
+    # asymmetric twins: t1 and t2 flag different cells
+    't1&t2&EQ(t1.c,t2.c)&LT(t1.b,t2.b)',
+    't1&t2&EQ(t1.c,t2.c)&GT(t1.b,t2.b)',
+    't1&t2&EQ(t1.c,t2.c)&LT(t2.b,t1.b)',
+    "t1&EQ(t1.a,'v0')",
+    "t1&EQ(t1.a,'v0')&EQ(t1.c,'v1')",
+    "t1&EQ(t1.a,'v0')&IQ(t1.a,'v1')",
+]
+
+
+def flagged_cells(dcs, rows):
+    """
+    :return: brute-force set of (tid, attribute) cells reported by the constraints.
+    """
+    return set((tid, attr) for _, c in dcs for tid in violating_tuples(c, rows) for attr in c.components)
+
+
+def detected_cells(dcs, enc):
+    """
+    :return: set of (tid, attribute) cells detected in memory by the constraints that can be
+    evaluated by partitioning.
+    """
+    partitions = PartitionCache(enc)
+    cells = set()
+    for _, c in dcs:
+        plan = plan_constraint(c)
+        if plan is not None:
+            df = violations_df(enc, plan, c.components, partitions)
+            cells.update(zip(df['_tid_'].tolist(), df['attribute'].tolist()))
+    return cells
+
+
+class PruneConstraintsTest(unittest.TestCase):
+
+    def compile(self):
+        return [(dc, compile_dc(dc, ATTRS)) for dc in CONSTRAINTS]
+
+    def test_pruned(self):
+        dcs = self.compile()
+        kept, removed, queries_saved = prune_constraints(dcs)
+        self.assertEqual(kept, [CONSTRAINTS[idx] for idx in [0, 2, 4, 5, 7, 8]])
+        self.assertEqual(dict(removed), {CONSTRAINTS[1]: CONSTRAINTS[0], CONSTRAINTS[3]: CONSTRAINTS[0],
+                                         CONSTRAINTS[6]: CONSTRAINTS[5], CONSTRAINTS[9]: CONSTRAINTS[7]})
+        self.assertGreater(queries_saved, 0)
+        plans = dict(dcs)
+        self.assertEqual(plans[CONSTRAINTS[0]].components, ['a', 'b'])
+        self.assertEqual(plans[CONSTRAINTS[7]].components, ['a'])
+
+    def test_same_cells(self):
+        # Pruning does not change the detected cells.
+        for seed in range(5):
+            rows = random_rows(seed, 25, [4, 4, 3])
+            dicts = [dict(zip(ATTRS, row)) for row in rows]
+            enc = make_enc(rows, ATTRS)
+            dcs = self.compile()
+            expected = flagged_cells(dcs, dicts)
+            expected_detected = detected_cells(dcs, enc)
+            kept, _, _ = prune_constraints(dcs)
+            pruned = [(key, c) for key, c in dcs if key in kept]
+            self.assertEqual(flagged_cells(pruned, dicts), expected, seed)
+            self.assertEqual(detected_cells(pruned, enc), expected_detected, seed)
+            self.assertGreater(len(expected_detected), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
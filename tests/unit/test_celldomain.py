@@ -0,0 +1,101 @@
+import unittest
+
+import numpy as np
+
+from bruteforce import make_enc, random_rows
+from domain.celldomain import CellDomain, gather_segments
+
+ATTRS = ['a', 'b', 'c']
+
+
+def random_domains(enc, attrs, tids, seed):
+    """
+    :return: dict (tid, attr) -> (list of candidate codes, init index) for a random subset
+    of the cells of <tids>.
+    """
+    rand = np.random.RandomState(seed)
+    domains = {}
+    for tid in tids:
+        for attr in attrs:
+            if rand.rand() < 0.3:
+                continue
+            size = enc.domain_size(attr)
+            codes = rand.permutation(size)[:rand.randint(1, size+1)].tolist()
+            domains[(tid, attr)] = (codes, rand.randint(len(codes)))
+    return domains
+
+
+def make_shard(domains, attrs):
+    """
+    :return: shard of from_shard with the cells of every attribute in decreasing _tid_ order.
+    """
+    shard = []
+    for attr in attrs:
+        cells = sorted([tid for tid, cell_attr in domains if cell_attr == attr], reverse=True)
+        if not cells:
+            continue
+        sizes = [len(domains[(tid, attr)][0]) for tid in cells]
+        codes = [code for tid in cells for code in domains[(tid, attr)][0]]
+        shard.append((attr, np.array(cells), np.concatenate([[0], np.cumsum(sizes)]), np.array(codes),
+                      np.array([domains[(tid, attr)][1] for tid in cells]), np.zeros(len(cells), dtype=np.int64)))
+    return shard
+
+
+class CellDomainTest(unittest.TestCase):
+
+    def setUp(self):
+        self.enc = make_enc(random_rows(2, 20, [6, 4, 5]), ATTRS)
+        self.domains = random_domains(self.enc, ATTRS, range(20), 3)
+        # Cells in (tuple, attribute) order, i.e. the order of the _vid_.
+        self.cells = sorted(self.domains, key=lambda cell: (cell[0], ATTRS.index(cell[1])))
+
+    def check(self, dom):
+        self.assertEqual(dom.num_vars(), len(self.cells))
+        self.assertEqual(dom.tids.tolist(), [tid for tid, _ in self.cells])
+        self.assertEqual([dom.attrs[idx] for idx in dom.attr_idx], [attr for _, attr in self.cells])
+        for vid, cell in enumerate(self.cells):
+            self.assertEqual(dom.get_domain(vid).tolist(), self.domains[cell][0])
+        self.assertEqual(dom.domain_sizes().tolist(), [len(self.domains[cell][0]) for cell in self.cells])
+        self.assertEqual(dom.init_codes().tolist(),
+                         [self.domains[cell][0][self.domains[cell][1]] for cell in self.cells])
+        for attr in ATTRS:
+            entries = [(vid, pos, code) for vid, cell in enumerate(self.cells) if cell[1] == attr
+                       for pos, code in enumerate(self.domains[cell][0])]
+            vids, pos, codes = dom.get_attr_entries(attr)
+            self.assertEqual(list(zip(vids.tolist(), pos.tolist(), codes.tolist())), entries)
+            self.assertEqual(dom.get_attr_vars(attr).tolist(),
+                             [vid for vid, cell in enumerate(self.cells) if cell[1] == attr])
+        values = dom.decode_entries(self.enc)
+        self.assertEqual(values.tolist(), [self.enc.get_values(attr)[code] for tid, attr in self.cells
+                                           for code in self.domains[(tid, attr)][0]])
+
+    def test_from_shard(self):
+        self.check(CellDomain.from_shard(make_shard(self.domains, ATTRS[::-1]), ATTRS))
+
+    def test_extend(self):
+        # Shards of consecutive tuples are appended in order.
+        dom = CellDomain(ATTRS)
+        for start in range(0, 20, 7):
+            part = dict((cell, d) for cell, d in self.domains.items() if start <= cell[0] < start+7)
+            dom.extend(CellDomain.from_shard(make_shard(part, ATTRS), ATTRS))
+        dom.finalize()
+        self.check(dom)
+
+    def test_missing_attribute(self):
+        dom = CellDomain.from_shard(make_shard(self.domains, ATTRS), ATTRS)
+        vids, pos, codes = dom.get_attr_entries('d')
+        self.assertEqual((len(vids), len(pos), len(codes)), (0, 0, 0))
+        self.assertEqual(len(dom.get_attr_vars('d')), 0)
+
+    def test_gather_segments(self):
+        segments = [[1, 2], [], [3], [4, 5, 6]]
+        offsets = np.concatenate([[0], np.cumsum([len(s) for s in segments])])
+        values = np.array([v for s in segments for v in s])
+        order = np.array([3, 0, 2, 1])
+        new_offsets, new_values = gather_segments(offsets, values, order)
+        self.assertEqual(new_values.tolist(), [v for idx in order for v in segments[idx]])
+        self.assertEqual(np.diff(new_offsets).tolist(), [len(segments[idx]) for idx in order])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from bruteforce import random_rows
+from dataset.encoding import EncodedDataset
+
+ATTRS = ['a', 'b']
+
+
+def make_df(rows, start):
+    """
+    :return: (dataframe with null cells filled in as by the Dataset, null mask)
+    """
+    df = pd.DataFrame(rows, columns=ATTRS)
+    df.insert(0, '_tid_', range(start, start+len(df)))
+    null_mask = df[ATTRS].isnull().values
+    return df.fillna('_nan_'), null_mask
+
+
+class EncodedDatasetTest(unittest.TestCase):
+
+    def setUp(self):
+        self.rows = random_rows(5, 60, [6, 40])
+        # some null cells
+        for idx in range(0, 60, 9):
+            self.rows[idx][1] = None
+        df, null_mask = make_df(self.rows, 0)
+        self.full = EncodedDataset.from_df(df, ATTRS, null_mask)
+
+    def extended(self):
+        df, null_mask = make_df(self.rows[:15], 0)
+        enc = EncodedDataset.from_df(df, ATTRS, null_mask)
+        for start in range(15, 60, 8):
+            prev = dict((attr, enc.decode(attr).copy()) for attr in ATTRS)
+            codes = dict((attr, enc.get_codes(attr)[:start].copy()) for attr in ATTRS)
+            enc.extend(*make_df(self.rows[start:start+8], start))
+            for attr in ATTRS:
+                # Codes handed out before stay valid.
+                self.assertEqual(enc.get_codes(attr)[:start].tolist(), codes[attr].tolist())
+                self.assertEqual(enc.decode(attr)[:start].tolist(), prev[attr].tolist())
+        return enc
+
+    def test_extend(self):
+        enc = self.extended()
+        self.assertFalse(enc.sorted)
+        self.assertEqual(enc.num_tuples, 60)
+        self.assertEqual(enc.tids.tolist(), self.full.tids.tolist())
+        self.assertEqual(enc.null_tids.tolist(), self.full.null_tids.tolist())
+        self.assertEqual(enc.null_attr_idx.tolist(), self.full.null_attr_idx.tolist())
+        for attr in ATTRS:
+            self.assertEqual(enc.decode(attr).tolist(), self.full.decode(attr).tolist())
+            for code, val in enumerate(enc.get_values(attr)):
+                self.assertEqual(enc.encode(attr, val), code)
+
+    def test_sort(self):
+        enc = self.extended()
+        old_codes = dict((attr, enc.get_codes(attr).copy()) for attr in ATTRS)
+        ranks = enc.sort()
+        self.assertTrue(enc.sorted)
+        self.assertIn('b', ranks)
+        for attr in ATTRS:
+            self.assertEqual(enc.get_codes(attr).tolist(), self.full.get_codes(attr).tolist())
+            self.assertEqual(enc.get_values(attr).tolist(), self.full.get_values(attr).tolist())
+            if attr in ranks:
+                self.assertEqual(ranks[attr][old_codes[attr]].tolist(), enc.get_codes(attr).tolist())
+        self.assertEqual(enc.sort(), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
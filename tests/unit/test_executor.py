@@ -0,0 +1,35 @@
+import unittest
+
+from dataset.executor import Executor
+
+
+def scale(ctx, item):
+    return ctx['factor']*item
+
+
+class ExecutorTest(unittest.TestCase):
+
+    def test_imap_context(self):
+        for processes in [1, 3]:
+            executor = Executor(processes)
+            try:
+                ctx = {'factor': 3}
+                self.assertEqual(list(executor.imap_context(scale, ctx, range(20))), [3*i for i in range(20)])
+                # A second job with another context is not served the context of the first one.
+                ctx = {'factor': 5}
+                self.assertEqual(list(executor.imap_context(scale, ctx, range(20))), [5*i for i in range(20)])
+            finally:
+                executor.close()
+
+    def test_start(self):
+        executor = Executor(2)
+        executor.start()
+        pool = executor.pool
+        self.assertIsNotNone(pool)
+        self.assertIs(executor.get_pool(), pool)
+        executor.close()
+        self.assertIsNone(executor.pool)
+
+
+if __name__ == '__main__':
+    unittest.main()
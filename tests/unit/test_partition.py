@@ -0,0 +1,72 @@
+import unittest
+
+from bruteforce import make_enc, random_rows, compile_dc, violating_tuples
+import detect.partition as partition
+from detect.partition import PartitionCache, plan_constraint, find_violations, violations_df
+
+ATTRS = ['a', 'b', 'c', 'd']
+
+CONSTRAINTS = [
+    't1&t2&EQ(t1.a,t2.a)',
+    't1&t2&EQ(t1.a,t2.a)&IQ(t1.b,t2.b)',
+    't1&t2&EQ(t1.a,t2.a)&EQ(t1.c,t2.c)&IQ(t1.b,t2.b)',
+    't1&t2&EQ(t1.a,t2.a)&IQ(t1.b,t2.b)&IQ(t1.c,t2.c)',
+    't1&t2&EQ(t1.a,t2.a)&IQ(t1.b,t2.b)&IQ(t1.c,t2.c)&IQ(t1.d,t2.d)',
+    't1&t2&IQ(t1.b,t2.b)&IQ(t1.c,t2.c)',
+    "t1&t2&EQ(t1.a,t2.a)&EQ(t1.d,'v0')&IQ(t1.b,t2.b)",
+    "t1&t2&EQ(t1.a,t2.a)&IQ(t2.d,'v1')&IQ(t1.b,t2.b)",
+    "t1&t2&EQ(t1.a,t2.a)&EQ(t1.c,'v1')&EQ(t2.c,'v2')",
+    "t1&EQ(t1.a,'v0')&IQ(t1.b,'v1')",
+    "t1&t2&EQ(t1.a,t2.a)&EQ(t1.b,'missing')",
+]
+
+
+class PartitionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.rows = random_rows(0, 40, [10, 4, 4, 3])
+        self.enc = make_enc(self.rows, ATTRS)
+        self.dicts = [dict(zip(ATTRS, row)) for row in self.rows]
+
+    def check(self, partitions=None):
+        for dc in CONSTRAINTS:
+            c = compile_dc(dc, ATTRS)
+            plan = plan_constraint(c)
+            self.assertIsNotNone(plan, dc)
+            found = find_violations(self.enc, plan, partitions)
+            self.assertEqual(sorted(found.tolist()), violating_tuples(c, self.dicts), dc)
+
+    def test_find_violations(self):
+        self.check()
+
+    def test_shared_partitions(self):
+        self.check(PartitionCache(self.enc))
+
+    def test_pair_chunks(self):
+        # Several residuals check the pairs of every group in chunks.
+        chunksize = partition.PAIR_CHUNKSIZE
+        partition.PAIR_CHUNKSIZE = 7
+        try:
+            self.check()
+        finally:
+            partition.PAIR_CHUNKSIZE = chunksize
+
+    def test_violations_df(self):
+        c = compile_dc('t1&t2&EQ(t1.a,t2.a)&IQ(t1.b,t2.b)', ATTRS)
+        df = violations_df(self.enc, plan_constraint(c), c.components)
+        expected = set((tid, attr) for tid in violating_tuples(c, self.dicts) for attr in ['a', 'b'])
+        self.assertEqual(set(zip(df['_tid_'].tolist(), df['attribute'].tolist())), expected)
+        self.assertEqual(len(df), len(expected))
+
+    def test_unsupported(self):
+        for dc in ['t1&t2&EQ(t1.a,t2.a)&LT(t1.b,t2.b)', 't1&t2&EQ(t1.a,t2.a)&IQ(t1.b,t2.c)']:
+            self.assertIsNone(plan_constraint(compile_dc(dc, ATTRS)), dc)
+
+    def test_empty(self):
+        enc = make_enc([], ATTRS)
+        plan = plan_constraint(compile_dc(CONSTRAINTS[1], ATTRS))
+        self.assertEqual(len(find_violations(enc, plan)), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+import unittest
+
+from dataset.dbengine import QueryPlanner
+
+QUERY = 'SELECT count(*) FROM t'
+BACKUP = 'SELECT 1 FROM t'
+
+
+class QueryPlannerTest(unittest.TestCase):
+
+    def choices(self, planner, runs=200):
+        return set(planner.get_choice(QUERY, BACKUP) for _ in range(runs))
+
+    def test_backup_only_after_timeout(self):
+        planner = QueryPlanner(seed=0)
+        self.assertEqual(self.choices(planner), {'query'})
+        planner.record(QUERY, BACKUP, ('backup', 0.1, False))
+        self.assertEqual(self.choices(planner), {'query'})
+        planner.record(QUERY, BACKUP, ('backup', 0.1, True))
+        # The query is retried now and then.
+        self.assertEqual(self.choices(planner), {'query', 'backup'})
+        planner.explore = 0
+        self.assertEqual(self.choices(planner), {'backup'})
+        planner.record(QUERY, BACKUP, ('query', 2.0, False))
+        self.assertEqual(self.choices(planner), {'query'})
+
+    def test_lossy(self):
+        planner = QueryPlanner(lossy=True, seed=0)
+        self.assertEqual(self.choices(planner), {None})
+        planner.record(QUERY, BACKUP, ('query', 2.0, False))
+        # The backup is tried although it has no runtime yet.
+        self.assertEqual(self.choices(planner), {'query', 'backup'})
+        planner.record(QUERY, BACKUP, ('backup', 0.5, False))
+        planner.explore = 0
+        self.assertEqual(self.choices(planner), {'backup'})
+
+    def test_no_backup(self):
+        planner = QueryPlanner(lossy=True, seed=0)
+        self.assertEqual(planner.get_choice(QUERY, ''), 'query')
+        planner.record(QUERY, '', ('query', 1.0, False))
+        self.assertEqual(planner.plans, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
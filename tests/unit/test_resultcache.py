@@ -0,0 +1,87 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from dataset.resultcache import ResultCache, table_references
+
+
+class ResultCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_table_references(self):
+        query = "SELECT t1.city FROM hospital AS t1, pos_values t2 LEFT JOIN cell_domain AS t3 " \
+                "ON t2._vid_ = t3._vid_ WHERE t1.city = 'from dk_cells' AND EXISTS " \
+                "(SELECT 1 FROM public.dk_cells AS t4 WHERE t4._tid_ = t1._tid_)"
+        self.assertEqual(table_references(query), {'hospital', 'pos_values', 'cell_domain', 'dk_cells'})
+
+    def test_column_named_like_table(self):
+        cache = ResultCache()
+        cache.set_version('hospital', 'v1')
+        cache.set_version('city', 'v1')
+        query = 'SELECT city FROM hospital'
+        self.assertEqual(cache.get_tables(query), ['hospital'])
+        cache.put(query, [('a',)])
+        # Rewriting a table the query does not read keeps its result.
+        cache.set_version('city', 'v2')
+        self.assertEqual(cache.get(query), (True, [('a',)]))
+        cache.set_version('hospital', 'v2')
+        self.assertEqual(cache.get(query), (False, None))
+
+    def test_unversioned_table(self):
+        cache = ResultCache()
+        cache.set_version('hospital', 'v1')
+        query = 'SELECT t1.city FROM hospital AS t1, clean AS t2 WHERE t1._tid_ = t2._tid_'
+        self.assertEqual(cache.get_key(query), (None, None))
+        cache.put(query, [('a',)])
+        self.assertEqual(cache.get(query), (False, None))
+        self.assertIsNone(cache.query_token(query))
+        cache.set_version('clean', 'v1')
+        self.assertEqual(cache.get_tables(query), ['clean', 'hospital'])
+
+    def test_stream(self):
+        cache = ResultCache(max_rows=5)
+        cache.set_version('hospital', 'v1')
+        query = 'SELECT _vid_, attribute FROM hospital'
+        cache.put(query, [(1, 'a'), (2, 'b')], columns=['_vid_', 'attribute'])
+        self.assertEqual(cache.get(query, stream=True), (True, (('_vid_', 'attribute'), [(1, 'a'), (2, 'b')])))
+        # Streamed results do not answer the plain query.
+        self.assertEqual(cache.get(query), (False, None))
+        self.assertEqual(cache.rows, 2)
+
+    def test_disk_tier(self):
+        cache = ResultCache(path=self.path)
+        cache.set_version('hospital', 'v1')
+        cache.put('SELECT a FROM hospital', [(1,), (2,)])
+        # A new session finds the result on disk.
+        cache = ResultCache(path=self.path)
+        cache.set_version('hospital', 'v1')
+        self.assertEqual(cache.get('SELECT a FROM hospital'), (True, [(1,), (2,)]))
+
+    def test_disk_bound(self):
+        cache = ResultCache(path=self.path)
+        cache.set_version('hospital', 'v1')
+        queries = ['SELECT a%d FROM hospital' % idx for idx in range(10)]
+        for idx, query in enumerate(queries):
+            cache.put(query, [(idx, 'x'*100)]*20)
+            os.utime(cache._file(cache.get_key(query)[0]), (idx, idx))
+        size = cache.disk_bytes // 10
+        cache = ResultCache(path=self.path, max_disk_bytes=5*size)
+        cache.set_version('hospital', 'v1')
+        # Reading the first result from disk makes it the most recently used one.
+        self.assertTrue(cache.get(queries[0])[0])
+        cache.put('SELECT b FROM hospital', [(0, 'x'*100)]*20)
+        self.assertLessEqual(cache.disk_bytes, 5*size)
+        self.assertLessEqual(len(os.listdir(self.path)), 5)
+        on_disk = [os.path.exists(cache._file(cache.get_key(query)[0])) for query in queries]
+        self.assertTrue(on_disk[0])
+        self.assertEqual(on_disk[1:6], [False]*5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+import unittest
+from collections import Counter
+
+import pandas as pd
+
+from bruteforce import make_enc, random_rows
+from dataset.stats import StatsEngine
+
+ATTRS = ['a', 'b', 'c']
+
+
+class StatsEngineTest(unittest.TestCase):
+
+    def setUp(self):
+        self.rows = random_rows(4, 50, [5, 3, 6])
+        self.enc = make_enc(self.rows, ATTRS)
+        self.stats = StatsEngine(self.enc)
+        self.stats.collect()
+
+    def values(self, attr):
+        return [row[ATTRS.index(attr)] for row in self.rows]
+
+    def pairs(self, cond_attr, trg_attr):
+        return Counter(zip(self.values(cond_attr), self.values(trg_attr)))
+
+    def test_single_counts(self):
+        for attr in ATTRS:
+            expected = Counter(self.values(attr))
+            for val in expected:
+                self.assertEqual(self.stats.count(attr, self.enc.encode(attr, val)), expected[val])
+            self.assertEqual(self.stats.count(attr, self.enc.encode(attr, 'missing')), 0)
+
+    def test_pair_counts(self):
+        # Both orientations, the second one being the transpose of the first.
+        for cond_attr in ATTRS:
+            for trg_attr in ATTRS:
+                if cond_attr == trg_attr:
+                    continue
+                expected = self.pairs(cond_attr, trg_attr)
+                for x in self.enc.get_values(cond_attr):
+                    for y in self.enc.get_values(trg_attr):
+                        self.assertEqual(self.stats.count_pair(cond_attr, self.enc.encode(cond_attr, x),
+                                                               trg_attr, self.enc.encode(trg_attr, y)),
+                                         expected[(x, y)])
+
+    def test_cond_counts(self):
+        expected = self.pairs('a', 'c')
+        for x in self.enc.get_values('a'):
+            codes, counts = self.stats.cond_counts('a', self.enc.encode('a', x), 'c')
+            found = dict(zip(self.enc.get_values('c')[codes], counts.tolist()))
+            self.assertEqual(found, dict((y, cnt) for (x2, y), cnt in expected.items() if x2 == x))
+            top = self.stats.topk('a', self.enc.encode('a', x), 'c', 2)
+            best = sorted(found.values(), reverse=True)[:2]
+            self.assertEqual([found[y] for y in self.enc.get_values('c')[top]], best)
+
+    def test_cond_candidates(self):
+        threshold = 0.3
+        expected = self.pairs('a', 'b')
+        single = Counter(self.values('a'))
+        cands = self.stats.cond_candidates('a', 'b', threshold)
+        for x in self.enc.get_values('a'):
+            row = cands.getrow(self.enc.encode('a', x))
+            found = set(self.enc.get_values('b')[row.indices])
+            self.assertEqual(found, set(y for (x2, y), cnt in expected.items()
+                                        if x2 == x and cnt > threshold*single[x]))
+
+    def test_update(self):
+        # Counts updated batch by batch (and renumbered once sorted) match the counts of the whole data.
+        enc = make_enc(self.rows[:20], ATTRS)
+        stats = StatsEngine(enc)
+        stats.collect()
+        stats.pair_counts('a', 'c')
+        stats.pair_counts('c', 'b')
+        for start in range(20, 50, 7):
+            df = pd.DataFrame(self.rows[start:start+7], columns=ATTRS)
+            df.insert(0, '_tid_', range(start, start+len(df)))
+            enc.extend(df)
+            stats.update(start)
+            self.check(enc, stats)
+        stats.remap(enc.sort())
+        self.check(enc, stats)
+
+    def check(self, enc, stats):
+        fresh = StatsEngine(enc)
+        for attr in ATTRS:
+            self.assertEqual(stats.single_counts(attr).tolist(), fresh.single_counts(attr).tolist())
+        for cond_attr, trg_attr in [('a', 'c'), ('c', 'b')]:
+            self.assertEqual((stats.pair_counts(cond_attr, trg_attr) !=
+                              fresh.pair_counts(cond_attr, trg_attr)).nnz, 0)
+            for x in range(enc.domain_size(cond_attr)):
+                for y in range(enc.domain_size(trg_attr)):
+                    self.assertEqual(stats.count_pair(cond_attr, x, trg_attr, y),
+                                     fresh.count_pair(cond_attr, x, trg_attr, y))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+import unittest
+
+import numpy as np
+
+from bruteforce import make_enc, random_rows, compile_dc, component_value, holds, operations
+from domain.celldomain import CellDomain
+from repair.featurize.violationcount import ViolationCounter
+
+CONSTRAINTS = [
+    't1&t2&EQ(t1.a,t2.a)&IQ(t1.b,t2.b)',
+    't1&t2&EQ(t1.a,t2.a)&EQ(t1.c,t2.c)&IQ(t1.b,t2.b)',
+    't1&t2&EQ(t1.a,t2.a)&EQ(t1.b,t2.b)',
+    "t1&t2&EQ(t1.a,t2.a)&EQ(t1.c,'v1')&IQ(t1.b,t2.b)",
+    "t1&t2&EQ(t1.a,t2.a)&IQ(t2.c,'v0')&IQ(t1.b,t2.b)",
+    "t1&EQ(t1.a,'v0')&IQ(t1.b,'v1')",
+]
+
+
+def make_domain(enc, attrs):
+    """
+    :return: CellDomain where every cell of <attrs> takes all the values of its attribute.
+    """
+    shard = []
+    for attr in attrs:
+        n, size = enc.num_tuples, enc.domain_size(attr)
+        rows = np.arange(n)
+        offsets = np.arange(n+1)*size
+        codes = np.tile(np.arange(size), n)
+        init_index = enc.get_codes(attr).astype(np.int64)
+        shard.append((attr, rows, offsets, codes, init_index, np.zeros(n, dtype=np.int64)))
+    return CellDomain.from_shard(shard, sorted(attrs))
+
+
+def relaxed_counts(c, predicate, rel, rows, enc, domain):
+    """
+    :return: brute-force violations of every (variable, candidate value) entry of the relaxed
+    constraint: the number of tuples t2 != t satisfying the other predicates with t, while
+    the candidate value of t satisfies the relaxed predicate.
+    """
+    orig_preds = [p for p in c.predicates if p is not predicate]
+    other = [name for name in c.tuple_names if name != rel]
+    counts = []
+    for vid, code in zip(domain.entry_vids(), domain.codes):
+        tid, attr = domain.tids[vid], domain.attrs[domain.attr_idx[vid]]
+        value = enc.get_values(attr)[code]
+        count = 0
+        for t2 in ([tid] if not other else range(len(rows))):
+            if other and t2 == tid:
+                continue
+            assignment = {rel: rows[tid]}
+            if other:
+                assignment[other[0]] = rows[t2]
+            const = component_value(predicate.components[1], assignment).lower()
+            if holds(orig_preds, assignment) and operations[predicate.operation](value, const):
+                count += 1
+        counts.append(count)
+    return np.array(counts)
+
+
+class ViolationCounterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.attrs = ['a', 'b', 'c']
+        self.enc = make_enc([['x', '1', 'p'],
+                             ['x', '2', 'p'],
+                             ['x', '1', 'q'],
+                             ['y', '3', 'p'],
+                             ['y', '3', 'q']], self.attrs)
+
+    def test_inactive_attribute(self):
+        # 'a' has no random variables: relaxing it yields no features instead of failing.
+        domain = make_domain(self.enc, ['b'])
+        counter = ViolationCounter(self.enc, domain)
+        c = compile_dc('t1&t2&EQ(t1.a,t2.a)&IQ(t1.b,t2.b)', self.attrs)
+        self.assertTrue(counter.supports(c, c.predicates[0], 't1'))
+        vids, pos, counts = counter.count(c, c.predicates[0], 't1')
+        self.assertEqual(len(vids), 0)
+        self.assertEqual(len(pos), 0)
+        self.assertEqual(len(counts), 0)
+        self.assertEqual(len(domain.get_attr_vars('a')), 0)
+
+    def test_counts(self):
+        attrs = ['a', 'b', 'c']
+        rows = random_rows(1, 30, [5, 3, 3])
+        enc = make_enc(rows, attrs)
+        dicts = [dict(zip(attrs, row)) for row in rows]
+        domain = make_domain(enc, attrs)
+        counter = ViolationCounter(enc, domain)
+        checked = 0
+        for dc in CONSTRAINTS:
+            c = compile_dc(dc, attrs)
+            for predicate in c.predicates:
+                for rel in c.tuple_names:
+                    if not counter.supports(c, predicate, rel):
+                        continue
+                    vids, pos, counts = counter.count(c, predicate, rel)
+                    attr = predicate.attrs[0]
+                    keep = domain.attr_idx[domain.entry_vids()] == domain.attrs.index(attr)
+                    expected = relaxed_counts(c, predicate, rel, dicts, enc, domain)[keep]
+                    self.assertEqual(vids.tolist(), domain.entry_vids()[keep].tolist())
+                    self.assertEqual(pos.tolist(), domain.entry_pos()[keep].tolist())
+                    self.assertEqual(counts.tolist(), expected.tolist(), (dc, predicate.cnf_form, rel))
+                    checked += 1
+        self.assertGreater(checked, 10)
+
+
+if __name__ == '__main__':
+    unittest.main()